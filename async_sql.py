@@ -0,0 +1,433 @@
+import asyncio
+import logging
+import queue
+import sqlite3
+import threading
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, List, Literal, Optional, Tuple, Union
+
+from queries import QUERIES, QueryRegistry
+from sql import ConnectionPool, DEFAULT_DB_FILE
+
+"""
+An asyncio counterpart to SqlWrapper, for frontends that must not block their event loop on the database.
+
+The work runs on dedicated connection threads, each holding one connection from a ConnectionPool for its lifetime:
+reader threads take requests from a shared read queue, and one writer thread runs every write, so writes never
+compete for SQLite's single write lock. A reader thread that takes a request also takes the reads queued behind it
+(up to batch_size) and runs them in one read transaction, answering the whole batch with one wake-up of the event
+loop; identical reads in a batch are run once.
+
+Every call takes a timeout (or the wrapper's default). When a call times out or its task is cancelled, a request that
+has not started is dropped and one that is running is stopped with the connection's interrupt().
+
+iterate() streams a large result set in chunks on a connection of its own, fetching the next chunk only when the
+consumer has room for it, so the rows are never all held in memory.
+
+Usage:
+sql = AsyncSqlWrapper("database", readers=4)
+profile = await sql.select_named("shopper_profile", (shopper_id,), fetch="one", timeout=1.0)
+async with sql.transaction() as transaction:
+    await transaction.execute_named("create_order", (shopper_id, order_date))
+async for rows in sql.iterate("SELECT * FROM ordered_products", chunk_size=1000):
+    ...
+await sql.close()
+"""
+
+logger = logging.getLogger("parana.sql")
+
+Fetch = Literal['all', 'many', 'one']
+
+
+def fetch_rows(cursor: sqlite3.Cursor, fetch: Fetch, num_fetch: int) -> Any:
+    if fetch == "all":
+        return cursor.fetchall()
+    if fetch == "many":
+        return cursor.fetchmany(num_fetch)
+    return cursor.fetchone()
+
+
+class _Request:
+    """
+    One piece of work for a connection thread, answered through an asyncio future
+    """
+    __slots__ = ("work", "key", "future", "loop", "db", "cancelled")
+
+    def __init__(self, work: Callable[[sqlite3.Connection], Any], key: Optional[tuple] = None) -> None:
+        self.work = work
+        # Requests with the same key in one batch are run once, None for requests that must always run
+        self.key = key
+        self.future: Optional[asyncio.Future] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        # The connection running the request, while it runs
+        self.db: Optional[sqlite3.Connection] = None
+        self.cancelled = False
+
+
+def _resolve(answers: List[Tuple[_Request, Any, Optional[BaseException]]]) -> None:
+    # Runs on the event loop. A future is already done if its caller timed out or was cancelled.
+    for request, result, error in answers:
+        if not request.future.done():
+            if error is not None:
+                request.future.set_exception(error)
+            else:
+                request.future.set_result(result)
+
+
+class AsyncTransaction:
+    """
+    The statements of one transaction, run in order on the writer thread
+    """
+    def __init__(self, wrapper: "AsyncSqlWrapper") -> None:
+        self._wrapper = wrapper
+        self.lastrowid: Optional[int] = None
+
+    async def execute(self, sql_query: str, sql_parameters: tuple = tuple(), timeout: Optional[float] = None,
+                      query_name: Optional[str] = None) -> int:
+        """
+        Run a statement, raising any database error, returning the number of rows it changed
+        """
+        rowcount, self.lastrowid = await self._wrapper._write(
+            lambda db: self._wrapper._run(db, sql_query, sql_parameters, lambda cursor: (cursor.rowcount, cursor.lastrowid),
+                                          query_name),
+            timeout)
+        return rowcount
+
+    async def execute_named(self, query_name: str, sql_parameters: tuple = tuple(), timeout: Optional[float] = None) -> int:
+        """
+        Run a statement from the query registry by name, see execute
+        """
+        return await self.execute(self._wrapper.queries[query_name].sql, sql_parameters, timeout, query_name)
+
+    async def select_query(self, sql_query: str, sql_parameters: tuple = tuple(), fetch: Fetch = "all", num_fetch: int = 1,
+                           timeout: Optional[float] = None, query_name: Optional[str] = None) -> Any:
+        """
+        Run a SELECT inside the transaction, so it sees the transaction's own changes
+        """
+        return await self._wrapper._write(
+            lambda db: self._wrapper._run(db, sql_query, sql_parameters, lambda cursor: fetch_rows(cursor, fetch, num_fetch),
+                                          query_name),
+            timeout)
+
+    async def select_named(self, query_name: str, sql_parameters: tuple = tuple(), fetch: Fetch = "all", num_fetch: int = 1,
+                           timeout: Optional[float] = None) -> Any:
+        return await self.select_query(self._wrapper.queries[query_name].sql, sql_parameters, fetch, num_fetch, timeout,
+                                       query_name)
+
+
+class AsyncSqlWrapper:
+    """
+    Awaitable SELECT/INSERT/UPDATE/DELETE and transactions on dedicated connection threads, see the module docstring
+    """
+    def __init__(self, db_file: str = DEFAULT_DB_FILE, readers: int = 4, streams: int = 2, batch_size: int = 32,
+                 timeout: Optional[float] = None, queries: QueryRegistry = QUERIES, **pool_options) -> None:
+        """
+        Args:
+            db_file: Path to the database file
+            readers: The number of reader threads (and connections)
+            streams: The most iterate() calls streaming at once, each has a connection of its own
+            batch_size: The most queued reads a reader thread runs in one transaction, 1 turns batching off
+            timeout: Seconds a call may take before it is interrupted, None waits forever. Each call can override it.
+            queries: The registry of named queries
+            pool_options: Extra ConnectionPool settings, e.g. journal_mode, busy_timeout, cache_size
+        """
+        if readers < 1:
+            raise ValueError("readers must be at least 1")
+        self.db_file = db_file
+        self.queries = queries
+        self.batch_size = max(1, batch_size)
+        self.timeout = timeout
+        self.pool = ConnectionPool(db_file, pool_size=readers + 1 + streams, **pool_options)
+        self._reads: "queue.Queue[Optional[_Request]]" = queue.Queue()
+        self._writes: "queue.Queue[Optional[_Request]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._write_lock: Optional[asyncio.Lock] = None
+        self._closed = False
+        self._reads_run = 0
+        self._reads_shared = 0
+        self._batches = 0
+        self._interrupts = 0
+        self._threads = [threading.Thread(target=self._serve, args=(self._reads, self.batch_size),
+                                          name=f"parana-async-reader-{index}", daemon=True)
+                         for index in range(readers)]
+        self._threads.append(threading.Thread(target=self._serve, args=(self._writes, 1),
+                                              name="parana-async-writer", daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def __str__(self):
+        return f"Async SQL Database wrapper for: {self.db_file}"
+
+    # Connection threads
+
+    def _serve(self, requests: "queue.Queue[Optional[_Request]]", batch_size: int) -> None:
+        db = self.pool.acquire()
+        try:
+            while True:
+                request = requests.get()
+                if request is None:
+                    return
+                batch = [request]
+                while len(batch) < batch_size:
+                    try:
+                        request = requests.get_nowait()
+                    except queue.Empty:
+                        break
+                    if request is None:
+                        # Leave the stop marker for the next get, after this batch is answered
+                        requests.put(None)
+                        break
+                    batch.append(request)
+                if requests is self._reads:
+                    with self._lock:
+                        self._batches += 1
+                        self._reads_run += len(batch)
+                self._run_batch(db, batch)
+        finally:
+            self.pool.release(db)
+
+    def _run_batch(self, db: sqlite3.Connection, batch: List[_Request]) -> None:
+        answers = []
+        shared: Dict[tuple, Tuple[Any, Optional[BaseException]]] = {}
+        # One read transaction for the batch: one snapshot, and the shared lock is taken once
+        in_batch_transaction = len(batch) > 1 and not db.in_transaction
+        if in_batch_transaction:
+            db.execute("BEGIN DEFERRED")
+        try:
+            for request in batch:
+                if request.cancelled:
+                    continue
+                # Any error goes to the caller, as one escaping would end the thread and strand the queued requests
+                try:
+                    answers.append((request, *self._run_request(db, request, shared)))
+                except Exception as e:
+                    answers.append((request, None, e))
+        finally:
+            if in_batch_transaction and db.in_transaction:
+                db.commit()
+        # Answer each event loop once for the whole batch
+        by_loop: Dict[asyncio.AbstractEventLoop, list] = {}
+        for answer in answers:
+            by_loop.setdefault(answer[0].loop, []).append(answer)
+        for loop, loop_answers in by_loop.items():
+            try:
+                loop.call_soon_threadsafe(_resolve, loop_answers)
+            except RuntimeError:
+                pass  # The loop has been closed, nobody is waiting for the answers
+
+    def _run_request(self, db: sqlite3.Connection, request: _Request,
+                     shared: Dict[tuple, Tuple[Any, Optional[BaseException]]]) -> Tuple[Any, Optional[BaseException]]:
+        key = request.key
+        if key is not None:
+            try:
+                hash(key)
+            except TypeError:
+                # Parameters that cannot be hashed (e.g. a list) are not compared with the other reads
+                key = None
+        if key is not None and key in shared:
+            result, error = shared[key]
+            with self._lock:
+                self._reads_shared += 1
+            # Each caller gets its own list of rows, so one changing it does not change what the others see
+            return (list(result) if isinstance(result, list) else result), error
+        with self._lock:
+            request.db = db
+        try:
+            result, error = request.work(db), None
+        except Exception as e:
+            result, error = None, e
+        finally:
+            with self._lock:
+                request.db = None
+        if key is not None:
+            shared[key] = (result, error)
+        return result, error
+
+    def _run(self, db: sqlite3.Connection, sql_query: str, sql_parameters: tuple,
+             result: Callable[[sqlite3.Cursor], Any], query_name: Optional[str] = None) -> Any:
+        if not isinstance(sql_parameters, tuple):
+            sql_parameters = (sql_parameters,)
+        cached = db.statement_cache.touch(sql_query)
+        if query_name is not None:
+            self.queries.record(query_name, cached)
+        cursor = db.execute(sql_query, sql_parameters)
+        try:
+            return result(cursor)
+        finally:
+            cursor.close()
+
+    def _interrupt(self, request: _Request) -> None:
+        """
+        Drop a request that has not started, or interrupt it if it is running
+        """
+        with self._lock:
+            request.cancelled = True
+            if request.db is not None:
+                request.db.interrupt()
+                self._interrupts += 1
+
+    # Event loop side
+
+    async def _submit(self, requests: "queue.Queue[Optional[_Request]]", request: _Request, timeout: Optional[float]) -> Any:
+        if self._closed:
+            raise sqlite3.ProgrammingError("Cannot operate on a closed database.")
+        request.loop = asyncio.get_running_loop()
+        request.future = request.loop.create_future()
+        requests.put(request)
+        try:
+            return await asyncio.wait_for(request.future, self.timeout if timeout is None else timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            self._interrupt(request)
+            raise
+
+    async def _read(self, work: Callable[[sqlite3.Connection], Any], key: Optional[tuple], timeout: Optional[float]) -> Any:
+        return await self._submit(self._reads, _Request(work, key), timeout)
+
+    async def _write(self, work: Callable[[sqlite3.Connection], Any], timeout: Optional[float] = None) -> Any:
+        return await self._submit(self._writes, _Request(work), timeout)
+
+    def _locked(self) -> asyncio.Lock:
+        # Created on first use, so it belongs to the running event loop
+        if self._write_lock is None:
+            self._write_lock = asyncio.Lock()
+        return self._write_lock
+
+    async def select_query(self, sql_query: str, sql_parameters: tuple = tuple(), fetch: Fetch = "all", num_fetch: int = 1,
+                           timeout: Optional[float] = None, query_name: Optional[str] = None) -> Any:
+        """
+        Run a SELECT on a reader thread, see SqlWrapper.select_query
+
+        Args:
+            timeout: Seconds before the query is interrupted and TimeoutError is raised, defaults to the wrapper's timeout
+        """
+        if not isinstance(sql_parameters, tuple):
+            sql_parameters = (sql_parameters,)
+        return await self._read(lambda db: self._run(db, sql_query, sql_parameters,
+                                                     lambda cursor: fetch_rows(cursor, fetch, num_fetch), query_name),
+                                (sql_query, sql_parameters, fetch, num_fetch), timeout)
+
+    async def select_named(self, query_name: str, sql_parameters: tuple = tuple(), fetch: Fetch = "all", num_fetch: int = 1,
+                           timeout: Optional[float] = None) -> Any:
+        """
+        Run a SELECT query from the query registry by name, see select_query
+        """
+        return await self.select_query(self.queries[query_name].sql, sql_parameters, fetch, num_fetch, timeout, query_name)
+
+    async def update_table(self, sql_query: str, sql_parameters: tuple = tuple(), timeout: Optional[float] = None,
+                           query_name: Optional[str] = None) -> Union[None, Exception]:
+        """
+        Run an INSERT/UPDATE/DELETE on the writer thread and commit it. Use transaction() for several statements.
+
+        Returns the error if the query fails (it is rolled back), otherwise None, as SqlWrapper.update_table does
+        """
+        def update(db: sqlite3.Connection) -> Union[None, Exception]:
+            try:
+                self._run(db, sql_query, sql_parameters, lambda cursor: None, query_name)
+            except sqlite3.IntegrityError as e:
+                db.rollback()
+                return e
+            except sqlite3.Error as e:
+                db.rollback()
+                logger.error("Database Error! %s running: %s", e, query_name or sql_query)
+                return e
+            db.commit()
+
+        async with self._locked():
+            return await self._write(update, timeout)
+
+    async def update_named(self, query_name: str, sql_parameters: tuple = tuple(),
+                           timeout: Optional[float] = None) -> Union[None, Exception]:
+        """
+        Run an INSERT/UPDATE/DELETE query from the query registry by name, see update_table
+        """
+        return await self.update_table(self.queries[query_name].sql, sql_parameters, timeout, query_name)
+
+    @asynccontextmanager
+    async def transaction(self, mode: Literal['DEFERRED', 'IMMEDIATE', 'EXCLUSIVE'] = "IMMEDIATE") -> AsyncIterator[AsyncTransaction]:
+        """
+        Run an async with block as one transaction on the writer thread. It is committed if the block completes and
+        rolled back if it raises (or is cancelled). Other writes wait until it ends, so use the methods of the
+        AsyncTransaction inside the block, not update_table.
+        """
+        async with self._locked():
+            await self._write(lambda db: db.execute(f"BEGIN {mode}"))
+            try:
+                yield AsyncTransaction(self)
+            except BaseException:
+                # Shielded, so a cancelled block still rolls back before the write lock is released
+                await asyncio.shield(self._write(lambda db: db.rollback()))
+                raise
+            await self._write(lambda db: db.commit())
+
+    async def iterate(self, sql_query: str, sql_parameters: tuple = tuple(), chunk_size: int = 1000) -> AsyncIterator[List[tuple]]:
+        """
+        Yield the rows of a SELECT in lists of up to chunk_size rows. The next chunk is fetched while the current one
+        is used, and no further ahead. Leaving the loop early interrupts the query.
+        """
+        if not isinstance(sql_parameters, tuple):
+            sql_parameters = (sql_parameters,)
+        loop = asyncio.get_running_loop()
+        chunks: asyncio.Queue = asyncio.Queue(maxsize=1)
+        request = _Request(lambda db: None)
+
+        def put(item: Any) -> None:
+            asyncio.run_coroutine_threadsafe(chunks.put(item), loop).result()
+
+        def stream() -> None:
+            try:
+                with self.pool.connection() as db:
+                    with self._lock:
+                        request.db = db
+                    cursor = db.cursor()
+                    try:
+                        cursor.execute(sql_query, sql_parameters)
+                        while not request.cancelled:
+                            rows = cursor.fetchmany(chunk_size)
+                            put(rows)
+                            if not rows:
+                                break
+                    finally:
+                        with self._lock:
+                            request.db = None
+                        cursor.close()
+            except Exception as e:
+                if not request.cancelled:
+                    put(e)
+
+        threading.Thread(target=stream, name="parana-async-stream", daemon=True).start()
+        try:
+            while True:
+                rows = await chunks.get()
+                if isinstance(rows, Exception):
+                    raise rows
+                if not rows:
+                    return
+                yield rows
+        finally:
+            self._interrupt(request)
+            # Make room for a chunk the thread may be waiting to put, so it sees it was cancelled and ends
+            while not chunks.empty():
+                chunks.get_nowait()
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        """
+        Return the batching and interrupt counts and the connection pool statistics
+        """
+        with self._lock:
+            stats = {"reads_run": self._reads_run, "reads_shared": self._reads_shared, "batches": self._batches,
+                     "mean_batch_size": self._reads_run / self._batches if self._batches else 0.0,
+                     "interrupts": self._interrupts}
+        return {**stats, **self.pool.stats()}
+
+    async def close(self) -> None:
+        """
+        Finish the queued requests, then stop the connection threads and close the connections
+        """
+        if self._closed:
+            return
+        self._closed = True
+        for thread in self._threads[:-1]:
+            self._reads.put(None)
+        self._writes.put(None)
+        await asyncio.get_running_loop().run_in_executor(None, lambda: [thread.join() for thread in self._threads])
+        self.pool.close()
@@ -0,0 +1,346 @@
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, TextIO
+
+from models import BasketItem, BasketSummary
+from sql import SqlWrapper, DEFAULT_DB_FILE
+
+"""
+Write-behind buffer for a shoppers basket.
+
+Without a buffer every add, quantity change and removal is its own committed transaction. BasketBuffer keeps the
+changes in memory instead, as the line each product should end up as (or None once it is removed), so repeated edits
+to the same line are combined into one. The (basket_id, product_id) primary key is checked against the buffered
+basket, so adding a product twice fails straight away as it would in the database.
+
+The pending lines are written in one transaction, by comparing them with the lines in the database:
+- at checkout, in the same transaction that places the order (flush_with)
+- once the oldest pending change is FLUSH_INTERVAL seconds old. A background timer flushes them when the SqlWrapper is
+  pooled; a plain SqlWrapper can only be used on the thread that opened it, so the flush then happens on the next change.
+- when the ShopperService is closed
+
+Durability, what a crash of the session loses:
+memory   The changes made since the last flush
+journal  Nothing. Each change is appended to a journal file before it is acknowledged and the journal is replayed when
+         the basket is next opened (or by recover). A power failure can still lose the changes the OS had not written.
+fsync    Nothing, even on power failure. Each change is fsynced to the journal, which still costs less than a commit.
+
+A journal is kept per basket in journal_directory(db_file), and removed once its basket has been flushed. Replaying a
+journal writes the lines it ends with, so replaying it again, or after the flush it records, changes nothing.
+
+Usage:
+python basket_buffer.py [--database PATH]  -> flush the journals left by sessions that did not close
+"""
+
+DURABILITY_LEVELS = ("memory", "journal", "fsync")
+FLUSH_INTERVAL = 30.0
+
+logger = logging.getLogger("parana.basket_buffer")
+
+
+def journal_directory(db_file: str) -> str:
+    """
+    The directory the basket journals of a database are kept in
+    """
+    return db_file + "-baskets"
+
+
+def journal_path(directory: str, basket_id: int) -> str:
+    return os.path.join(directory, f"basket-{basket_id}.jsonl")
+
+
+def journal_line(product_id: int, item: Optional[BasketItem]) -> str:
+    return json.dumps({"product_id": product_id, "item": list(item) if item is not None else None}) + "\n"
+
+
+def read_journal(path: str) -> Dict[int, Optional[BasketItem]]:
+    """
+    Replay a journal, returning the line each product ends up as (None if removed). A line cut short by a crash is
+    ignored, as its change was never acknowledged.
+    """
+    pending = {}
+    with open(path) as journal:
+        for line in journal:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                break
+            pending[entry["product_id"]] = BasketItem(*entry["item"]) if entry["item"] is not None else None
+    return pending
+
+
+def write_lines(sql: SqlWrapper, basket_id: int, pending: Dict[int, Optional[BasketItem]]) -> int:
+    """
+    Make the lines of the basket in the database match pending, returning the number of statements run.
+    Must be run inside a transaction.
+    """
+    current = {row[0]: row for row in sql.execute_named("basket_lines", sql_parameters=(basket_id,))}
+    statements = 0
+    for product_id, item in pending.items():
+        row = current.get(product_id)
+        if item is None:
+            if row is not None:
+                sql.execute_named("remove_basket_item", sql_parameters=(basket_id, product_id))
+                statements += 1
+            continue
+        if row is not None and (row[1], row[3]) == (item.seller_id, item.price):
+            if row[2] != item.quantity:
+                sql.execute_named("change_basket_quantity", sql_parameters=(item.quantity, basket_id, product_id))
+                statements += 1
+            continue
+        if row is not None:
+            # Now from another seller, or at another price
+            sql.execute_named("remove_basket_item", sql_parameters=(basket_id, product_id))
+            statements += 1
+        sql.execute_named("add_basket_item", sql_parameters=(basket_id, product_id, item.seller_id, item.quantity, item.price))
+        statements += 1
+    return statements
+
+
+class BasketBuffer:
+    """
+    Pending changes to one basket, see the module docstring. Safe to use from the session and the flush timer threads.
+    """
+
+    def __init__(self, sql: SqlWrapper, basket_id: int, durability: str = "journal", flush_interval: float = FLUSH_INTERVAL,
+                 journal_dir: Optional[str] = None) -> None:
+        """
+        Args:
+            sql: The database
+            basket_id: The basket to buffer, changes left in its journal by an earlier session are picked up
+            durability: One of DURABILITY_LEVELS
+            flush_interval: Seconds a change can wait to be written. None only flushes on checkout and close
+            journal_dir: Where the journals are kept, defaults to journal_directory(sql.db_file)
+        """
+        if durability not in DURABILITY_LEVELS:
+            raise ValueError(f"durability must be one of {', '.join(DURABILITY_LEVELS)}")
+        self.sql = sql
+        self.durability = durability
+        self.flush_interval = flush_interval
+        self.journal_dir = journal_dir if journal_dir is not None else journal_directory(sql.db_file)
+        self.lock = threading.RLock()
+        self.changes = self.flushes = self.statements = 0
+        self._journal: Optional[TextIO] = None
+        self._timer: Optional[threading.Timer] = None
+        self._pending_since: Optional[float] = None
+        self._load(basket_id)
+
+    def _load(self, basket_id: int) -> None:
+        self.basket_id = basket_id
+        self._base = {item.product_id: item
+                      for item in map(BasketItem._make, self.sql.select_named("basket_contents", sql_parameters=(basket_id,)))}
+        self._pending: Dict[int, Optional[BasketItem]] = {}
+        if self.durability != "memory" and os.path.exists(self._journal_path()):
+            self._pending = read_journal(self._journal_path())
+            # The journal may end with a line cut short by the crash, which later changes must not be appended to
+            self._rewrite_journal()
+            if self._pending:
+                logger.info("Recovered %d line(s) of basket %d from its journal", len(self._pending), basket_id)
+                self._pending_since = time.monotonic()
+                self._start_timer()
+
+    def _rewrite_journal(self) -> None:
+        """
+        Replace the journal with one complete line for each pending product
+        """
+        path = self._journal_path()
+        if not self._pending:
+            os.remove(path)
+            return
+        with open(path + ".tmp", "w") as journal:
+            journal.writelines(journal_line(product_id, item) for product_id, item in self._pending.items())
+            journal.flush()
+            if self.durability == "fsync":
+                os.fsync(journal.fileno())
+        os.replace(path + ".tmp", path)
+
+    def _journal_path(self) -> str:
+        return journal_path(self.journal_dir, self.basket_id)
+
+    def items(self) -> List[BasketItem]:
+        """
+        The lines of the basket, including the changes not yet written
+        """
+        with self.lock:
+            lines = dict(self._base)
+            for product_id, item in self._pending.items():
+                if item is None:
+                    lines.pop(product_id, None)
+                else:
+                    lines[product_id] = item
+            return list(lines.values())
+
+    def summary(self) -> BasketSummary:
+        items = self.items()
+        return BasketSummary(len(items), sum(item.total for item in items))
+
+    @property
+    def pending(self) -> int:
+        """
+        The number of lines waiting to be written
+        """
+        return len(self._pending)
+
+    def add(self, item: BasketItem) -> None:
+        """
+        Add a line to the basket, raising sqlite3.IntegrityError if the product is already in it
+        """
+        with self.lock:
+            if any(line.product_id == item.product_id for line in self.items()):
+                raise sqlite3.IntegrityError("UNIQUE constraint failed: basket_contents.basket_id, basket_contents.product_id")
+            self._change(item.product_id, item)
+
+    def change_quantity(self, product_id: int, quantity: int) -> None:
+        """
+        Change the quantity of a line in the basket, nothing is changed if the product is not in it
+        """
+        with self.lock:
+            item = next((line for line in self.items() if line.product_id == product_id), None)
+            if item is not None:
+                self._change(product_id, item._replace(quantity=quantity))
+
+    def remove(self, product_id: int) -> None:
+        """
+        Remove a line from the basket
+        """
+        with self.lock:
+            self._change(product_id, None)
+
+    def _change(self, product_id: int, item: Optional[BasketItem]) -> None:
+        if self.durability != "memory":
+            self._append(product_id, item)
+        self._pending[product_id] = item
+        self.changes += 1
+        if self._pending_since is None:
+            self._pending_since = time.monotonic()
+            self._start_timer()
+        elif self.flush_interval is not None and time.monotonic() - self._pending_since >= self.flush_interval:
+            self._flush_due()
+
+    def _append(self, product_id: int, item: Optional[BasketItem]) -> None:
+        if self._journal is None:
+            os.makedirs(self.journal_dir, exist_ok=True)
+            self._journal = open(self._journal_path(), "a")
+        self._journal.write(journal_line(product_id, item))
+        self._journal.flush()
+        if self.durability == "fsync":
+            os.fsync(self._journal.fileno())
+
+    def _start_timer(self) -> None:
+        if self.flush_interval is None or self.sql.pool is None:
+            return
+        self._timer = threading.Timer(self.flush_interval, self._flush_due)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _flush_due(self) -> None:
+        try:
+            self.flush()
+        except sqlite3.Error as e:
+            # The change that was made is kept pending, the flush is tried again at the next change, checkout or close
+            logger.error("Flushing basket %d failed: %s", self.basket_id, e)
+
+    def flush(self) -> int:
+        """
+        Write the pending lines in one transaction, returning the number of statements run
+        """
+        with self.lock:
+            if not self._pending:
+                self._clear()
+                return 0
+            statements = self.statements
+            self.flush_with(lambda: None)
+            return self.statements - statements
+
+    def flush_with(self, func: Callable[[], Any]) -> Any:
+        """
+        Write the pending lines and call func in the same transaction, returning what func returns. The lines stay
+        pending if the transaction fails.
+        """
+        with self.lock:
+            pending = dict(self._pending)
+
+            def transaction() -> tuple:
+                return write_lines(self.sql, self.basket_id, pending) if pending else 0, func()
+
+            statements, result = self.sql.run_in_transaction(transaction)
+            if pending:
+                self.statements += statements
+                self._base = {item.product_id: item for item in self.items()}
+                self._pending = {}
+                self.flushes += 1
+            self._clear()
+            return result
+
+    def _clear(self) -> None:
+        self._pending_since = None
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        if os.path.exists(self._journal_path()):
+            os.remove(self._journal_path())
+
+    def move_to(self, basket_id: int) -> None:
+        """
+        Buffer another basket, once everything pending has been flushed (e.g. by checkout)
+        """
+        with self.lock:
+            if self._pending:
+                raise RuntimeError(f"Basket {self.basket_id} has changes that have not been written")
+            self._clear()
+            self._load(basket_id)
+
+    def close(self) -> None:
+        """
+        Flush the pending lines and stop the timer
+        """
+        with self.lock:
+            self.flush()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        changes buffered, flushes and statements written. changes - statements is the writes saved by combining changes.
+        """
+        return {"changes": self.changes, "pending": self.pending, "flushes": self.flushes, "statements": self.statements}
+
+
+def recover(sql: SqlWrapper, journal_dir: Optional[str] = None) -> Dict[int, int]:
+    """
+    Flush the journals left in journal_dir by sessions that did not close, returning the statements run for each basket.
+    Journals of baskets that no longer exist (checked out or expired) are removed. Only run while no session is
+    buffering those baskets.
+    """
+    journal_dir = journal_dir if journal_dir is not None else journal_directory(sql.db_file)
+    if not os.path.isdir(journal_dir):
+        return {}
+    recovered = {}
+    for name in sorted(os.listdir(journal_dir)):
+        if not (name.startswith("basket-") and name.endswith(".jsonl")):
+            continue
+        basket_id = int(name[len("basket-"):-len(".jsonl")])
+        path = os.path.join(journal_dir, name)
+        if sql.select_query("SELECT 1 FROM shopper_baskets WHERE basket_id = ?", sql_parameters=(basket_id,), fetch="one"):
+            pending = read_journal(path)
+            recovered[basket_id] = sql.run_in_transaction(lambda: write_lines(sql, basket_id, pending))
+        os.remove(path)
+    return recovered
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Flush the basket journals left by sessions that did not close")
+    parser.add_argument("--database", default=DEFAULT_DB_FILE, help="Path to the database file")
+    parser.add_argument("--journal-dir", default=None, help="Where the journals are kept, defaults to <database>-baskets")
+    args = parser.parse_args()
+
+    sql = SqlWrapper(args.database)
+    for basket_id, statements in recover(sql, args.journal_dir).items():
+        print(f"Basket {basket_id}: {statements} statement(s) written")
+    sql.close()
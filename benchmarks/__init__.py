@@ -0,0 +1,3 @@
+"""
+Benchmarks for the Parana shopper session. Run them from the project root, e.g. python -m benchmarks.query_count
+"""
@@ -0,0 +1,131 @@
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+from async_sql import AsyncSqlWrapper
+from benchmarks.datagen import SCALES
+from benchmarks.scaling import prepare_database
+from sql import SqlWrapper, DEFAULT_DB_FILE
+
+"""
+Compares the read throughput of SqlWrapper and AsyncSqlWrapper under concurrent load.
+
+Every client runs the same mix of small named reads (a shopper profile, the offers of a product, a basket) one after
+another, as a shopper session does:
+
+threads         SqlWrapper pooled, one thread per client
+executor        asyncio tasks running SqlWrapper calls on a thread pool (as server.py does)
+async           asyncio tasks on AsyncSqlWrapper, batching queued reads
+async_unbatched AsyncSqlWrapper with batch_size=1
+
+Usage:
+python -m benchmarks.async_sql [--scale small] [--clients 1 8 64] [--reads 5000] [--connections 4] [--data-dir DIR]
+"""
+
+
+def workload(sql: SqlWrapper, reads: int, seed: int) -> List[Tuple[str, tuple]]:
+    """
+    The (query name, parameters) of reads, drawn from the shoppers, products and baskets in the database
+    """
+    rng = random.Random(seed)
+    shoppers = [shopper_id for shopper_id, in sql.select_query("SELECT shopper_id FROM shoppers")]
+    products = [product_id for product_id, in sql.select_query("SELECT product_id FROM products")]
+    baskets = [basket_id for basket_id, in sql.select_query("SELECT basket_id FROM shopper_baskets")] or [0]
+    choices = (lambda: ("shopper_profile", (rng.choice(shoppers),)),
+               lambda: ("product_offers", (rng.choice(products),)),
+               lambda: ("basket_contents", (rng.choice(baskets),)))
+    return [rng.choice(choices)() for _ in range(reads)]
+
+
+def split(reads: List[Tuple[str, tuple]], clients: int) -> List[List[Tuple[str, tuple]]]:
+    return [reads[client::clients] for client in range(clients)]
+
+
+def run_threads(db_file: str, reads: List[Tuple[str, tuple]], clients: int, connections: int) -> float:
+    sql = SqlWrapper(db_file, pool_size=connections)
+
+    def client(client_reads: List[Tuple[str, tuple]]) -> None:
+        for query_name, parameters in client_reads:
+            sql.select_named(query_name, parameters)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        list(executor.map(client, split(reads, clients)))
+    seconds = time.perf_counter() - start
+    sql.close()
+    return seconds
+
+
+async def run_executor(db_file: str, reads: List[Tuple[str, tuple]], clients: int, connections: int) -> float:
+    sql = SqlWrapper(db_file, pool_size=connections)
+    executor = ThreadPoolExecutor(max_workers=connections)
+    loop = asyncio.get_running_loop()
+
+    async def client(client_reads: List[Tuple[str, tuple]]) -> None:
+        for query_name, parameters in client_reads:
+            await loop.run_in_executor(executor, sql.select_named, query_name, parameters)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(client_reads) for client_reads in split(reads, clients)))
+    seconds = time.perf_counter() - start
+    executor.shutdown()
+    sql.close()
+    return seconds
+
+
+async def run_async(db_file: str, reads: List[Tuple[str, tuple]], clients: int, connections: int, batch_size: int) -> float:
+    sql = AsyncSqlWrapper(db_file, readers=connections, batch_size=batch_size)
+
+    async def client(client_reads: List[Tuple[str, tuple]]) -> None:
+        for query_name, parameters in client_reads:
+            await sql.select_named(query_name, parameters)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(client_reads) for client_reads in split(reads, clients)))
+    seconds = time.perf_counter() - start
+    await sql.close()
+    return seconds
+
+
+def run(db_file: str, client_counts: List[int], reads: int, connections: int, seed: int = 417) -> Dict[int, Dict[str, float]]:
+    sql = SqlWrapper(db_file)
+    planned = workload(sql, reads, seed)
+    sql.close()
+    results = {}
+    for clients in client_counts:
+        timings = {"threads": run_threads(db_file, planned, clients, connections),
+                   "executor": asyncio.run(run_executor(db_file, planned, clients, connections)),
+                   "async": asyncio.run(run_async(db_file, planned, clients, connections, 32)),
+                   "async_unbatched": asyncio.run(run_async(db_file, planned, clients, connections, 1))}
+        results[clients] = {method: reads / seconds for method, seconds in timings.items()}
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare SqlWrapper and AsyncSqlWrapper read throughput under concurrent load")
+    parser.add_argument("--database", default=DEFAULT_DB_FILE, help="Database to copy the schema and existing rows from")
+    parser.add_argument("--scale", choices=SCALES, default="small", help="Scale of the generated database")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 8, 64], help="Concurrent clients")
+    parser.add_argument("--reads", type=int, default=5000, help="Reads made by all the clients together")
+    parser.add_argument("--connections", type=int, default=4, help="Database connections (and threads) of each wrapper")
+    parser.add_argument("--seed", type=int, default=417, help="Random seed for the data and the workload")
+    parser.add_argument("--data-dir", default=None, help="Keep the generated database here and reuse it")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file, _ = prepare_database(args.scale, args.seed, args.database, args.data_dir or tmp)
+        # The wrappers switch the database to WAL mode, so they run on a copy
+        copy = os.path.join(tmp, "benchmark.db")
+        shutil.copyfile(db_file, copy)
+        results = run(copy, args.clients, args.reads, args.connections, args.seed)
+
+    methods = ("threads", "executor", "async", "async_unbatched")
+    print(f"{'Clients':>8}" + "".join(f"{method:>18}" for method in methods) + "   (reads/s)")
+    for clients, throughput in results.items():
+        print(f"{clients:>8}" + "".join(f"{throughput[method]:>18,.0f}" for method in methods))
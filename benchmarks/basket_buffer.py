@@ -0,0 +1,121 @@
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+from basket_buffer import DURABILITY_LEVELS
+from migrations import migrate
+from shopper import ShopperService
+from sql import SqlWrapper, DEFAULT_DB_FILE
+
+"""
+Times basket editing with and without a BasketBuffer (basket_buffer.py).
+
+--sessions shoppers each make --edits basket changes (adds, quantity changes and removals), and one in --checkout-every
+checks out, as most baskets are abandoned. Run with every change committed, then with the buffer at each durability
+level. Every run uses a fresh copy of the database.
+
+What a crashed session keeps is tested in tests/test_basket_buffer.py.
+
+Usage:
+python -m benchmarks.basket_buffer [--database PATH] [--sessions 20] [--edits 30] [--checkout-every 5]
+"""
+
+Edit = Tuple  # ("add", product_id, seller_id, quantity) / ("change", product_id, quantity) / ("remove", product_id)
+
+
+def offers(sql: SqlWrapper) -> List[Tuple[int, int]]:
+    return sql.select_query("SELECT product_id, MIN(seller_id) FROM product_sellers GROUP BY product_id")
+
+
+def script(rng: random.Random, product_offers: List[Tuple[int, int]], edits: int) -> List[Edit]:
+    """
+    A list of basket changes that are all valid when made in order
+    """
+    basket, changes = set(), []
+    while len(changes) < edits:
+        product_id, seller_id = rng.choice(product_offers)
+        if product_id not in basket:
+            basket.add(product_id)
+            changes.append(("add", product_id, seller_id, rng.randint(1, 3)))
+        elif rng.random() < 0.8:
+            changes.append(("change", product_id, rng.randint(1, 9)))
+        else:
+            basket.remove(product_id)
+            changes.append(("remove", product_id))
+    return changes
+
+
+def apply(shopper: ShopperService, edit: Edit) -> None:
+    if edit[0] == "add":
+        shopper.add_item(*edit[1:])
+    elif edit[0] == "change":
+        shopper.change_quantity(*edit[1:])
+    else:
+        shopper.remove_item(*edit[1:])
+
+
+def fresh_copy(db_file: str, tmp: str) -> str:
+    copy = os.path.join(tmp, "run.db")
+    for path in (copy, copy + "-journal", copy + "-wal", copy + "-shm"):
+        if os.path.exists(path):
+            os.remove(path)
+    shutil.rmtree(copy + "-baskets", ignore_errors=True)
+    shutil.copyfile(db_file, copy)
+    return copy
+
+
+def write_load(db_file: str, durability: Optional[str], shoppers: List[int], scripts: List[List[Edit]],
+               checkout_every: int) -> Dict[str, float]:
+    """
+    Run the scripted sessions one after another, returning the time taken and the statements written
+    """
+    sql = SqlWrapper(db_file)
+    statements = changes = 0
+    start = time.perf_counter()
+    for session, (shopper_id, changes_made) in enumerate(zip(shoppers, scripts)):
+        shopper = ShopperService(sql, shopper_id, profiles=None)
+        if durability is not None:
+            shopper.enable_basket_buffer(durability, flush_interval=None)
+        for edit in changes_made:
+            apply(shopper, edit)
+        if session % checkout_every == 0 and shopper.basket():
+            shopper.checkout()
+        shopper.close()
+        changes += len(changes_made)
+        statements += shopper.basket_buffer.statements if durability is not None else len(changes_made)
+    seconds = time.perf_counter() - start
+    sql.close()
+    return {"seconds": seconds, "ms_per_change": seconds * 1000 / changes, "statements": statements}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time basket editing with and without a BasketBuffer")
+    parser.add_argument("--database", default=DEFAULT_DB_FILE, help="Database to copy")
+    parser.add_argument("--sessions", type=int, default=20, help="Shopper sessions in the write load")
+    parser.add_argument("--edits", type=int, default=30, help="Basket changes made in each session")
+    parser.add_argument("--checkout-every", type=int, default=5, help="One session in this many checks out")
+    parser.add_argument("--seed", type=int, default=417, help="Random seed for the changes")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, "database")
+        shutil.copyfile(args.database, db_file)
+        sql = SqlWrapper(db_file)
+        migrate(sql)
+        product_offers = offers(sql)
+        shopper_ids = [shopper_id for shopper_id, in sql.select_query("SELECT shopper_id FROM shoppers ORDER BY shopper_id")]
+        sql.close()
+        # One session per shopper, as a second session would carry on with the same basket
+        shoppers = shopper_ids[:args.sessions]
+        scripts = [script(rng, product_offers, args.edits) for _ in shoppers]
+
+        print(f"{'Basket writes':<16}{'Seconds':>9}{'ms/change':>11}{'Statements':>12}")
+        for durability in (None,) + DURABILITY_LEVELS:
+            result = write_load(fresh_copy(db_file, tmp), durability, shoppers, scripts, args.checkout_every)
+            print(f"{durability or 'each committed':<16}{result['seconds']:>9.2f}{result['ms_per_change']:>11.2f}"
+                  f"{result['statements']:>12,}")
@@ -0,0 +1,100 @@
+import argparse
+import csv
+import multiprocessing
+import os
+import resource
+import shutil
+import tempfile
+import time
+from typing import Dict, Iterator
+
+from benchmarks.datagen import Generator, Scale
+from bulk import TABLES, import_rows, read_rows
+from migrations import migrate
+from sql import SqlWrapper, DEFAULT_DB_FILE
+
+"""
+Times a bulk import of product_sellers rows (bulk.py) from a CSV file, and the peak memory of the process.
+
+A copy of the database is filled with synthetic products and sellers (benchmarks.datagen), then a CSV file offering
+every product from --sellers-per-product sellers is written and imported, with and without deferring the indexes.
+
+Usage:
+python -m benchmarks.bulk_import [--database PATH] [--products 1000000] [--sellers 5000] [--sellers-per-product 10]
+"""
+
+
+def offers(sql: SqlWrapper, sellers_per_product: int) -> Iterator[tuple]:
+    """
+    Yield (product_code, seller_account_ref, price) offering every product from sellers_per_product different sellers
+    """
+    seller_refs = [ref for ref, in sql.select_query("SELECT seller_account_ref FROM sellers ORDER BY seller_id")]
+    for index, (product_code,) in enumerate(sql.execute("SELECT product_code FROM products ORDER BY product_id")):
+        for offer in range(sellers_per_product):
+            yield product_code, seller_refs[(index * 7 + offer * 13) % len(seller_refs)], round(5 + (index * 31 + offer) % 995, 2)
+
+
+def peak_memory_mb() -> float:
+    """
+    The peak resident memory of this process. ru_maxrss carries over from the parent through fork and exec on Linux,
+    so VmHWM (the peak of this process image) is read where there is one.
+    """
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def time_import(db_file: str, csv_file: str, defer_indexes: bool) -> Dict[str, float]:
+    """
+    Import the CSV file, run in a fresh process so its peak memory is the import's alone
+    """
+    sql = SqlWrapper(db_file)
+    with open(csv_file, newline="") as file:
+        result = import_rows(sql, "product_sellers", read_rows(file, TABLES["product_sellers"].columns),
+                             defer_indexes=defer_indexes)
+    sql.close()
+    return {"rows": result.rows_loaded, "seconds": result.seconds, "rows_per_second": result.rows_loaded / result.seconds,
+            "peak_memory_mb": peak_memory_mb()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time a bulk import of product_sellers rows")
+    parser.add_argument("--database", default=DEFAULT_DB_FILE, help="Database to copy the schema and existing rows from")
+    parser.add_argument("--products", type=int, default=1000000, help="Synthetic products to add")
+    parser.add_argument("--sellers", type=int, default=5000, help="Synthetic sellers to add")
+    parser.add_argument("--sellers-per-product", type=int, default=10, help="Offers of each product in the CSV file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, "database")
+        shutil.copyfile(args.database, db_file)
+        sql = SqlWrapper(db_file)
+        migrate(sql)
+        Generator(sql, Scale(shoppers=0, sellers=args.sellers, categories=10, products=args.products, sellers_per_product=0,
+                             orders=0, lines_per_order=0, reviews=0)).generate()
+        csv_file = os.path.join(tmp, "product_sellers.csv")
+        start = time.perf_counter()
+        with open(csv_file, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(TABLES["product_sellers"].columns)
+            writer.writerows(offers(sql, args.sellers_per_product))
+        sql.close()
+        print(f"Wrote {os.path.getsize(csv_file) / 1024 ** 2:,.0f} MiB of CSV in {time.perf_counter() - start:.1f}s, "
+              f"peak memory {peak_memory_mb():,.0f} MiB")
+
+        print(f"{'Indexes':<10}{'Rows':>12}{'Seconds':>10}{'Rows/s':>12}{'Peak MiB':>10}")
+        for defer_indexes in (False, True):
+            # Each import starts from the generated database, so the rows are all new
+            run_file = os.path.join(tmp, "import.db")
+            shutil.copyfile(db_file, run_file)
+            with multiprocessing.get_context("spawn").Pool(1) as pool:
+                result = pool.apply(time_import, (run_file, csv_file, defer_indexes))
+            os.remove(run_file)
+            print(f"{'deferred' if defer_indexes else 'kept':<10}{result['rows']:>12,}{result['seconds']:>10.1f}"
+                  f"{result['rows_per_second']:>12,.0f}{result['peak_memory_mb']:>10,.0f}")
@@ -0,0 +1,94 @@
+import argparse
+import os
+import shutil
+import statistics
+import tempfile
+import time
+from typing import Dict
+
+from benchmarks.checkout import add_synthetic_products
+from catalog import CatalogCache
+from migrations import migrate
+from sql import SqlWrapper, DEFAULT_DB_FILE
+
+"""
+Compares cold and warm browse latency through the catalog cache.
+
+A browse walks the add_item path for the whole catalog: categories -> the products of every category -> the sellers of every product.
+Cold browses invalidate the cache first, so every lookup queries the database. Warm browses are served from the cache,
+apart from the catalog version check on each lookup. Warm (interval) browses use a cache that reads the catalog version
+at most once a second.
+
+Usage:
+python -m benchmarks.catalog_cache [--database PATH] [--products 1000] [--repeats 20]
+
+The benchmark runs against a temporary copy of the database.
+"""
+
+
+def browse(sql: SqlWrapper, catalog: CatalogCache) -> int:
+    """
+    Walk the whole catalog, returning the number of seller offers seen
+    """
+    offers = 0
+    for category in catalog.categories(sql):
+        for product in catalog.products(sql, category.category_id):
+            offers += len(catalog.offers(sql, product.product_id))
+    return offers
+
+
+def time_browses(sql: SqlWrapper, catalog: CatalogCache, repeats: int, cold: bool) -> Dict[str, float]:
+    timings = []
+    for _ in range(repeats):
+        if cold:
+            catalog.invalidate()
+        start = time.perf_counter()
+        browse(sql, catalog)
+        timings.append((time.perf_counter() - start) * 1000)
+    return {"median_ms": statistics.median(timings), "min_ms": min(timings), "max_ms": max(timings)}
+
+
+def run(db_file: str, products: int, repeats: int) -> Dict[str, Dict[str, float]]:
+    sql = SqlWrapper(db_file)
+    migrate(sql)
+    if products:
+        add_synthetic_products(sql, products)
+    catalog = CatalogCache(max_entries=products + 1024)
+    browse(sql, catalog)  # Prepare the statements, so cold browses only measure the queries
+
+    interval_catalog = CatalogCache(max_entries=products + 1024, version_check_interval=1.0)
+    browse(sql, interval_catalog)
+
+    results = {"cold": time_browses(sql, catalog, repeats, cold=True),
+               "warm": time_browses(sql, catalog, repeats, cold=False),
+               "warm (interval)": time_browses(sql, interval_catalog, repeats, cold=False)}
+
+    # A price change must be seen straight away by a warm cache
+    product_id, seller_id, price = sql.select_query("SELECT product_id, seller_id, price FROM product_sellers LIMIT 1", fetch="one")
+    sql.update_table("UPDATE product_sellers SET price = ? WHERE product_id = ? AND seller_id = ?",
+                     sql_parameters=(price + 1, product_id, seller_id))
+    assert any(offer.seller_id == seller_id and offer.price == price + 1 for offer in catalog.offers(sql, product_id)), \
+        "Price change was not picked up by the catalog cache"
+
+    results["cache"] = catalog.stats()
+    sql.close()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare cold and warm catalog browse latency")
+    parser.add_argument("--database", default=DEFAULT_DB_FILE, help="Path to the database file")
+    parser.add_argument("--products", type=int, default=1000, help="Synthetic products to add to the catalog")
+    parser.add_argument("--repeats", type=int, default=20, help="Browses timed for each of cold and warm")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, "database")
+        shutil.copyfile(args.database, db_file)
+        results = run(db_file, args.products, args.repeats)
+
+    print(f"{'Browse':<16}{'Median ms':>12}{'Min ms':>12}{'Max ms':>12}{'Speed up':>10}")
+    for name in ("cold", "warm", "warm (interval)"):
+        speed_up = results["cold"]["median_ms"] / results[name]["median_ms"]
+        print(f"{name:<16}{results[name]['median_ms']:>12.2f}{results[name]['min_ms']:>12.2f}{results[name]['max_ms']:>12.2f}{speed_up:>9.1f}x")
+    print("\nCache: " + ", ".join(f"{name} {value}" for name, value in results["cache"].items()))
@@ -0,0 +1,123 @@
+import argparse
+import datetime
+import os
+import shutil
+import statistics
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+from shopper import ShopperService
+from migrations import migrate
+from sql import SqlWrapper, DEFAULT_DB_FILE
+
+"""
+Times checkout for baskets of 1, 100 and 10,000 lines.
+
+The batched checkout (ShopperService.place_order, one BEGIN IMMEDIATE transaction with INSERT ... SELECT)
+is compared against the previous per-line checkout, which sent one INSERT per basket line through update_table.
+
+Usage:
+python -m benchmarks.checkout [--database PATH] [--sizes 1 100 10000] [--repeats 5]
+
+The benchmark runs against a temporary copy of the database, with synthetic products added so the biggest basket can be filled.
+"""
+
+SHOPPER_ID = 10000
+SELLER_ID = 200000
+CATEGORY_ID = 1
+
+
+def add_synthetic_products(sql: SqlWrapper, count: int) -> List[int]:
+    """
+    Add count products sold by SELLER_ID, returning their product IDs
+    """
+    first_id = sql.select_query("SELECT MAX(product_id) FROM products", fetch="one")[0] + 1
+    product_ids = list(range(first_id, first_id + count))
+    with sql.transaction() as db:
+        db.executemany("INSERT INTO products (product_id, category_id, product_code, product_description, product_manufacturer, product_status) "
+                       "VALUES (?, ?, ?, ?, 'Benchmark', 'Available')",
+                       [(product_id, CATEGORY_ID, f"BENCH{product_id}", f"Benchmark product {product_id}") for product_id in product_ids])
+        db.executemany("INSERT INTO product_sellers (product_id, seller_id, price) VALUES (?, ?, ?)",
+                       [(product_id, SELLER_ID, 9.99) for product_id in product_ids])
+    return product_ids
+
+
+def fill_basket(shopper: ShopperService, product_ids: List[int]) -> None:
+    """
+    Create a new basket for the shopper holding one line for each product
+    """
+    shopper.basket_id = shopper.create_basket()
+    with shopper.sql.transaction() as db:
+        db.executemany("INSERT INTO basket_contents (basket_id, product_id, seller_id, quantity, price) VALUES (?, ?, ?, 1, 9.99)",
+                       [(shopper.basket_id, product_id, SELLER_ID) for product_id in product_ids])
+
+
+def per_line_checkout(shopper: ShopperService) -> None:
+    """
+    The checkout write path before it was batched, kept as a reference point
+    """
+    sql = shopper.sql
+    basket_contents = sql.select_named("basket_contents", sql_parameters=shopper.basket_id)
+    sql.update_table("INSERT INTO shopper_orders (shopper_id, order_date, order_status) "
+                     "VALUES (?, ?, ?)", sql_parameters=(shopper.shopper_id, datetime.datetime.now().strftime("%Y-%m-%d"), "Placed"), commit=False)
+    order_id = sql.lastrowid
+    for item in basket_contents:
+        sql.update_table("INSERT INTO ordered_products (order_id, product_id, seller_id, quantity, price, ordered_product_status) "
+                         "VALUES (?, (SELECT product_id "
+                         "FROM products WHERE "
+                         "product_description = ?), (SELECT seller_id "
+                         "FROM sellers WHERE "
+                         "seller_name = ?), ?, ?, ?)",
+                         sql_parameters=(order_id, item[2], item[3], item[4], item[5], "Placed"), commit=False)
+    sql.update_table("DELETE FROM basket_contents WHERE basket_id = ?", sql_parameters=(shopper.basket_id,), commit=False)
+    sql.update_table("DELETE FROM shopper_baskets WHERE basket_id = ?", sql_parameters=(shopper.basket_id,))
+
+
+def time_checkout(shopper: ShopperService, product_ids: List[int], checkout: Callable[[ShopperService], object],
+                  repeats: int) -> Dict[str, float]:
+    """
+    Fill and check out a basket repeats times, returning the checkout timings in milliseconds
+    """
+    timings = []
+    for _ in range(repeats):
+        fill_basket(shopper, product_ids)
+        start = time.perf_counter()
+        checkout(shopper)
+        timings.append((time.perf_counter() - start) * 1000)
+    return {"median_ms": statistics.median(timings), "min_ms": min(timings), "max_ms": max(timings)}
+
+
+def run(db_file: str, sizes: List[int], repeats: int) -> List[Dict[str, float]]:
+    sql = SqlWrapper(db_file)
+    migrate(sql)
+    # The per line checkout looked products and sellers up by name, with the indexes it had then (dropped by migration 7)
+    sql.update_table("CREATE INDEX IF NOT EXISTS sellers_seller_name_idx ON sellers (seller_name)")
+    sql.update_table("CREATE INDEX IF NOT EXISTS products_product_description_idx ON products (product_description)")
+    product_ids = add_synthetic_products(sql, max(sizes))
+
+    shopper = ShopperService(sql, SHOPPER_ID)
+
+    results = []
+    for size in sizes:
+        for name, checkout in (("per_line", per_line_checkout), ("batched", ShopperService.place_order)):
+            results.append({"lines": size, "checkout": name, **time_checkout(shopper, product_ids[:size], checkout, repeats)})
+    sql.close()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time checkout for baskets of different sizes")
+    parser.add_argument("--database", default=DEFAULT_DB_FILE, help="Path to the database file")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 100, 10000], help="Basket sizes (lines) to check out")
+    parser.add_argument("--repeats", type=int, default=5, help="Checkouts timed for each basket size")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, "database")
+        shutil.copyfile(args.database, db_file)
+        results = run(db_file, args.sizes, args.repeats)
+
+    print(f"{'Lines':>8}  {'Checkout':<10}{'Median ms':>12}{'Min ms':>12}{'Max ms':>12}")
+    for result in results:
+        print(f"{result['lines']:>8}  {result['checkout']:<10}{result['median_ms']:>12.2f}{result['min_ms']:>12.2f}{result['max_ms']:>12.2f}")
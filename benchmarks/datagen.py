@@ -0,0 +1,296 @@
+import argparse
+import datetime
+import itertools
+import os
+import random
+import shutil
+import time
+from typing import Callable, Dict, Iterable, Iterator, NamedTuple, Tuple
+
+from bulk import chunked
+from migrations import migrate
+from sql import SqlWrapper, DEFAULT_DB_FILE
+
+"""
+Deterministic synthetic data for the Parana database.
+
+A generated database is a copy of the bundled database with synthetic shoppers, sellers, categories, products,
+product_sellers, shopper_orders, ordered_products and reviews appended after the existing rows.
+The same scale and seed always give the same rows, so timings from different runs can be compared.
+
+Rows are written with executemany in large chunks inside one transaction per table, with journaling and syncing
+turned off while loading. The migrations (indexes, catalog version triggers) are applied after the load,
+so the indexes are built once rather than updated for every row.
+
+Usage:
+python -m benchmarks.datagen --output PATH [--scale small] [--seed 417] [--database PATH]
+"""
+
+FIRST_ORDER_DATE = datetime.date(2019, 1, 1)
+LAST_ORDER_DATE = datetime.date(2024, 12, 31)
+ORDER_STATUSES = (("Complete", 70), ("Placed", 15), ("Incomplete", 5), ("Cancelled", 10))
+ORDERED_PRODUCT_STATUSES = {"Complete": "Delivered", "Placed": "Placed", "Incomplete": "Dispatched", "Cancelled": "Cancelled"}
+STAR_RATINGS = ("*", "**", "***", "****", "*****")
+FIRST_NAMES = ("Alice", "Ben", "Chloe", "David", "Emma", "Farid", "Grace", "Harry", "Isla", "Jack", "Kiran", "Lily",
+               "Mohammed", "Nina", "Oliver", "Priya", "Quinn", "Ruby", "Sam", "Tara")
+SURNAMES = ("Smith", "Jones", "Taylor", "Brown", "Williams", "Wilson", "Johnson", "Davies", "Patel", "Robinson",
+            "Wright", "Thompson", "Evans", "Walker", "White", "Roberts", "Green", "Hall", "Khan", "Clarke")
+ADJECTIVES = ("Black", "White", "Silver", "Compact", "Pro", "Ultra", "Mini", "Max", "Wireless", "Smart")
+NOUNS = ("Phone", "TV", "Speaker", "Laptop", "Camera", "Headphones", "Watch", "Tablet", "Monitor", "Router",
+         "Kettle", "Toaster", "Blender", "Drill", "Lamp")
+MANUFACTURERS = ("Sony", "Samsung", "LG", "Apple", "Panasonic", "Philips", "Bosch", "Dell", "Lenovo", "Acme")
+COUNTIES = ("Bedfordshire", "Wiltshire", "Kent", "Surrey", "Devon", "Yorkshire", "Lancashire", "Essex")
+COMMENTS = ("Awful", "Poor", "Okay", "Good", "Excellent")
+
+
+class Scale(NamedTuple):
+    """
+    The number of synthetic rows to add to each table
+    """
+    shoppers: int
+    sellers: int
+    categories: int
+    products: int
+    sellers_per_product: int
+    orders: int
+    lines_per_order: int
+    reviews: int
+
+
+SCALES = {
+    "tiny": Scale(shoppers=200, sellers=20, categories=10, products=500, sellers_per_product=3,
+                  orders=2000, lines_per_order=3, reviews=500),
+    "small": Scale(shoppers=2000, sellers=100, categories=25, products=5000, sellers_per_product=3,
+                   orders=20000, lines_per_order=3, reviews=5000),
+    "medium": Scale(shoppers=20000, sellers=500, categories=50, products=50000, sellers_per_product=3,
+                    orders=200000, lines_per_order=3, reviews=50000),
+    "large": Scale(shoppers=200000, sellers=2000, categories=100, products=500000, sellers_per_product=3,
+                   orders=2000000, lines_per_order=3, reviews=500000),
+    # ~10M shopper_orders and ~30M ordered_products
+    "xlarge": Scale(shoppers=1000000, sellers=5000, categories=200, products=1000000, sellers_per_product=4,
+                    orders=10000000, lines_per_order=3, reviews=2000000),
+}
+
+
+def next_id(sql: SqlWrapper, table: str, column: str) -> int:
+    """
+    The first ID after the rows already in the table
+    """
+    return (sql.select_query(f"SELECT MAX({column}) FROM {table}", fetch="one")[0] or 0) + 1
+
+
+class Generator:
+    """
+    Appends synthetic rows to a database. Every table draws from its own random stream, derived from the seed and the
+    table name, so changing the size of one table does not change the rows of the others.
+    """
+
+    def __init__(self, sql: SqlWrapper, scale: Scale, seed: int = 417,
+                 progress: Callable[[str, int, float], None] = None) -> None:
+        """
+        Args:
+            sql: The database to fill, a copy of the bundled database
+            scale: The number of rows to add to each table
+            seed: The random seed
+            progress: Called with (table, rows, seconds) after each table is loaded
+        """
+        self.sql = sql
+        self.scale = scale
+        self.seed = seed
+        self.progress = progress
+        self.first_shopper_id = next_id(sql, "shoppers", "shopper_id")
+        self.first_seller_id = next_id(sql, "sellers", "seller_id")
+        self.first_category_id = next_id(sql, "categories", "category_id")
+        self.first_product_id = next_id(sql, "products", "product_id")
+        self.first_order_id = next_id(sql, "shopper_orders", "order_id")
+        self.first_review_id = next_id(sql, "reviews", "review_id")
+
+    def rng(self, table: str) -> random.Random:
+        return random.Random(f"{self.seed}:{table}")
+
+    def generate(self) -> Dict[str, int]:
+        """
+        Load every table, returning the number of rows added to each
+        """
+        self.sql.execute("PRAGMA journal_mode=OFF")
+        self.sql.execute("PRAGMA synchronous=OFF")
+        self.sql.execute("PRAGMA cache_size=-262144")
+        # The generated keys are valid by construction, checking every foreign key would double the load time
+        self.sql.execute("PRAGMA foreign_keys=OFF")
+        try:
+            counts = {
+                "shoppers": self.load("shoppers", "INSERT INTO shoppers VALUES (?, ?, ?, ?, ?, ?, ?, ?)", self.shoppers()),
+                "sellers": self.load("sellers", "INSERT INTO sellers VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", self.sellers()),
+                "categories": self.load("categories", "INSERT INTO categories VALUES (?, ?, ?)", self.categories()),
+                "products": self.load("products", "INSERT INTO products VALUES (?, ?, ?, ?, ?, ?, ?)", self.products()),
+                "product_sellers": self.load("product_sellers", "INSERT INTO product_sellers VALUES (?, ?, ?)", self.product_sellers()),
+                "shopper_orders": self.load("shopper_orders", "INSERT INTO shopper_orders VALUES (?, ?, ?, ?)", self.shopper_orders()),
+                "ordered_products": self.load("ordered_products", "INSERT INTO ordered_products VALUES (?, ?, ?, ?, ?, ?)",
+                                              self.ordered_products()),
+                "reviews": self.load("reviews", "INSERT INTO reviews VALUES (?, ?, ?, ?, ?)", self.reviews()),
+            }
+            counts["product_reviews"] = self.load("product_reviews", "INSERT INTO product_reviews VALUES (?, ?)",
+                                                  self.product_reviews())
+            counts["seller_reviews"] = self.load("seller_reviews", "INSERT INTO seller_reviews VALUES (?, ?)",
+                                                 self.seller_reviews())
+        finally:
+            self.sql.execute("PRAGMA foreign_keys=ON")
+            self.sql.execute("PRAGMA synchronous=FULL")
+            self.sql.execute("PRAGMA journal_mode=DELETE")
+        return counts
+
+    def load(self, table: str, insert: str, rows: Iterable[tuple]) -> int:
+        """
+        Insert the rows in one transaction, CHUNK_SIZE rows per executemany
+        """
+        start = time.perf_counter()
+        count = 0
+        with self.sql.transaction() as db:
+            for chunk in chunked(rows):
+                db.executemany(insert, chunk)
+                count += len(chunk)
+        if self.progress is not None:
+            self.progress(table, count, time.perf_counter() - start)
+        return count
+
+    def shoppers(self) -> Iterator[tuple]:
+        rng = self.rng("shoppers")
+        for index in range(self.scale.shoppers):
+            shopper_id = self.first_shopper_id + index
+            first_name, surname = rng.choice(FIRST_NAMES), rng.choice(SURNAMES)
+            date_of_birth = datetime.date(1940, 1, 1) + datetime.timedelta(days=rng.randrange(25000))
+            date_joined = FIRST_ORDER_DATE - datetime.timedelta(days=rng.randrange(1500))
+            yield (shopper_id, f"SYN{shopper_id:09d}", first_name, surname,
+                   f"{first_name}.{surname}{shopper_id}@example.com".lower(), date_of_birth.isoformat(),
+                   rng.choice("MF"), date_joined.isoformat())
+
+    def sellers(self) -> Iterator[tuple]:
+        rng = self.rng("sellers")
+        for index in range(self.scale.sellers):
+            seller_id = self.first_seller_id + index
+            yield (seller_id, f"SYN{seller_id:08d}", f"{rng.choice(SURNAMES)} {rng.choice(NOUNS)}s {seller_id}",
+                   f"Unit {rng.randint(1, 99)}", f"{rng.choice(SURNAMES)} Industrial Estate", None,
+                   rng.choice(COUNTIES), f"SN{rng.randint(1, 99)} {rng.randint(1, 9)}AB", f"sales{seller_id}@example.com")
+
+    def categories(self) -> Iterator[tuple]:
+        for index in range(self.scale.categories):
+            category_id = self.first_category_id + index
+            yield category_id, f"SYN{category_id:05d}", f"{NOUNS[index % len(NOUNS)]}s and accessories {category_id}"
+
+    def products(self) -> Iterator[tuple]:
+        rng = self.rng("products")
+        for index in range(self.scale.products):
+            product_id = self.first_product_id + index
+            manufacturer = rng.choice(MANUFACTURERS)
+            yield (product_id, self.first_category_id + rng.randrange(self.scale.categories), f"SYN{product_id:010d}",
+                   f"{manufacturer} {rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {product_id}", manufacturer,
+                   f"M{rng.randrange(10**6):06d}", rng.choices(("Available", "Temporarily Unavailable", "Discontinued"), (90, 7, 3))[0])
+
+    def offer(self, product_index: int, slot: int) -> Tuple[int, float]:
+        """
+        The (seller_id, price) of one seller of a product. Worked out from the indexes rather than stored, so
+        ordered_products can pick an offer at the largest scales without holding every offer in memory.
+        """
+        stride = max(1, self.scale.sellers // self.scale.sellers_per_product)
+        seller_index = (product_index * 7919 + slot * stride) % self.scale.sellers
+        base_price = 5 + (product_index * 2654435761 % 100000) / 100
+        return self.first_seller_id + seller_index, round(base_price * (1 + slot * 0.03), 2)
+
+    def product_sellers(self) -> Iterator[tuple]:
+        for index in range(self.scale.products):
+            for slot in range(min(self.scale.sellers_per_product, self.scale.sellers)):
+                yield (self.first_product_id + index, *self.offer(index, slot))
+
+    def order_shopper_id(self, rng: random.Random) -> int:
+        # Skewed so a few shoppers have long order histories, as on a real site
+        return self.first_shopper_id + int(self.scale.shoppers * rng.random() ** 2)
+
+    def order_statuses(self) -> Iterator[str]:
+        """
+        The status of each order, from a stream of its own so ordered_products can follow it without replaying shopper_orders
+        """
+        rng = self.rng("order_statuses")
+        statuses, weights = zip(*ORDER_STATUSES)
+        cum_weights = list(itertools.accumulate(weights))
+        for _ in range(self.scale.orders):
+            yield rng.choices(statuses, cum_weights=cum_weights)[0]
+
+    def shopper_orders(self) -> Iterator[tuple]:
+        rng = self.rng("shopper_orders")
+        days = (LAST_ORDER_DATE - FIRST_ORDER_DATE).days
+        dates = [(FIRST_ORDER_DATE + datetime.timedelta(days=day)).isoformat() for day in range(days + 1)]
+        for index, status in enumerate(self.order_statuses()):
+            # Order IDs go up with the order date
+            yield self.first_order_id + index, self.order_shopper_id(rng), dates[index * days // self.scale.orders], status
+
+    def ordered_products(self) -> Iterator[tuple]:
+        rng = self.rng("ordered_products")
+        slots = min(self.scale.sellers_per_product, self.scale.sellers)
+        for index, order_status in enumerate(self.order_statuses()):
+            status = ORDERED_PRODUCT_STATUSES[order_status]
+            lines = rng.randint(1, 2 * self.scale.lines_per_order - 1)
+            for product_index in {rng.randrange(self.scale.products) for _ in range(lines)}:
+                seller_id, price = self.offer(product_index, rng.randrange(slots))
+                yield (self.first_order_id + index, self.first_product_id + product_index, seller_id,
+                       rng.randint(1, 5), price, status)
+
+    def reviews(self) -> Iterator[tuple]:
+        rng = self.rng("reviews")
+        days = (LAST_ORDER_DATE - FIRST_ORDER_DATE).days
+        for index in range(self.scale.reviews):
+            stars = rng.randrange(5)
+            review_date = FIRST_ORDER_DATE + datetime.timedelta(days=rng.randrange(days))
+            # reviews.shopper_id is a TEXT column in the schema
+            yield (self.first_review_id + index, str(self.order_shopper_id(rng)), STAR_RATINGS[stars], COMMENTS[stars],
+                   review_date.isoformat())
+
+    def product_reviews(self) -> Iterator[tuple]:
+        # Even reviews are of a product, odd reviews are of a seller
+        rng = self.rng("product_reviews")
+        for index in range(0, self.scale.reviews, 2):
+            yield self.first_review_id + index, self.first_product_id + rng.randrange(self.scale.products)
+
+    def seller_reviews(self) -> Iterator[tuple]:
+        rng = self.rng("seller_reviews")
+        for index in range(1, self.scale.reviews, 2):
+            yield self.first_review_id + index, self.first_seller_id + rng.randrange(self.scale.sellers)
+
+
+def generate(db_file: str, scale: Scale, seed: int = 417, source: str = DEFAULT_DB_FILE,
+             progress: Callable[[str, int, float], None] = None) -> Dict[str, int]:
+    """
+    Create db_file as a copy of source filled with synthetic rows, returning the number of rows added to each table
+
+    Args:
+        db_file: Path of the database to create, it is replaced if it exists
+        scale: The number of rows to add to each table, e.g. SCALES["small"]
+        seed: The random seed
+        source: The database to copy the schema and existing rows from
+        progress: Called with (table, rows, seconds) after each table is loaded
+    """
+    if os.path.exists(db_file):
+        os.remove(db_file)
+    shutil.copyfile(source, db_file)
+    sql = SqlWrapper(db_file)
+    try:
+        counts = Generator(sql, scale, seed, progress).generate()
+        migrate(sql)
+        # migrate only runs ANALYZE when it applies a migration, the source may already have been migrated
+        sql.execute("ANALYZE")
+    finally:
+        sql.close()
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create a database filled with deterministic synthetic data")
+    parser.add_argument("--output", required=True, help="Path of the database to create")
+    parser.add_argument("--scale", choices=SCALES, default="small", help="How many rows to generate")
+    parser.add_argument("--seed", type=int, default=417, help="Random seed")
+    parser.add_argument("--database", default=DEFAULT_DB_FILE, help="Database to copy the schema and existing rows from")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    generate(args.output, SCALES[args.scale], args.seed, args.database,
+             progress=lambda table, rows, seconds: print(f"{table:<18}{rows:>12,} rows{seconds:>8.1f}s{rows / max(seconds, 1e-9):>12,.0f} rows/s"))
+    print(f"Generated {args.scale} in {time.perf_counter() - start:.1f}s")
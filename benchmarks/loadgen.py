@@ -0,0 +1,184 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Tuple
+
+from sql import SqlWrapper, DEFAULT_DB_FILE
+
+"""
+Load generator for the multi-session server (server.py).
+
+Drives N simulated shoppers at once, each logging in and then repeatedly: viewing their order history, browsing
+categories -> products -> sellers, adding an item, viewing the basket and sometimes checking out.
+Reports the throughput and the p50/p99 latency of every command.
+
+Usage:
+python -m benchmarks.loadgen [--shoppers 50] [--duration 10] [--workers 8]            -> starts a server on a copy of the database
+python -m benchmarks.loadgen --connect 127.0.0.1:8417 [--shoppers 50] [--duration 10]  -> drives a server that is already running
+
+The Shopper IDs to log in with are read from --database.
+"""
+
+
+class SimulatedShopper:
+    """
+    One shopper connected to the server, recording the latency of each command
+    """
+
+    def __init__(self, address: str, shopper_id: int, latencies: Dict[str, List[float]], errors: Dict[str, int],
+                 checkout_rate: float, rng: random.Random) -> None:
+        self.address = address
+        self.shopper_id = shopper_id
+        self.latencies = latencies
+        self.errors = errors
+        self.checkout_rate = checkout_rate
+        self.rng = rng
+
+    async def connect(self) -> None:
+        if ":" in self.address:
+            host, port = self.address.rsplit(":", 1)
+            self.reader, self.writer = await asyncio.open_connection(host, int(port))
+        else:
+            self.reader, self.writer = await asyncio.open_unix_connection(self.address)
+
+    async def send(self, command: str) -> Tuple[bool, Any]:
+        """
+        Send a command, returning (ok, result)
+        """
+        name = command.split()[0]
+        start = time.perf_counter()
+        self.writer.write(command.encode("utf-8") + b"\n")
+        await self.writer.drain()
+        response = json.loads(await self.reader.readline())
+        self.latencies[name].append(time.perf_counter() - start)
+        if not response["ok"]:
+            self.errors[name] += 1
+        return response["ok"], response.get("result")
+
+    async def run(self, deadline: float) -> None:
+        await self.connect()
+        try:
+            await self.send(f"LOGIN {self.shopper_id}")
+            while time.perf_counter() < deadline:
+                await self.shop()
+            await self.send("QUIT")
+        finally:
+            self.writer.close()
+
+    async def shop(self) -> None:
+        await self.send("HISTORY")
+        ok, categories = await self.send("CATEGORIES")
+        if not ok or not categories:
+            return
+        ok, products = await self.send(f"PRODUCTS {self.rng.choice(categories)['category_id']}")
+        if not ok or not products:
+            return
+        product_id = self.rng.choice(products)["product_id"]
+        ok, offers = await self.send(f"OFFERS {product_id}")
+        if not ok or not offers:
+            return
+        quantity = self.rng.randint(1, 5)
+        ok, _ = await self.send(f"ADD {product_id} {self.rng.choice(offers)['seller_id']} {quantity}")
+        if not ok:
+            # Already in the basket
+            await self.send(f"QUANTITY {product_id} {quantity}")
+        await self.send("BASKET")
+        if self.rng.random() < self.checkout_rate:
+            await self.send("CHECKOUT")
+
+
+def percentile(values: List[float], percent: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+async def generate_load(address: str, shopper_ids: List[int], shoppers: int, duration: float, checkout_rate: float,
+                        seed: int) -> Dict[str, Any]:
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors: Dict[str, int] = defaultdict(int)
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    deadline = start + duration
+    # Spread the simulated shoppers over different Shopper IDs, shoppers sharing an ID also share a basket
+    shopper_ids = rng.sample(shopper_ids, len(shopper_ids))
+    await asyncio.gather(*(SimulatedShopper(address, shopper_ids[i % len(shopper_ids)], latencies, errors, checkout_rate,
+                                            random.Random(rng.random())).run(deadline)
+                           for i in range(shoppers)))
+    elapsed = time.perf_counter() - start
+
+    every_latency = [latency for command_latencies in latencies.values() for latency in command_latencies]
+    results = {"shoppers": shoppers, "seconds": elapsed, "requests": len(every_latency),
+               "throughput": len(every_latency) / elapsed, "commands": {}}
+    for name, command_latencies in sorted(latencies.items()):
+        results["commands"][name] = {"requests": len(command_latencies), "errors": errors[name],
+                                     "p50_ms": percentile(command_latencies, 50) * 1000,
+                                     "p99_ms": percentile(command_latencies, 99) * 1000}
+    results["commands"]["ALL"] = {"requests": len(every_latency), "errors": sum(errors.values()),
+                                  "p50_ms": percentile(every_latency, 50) * 1000,
+                                  "p99_ms": percentile(every_latency, 99) * 1000,
+                                  "mean_ms": statistics.mean(every_latency) * 1000}
+    return results
+
+
+async def start_server(db_file: str, workers: int) -> Tuple[asyncio.subprocess.Process, str]:
+    """
+    Start server.py in a subprocess on a port chosen by the OS, returning the process and its address
+    """
+    process = await asyncio.create_subprocess_exec(sys.executable, "server.py", "--database", db_file, "--port", "0",
+                                                   "--workers", str(workers), stdout=asyncio.subprocess.PIPE)
+    line = (await process.stdout.readline()).decode("utf-8").strip()
+    if not line.startswith("Serving on "):
+        process.kill()
+        raise RuntimeError(f"Server did not start: {line}")
+    return process, line.removeprefix("Serving on ")
+
+
+async def main(args: argparse.Namespace) -> Dict[str, Any]:
+    sql = SqlWrapper(args.database)
+    shopper_ids = [row[0] for row in sql.select_query("SELECT shopper_id FROM shoppers")]
+    sql.close()
+
+    if args.connect:
+        return await generate_load(args.connect, shopper_ids, args.shoppers, args.duration, args.checkout_rate, args.seed)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, "database")
+        shutil.copyfile(args.database, db_file)
+        process, address = await start_server(db_file, args.workers)
+        try:
+            return await generate_load(address, shopper_ids, args.shoppers, args.duration, args.checkout_rate, args.seed)
+        finally:
+            process.terminate()
+            await process.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Drive simulated shoppers against the Parana server")
+    parser.add_argument("--database", default=DEFAULT_DB_FILE, help="Path to the database file")
+    parser.add_argument("--connect", default=None, help="HOST:PORT or Unix socket path of a running server, "
+                                                        "otherwise a server is started on a copy of the database")
+    parser.add_argument("--shoppers", type=int, default=50, help="Simulated shoppers connected at once")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds to generate load for")
+    parser.add_argument("--workers", type=int, default=8, help="Worker threads for the server that is started")
+    parser.add_argument("--checkout-rate", type=float, default=0.1, help="Chance a shopper checks out after adding an item")
+    parser.add_argument("--seed", type=int, default=417, help="Random seed")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args()
+
+    results = asyncio.run(main(args))
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{results['shoppers']} shoppers, {results['requests']} requests in {results['seconds']:.1f}s: "
+              f"{results['throughput']:.0f} requests/s\n")
+        print(f"{'Command':<12}{'Requests':>10}{'Errors':>8}{'p50 ms':>10}{'p99 ms':>10}")
+        for name, command in results["commands"].items():
+            print(f"{name:<12}{command['requests']:>10}{command['errors']:>8}{command['p50_ms']:>10.2f}{command['p99_ms']:>10.2f}")
@@ -0,0 +1,102 @@
+import argparse
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+from benchmarks.datagen import Generator, Scale
+from migrations import migrate
+from profiles import ProfileCache
+from shopper import load_profile
+from sql import SqlWrapper, DEFAULT_DB_FILE
+
+"""
+Times shopper login as the shoppers table grows.
+
+scan            The previous login: read every shopper_id into a list to check membership, then query the name
+lookup          One point lookup on the primary key, validating the shopper and loading their profile together
+account_ref     One point lookup on the UNIQUE shopper_account_ref index
+cached          The lookup served from a warm ProfileCache
+
+Usage:
+python -m benchmarks.login [--database PATH] [--sizes 1000 10000 100000 1000000] [--repeats 200]
+
+The benchmark runs against a temporary copy of the database, with synthetic shoppers added (benchmarks.datagen).
+"""
+
+
+def scan_login(sql: SqlWrapper, shopper_id: int) -> tuple:
+    """
+    The login read path before it was a point lookup, kept as a reference point
+    """
+    shoppers = sql.select_query("SELECT shopper_id FROM shoppers")
+    if shopper_id not in [shopper[0] for shopper in shoppers]:
+        raise ValueError(f"Shopper ID {shopper_id} is not a valid Shopper ID")
+    return sql.select_query("SELECT shopper_first_name, shopper_surname FROM shoppers WHERE shopper_id = ?",
+                            sql_parameters=(shopper_id,), fetch="one")
+
+
+def time_logins(login: Callable[[int], object], keys: list) -> Dict[str, float]:
+    timings = []
+    for key in keys:
+        start = time.perf_counter()
+        login(key)
+        timings.append((time.perf_counter() - start) * 1000)
+    ordered = sorted(timings)
+    return {"median_ms": statistics.median(ordered), "p99_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]}
+
+
+def add_shoppers(sql: SqlWrapper, count: int, seed: int) -> None:
+    if count > 0:
+        Generator(sql, Scale(shoppers=count, sellers=0, categories=0, products=0, sellers_per_product=0, orders=0,
+                             lines_per_order=0, reviews=0), seed).generate()
+
+
+def run(db_file: str, sizes: List[int], repeats: int, seed: int = 417) -> List[Dict[str, float]]:
+    sql = SqlWrapper(db_file)
+    migrate(sql)
+    rng = random.Random(seed)
+    results = []
+    for size in sorted(sizes):
+        add_shoppers(sql, size - sql.select_query("SELECT COUNT(*) FROM shoppers", fetch="one")[0], seed + size)
+        shoppers = sql.select_query("SELECT shopper_id, shopper_account_ref FROM shoppers")
+        sample = [rng.choice(shoppers) for _ in range(repeats)]
+        shopper_ids = [shopper_id for shopper_id, _ in sample]
+        account_refs = [account_ref for _, account_ref in sample]
+
+        profiles = ProfileCache(max_entries=repeats)
+        for shopper_id in shopper_ids:
+            load_profile(sql, "shopper_profile", shopper_id, profiles)
+
+        # The scan reads the whole table on every login, so it is timed on fewer logins at the larger sizes
+        scan_ids = shopper_ids[:max(5, repeats * 1000 // len(shoppers))]
+        results.append({"shoppers": len(shoppers),
+                        "scan": time_logins(lambda shopper_id: scan_login(sql, shopper_id), scan_ids),
+                        "lookup": time_logins(lambda shopper_id: load_profile(sql, "shopper_profile", shopper_id, None), shopper_ids),
+                        "account_ref": time_logins(lambda account_ref: load_profile(sql, "shopper_profile_by_account_ref",
+                                                                                    account_ref, None), account_refs),
+                        "cached": time_logins(lambda shopper_id: load_profile(sql, "shopper_profile", shopper_id, profiles), shopper_ids)})
+    sql.close()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time shopper login as the shoppers table grows")
+    parser.add_argument("--database", default=DEFAULT_DB_FILE, help="Path to the database file")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000, 1000000], help="Shoppers in the table")
+    parser.add_argument("--repeats", type=int, default=200, help="Logins timed at each size")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, "database")
+        shutil.copyfile(args.database, db_file)
+        results = run(db_file, args.sizes, args.repeats)
+
+    methods = ("scan", "lookup", "account_ref", "cached")
+    print(f"{'Shoppers':>10}" + "".join(f"{method + ' ms':>16}" for method in methods) + "   (median / p99)")
+    for result in results:
+        print(f"{result['shoppers']:>10}" + "".join(f"{result[method]['median_ms']:>8.3f}/{result[method]['p99_ms']:<7.3f}"
+                                                   for method in methods))
@@ -0,0 +1,111 @@
+import argparse
+import builtins
+import io
+import os
+import shutil
+import tempfile
+import time
+from collections import Counter
+from contextlib import redirect_stdout
+from typing import Dict, List, Tuple
+
+from sql import SqlWrapper, DEFAULT_DB_FILE
+from tracing import normalize_sql
+
+"""
+Counts the SQL statements the shopper session sends to SQLite for a full add item -> change quantity -> checkout flow,
+and the number of SQLite virtual machine instructions they take to run.
+
+Only the statements the session runs through SqlWrapper are counted. SQLite's trace callback also reports each trigger
+program a statement fires, by sending the statement's text again, which would count the catalog_version and summary
+table triggers (migrations 2 and 4) as statements of their own. The VM steps do include the triggers' work.
+
+BASELINE is the same flow measured before the session carried IDs in its result rows (looking products, sellers and
+categories up by name), with the indexes of migration 1 and none of the triggers.
+
+Usage:
+python -m benchmarks.query_count [--database PATH]
+
+The flow runs against a temporary copy of the database, so the database is not changed.
+"""
+
+SHOPPER_ID = "10000"
+FLOW = [
+    # Add 2 items, browsing the categories (first product and first seller of the first 2 categories)
+    "2", "C", "1", "1", "1", "2",
+    "2", "C", "2", "1", "1", "1",
+    # Change the quantity of the first item
+    "4", "1", "3",
+    # Checkout
+    "6", "Y",
+    "7",
+]
+
+BASELINE = {"statements": 23, "select": 15, "insert": 5, "update": 1, "delete": 2, "vm_steps": 1259}
+
+
+def run_flow(db_file: str) -> Tuple[Dict[str, float], Counter]:
+    """
+    Run the scripted flow in a shopper session, counting the statements executed once the main menu is reached.
+    Returns the totals and the number of times each statement was run.
+    """
+    from main import ParanaShopperSession
+
+    sql = SqlWrapper(db_file)
+    statements: List[str] = []
+    steps = Counter()
+    inputs = iter([SHOPPER_ID] + FLOW)
+
+    execute = sql._execute
+
+    def counted_execute(db, sql_query, *args, **kwargs):
+        statements.append(sql_query)
+        return execute(db, sql_query, *args, **kwargs)
+
+    def scripted_input(prompt: str = "") -> str:
+        if prompt == "Select an option: " and not steps:
+            # Start counting at the first menu prompt, session set up is not part of the flow
+            sql._execute = counted_execute
+            sql.db.set_progress_handler(lambda: steps.update(["steps"]), 1)
+        return next(inputs)
+
+    real_input, real_print = builtins.input, builtins.print
+    builtins.input, builtins.print = scripted_input, lambda *args, **kwargs: None
+    start = time.perf_counter()
+    try:
+        # Tables are written straight to stdout rather than printed
+        with redirect_stdout(io.StringIO()):
+            ParanaShopperSession(sql=sql)
+    except SystemExit:
+        pass
+    finally:
+        builtins.input, builtins.print = real_input, real_print
+    elapsed = time.perf_counter() - start
+
+    kinds = Counter(statement.split(None, 1)[0].upper() for statement in statements)
+    return {"statements": sum(kinds[kind] for kind in ("SELECT", "INSERT", "UPDATE", "DELETE")),
+            **{kind.lower(): kinds[kind] for kind in ("SELECT", "INSERT", "UPDATE", "DELETE")},
+            "vm_steps": steps["steps"],
+            "seconds": elapsed}, Counter(normalize_sql(statement) for statement in statements)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Count the queries issued by an add -> change -> checkout flow")
+    parser.add_argument("--database", default=DEFAULT_DB_FILE, help="Path to the database file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, "database")
+        shutil.copyfile(args.database, db_file)
+        results, statement_counts = run_flow(db_file)
+
+    print(f"{'':<12}{'Before':>8}{'After':>8}")
+    for name, value in results.items():
+        if isinstance(value, float):
+            print(f"{name:<12}{'':>8}{value:>8.4f}")
+        else:
+            print(f"{name:<12}{BASELINE[name]:>8}{value:>8}")
+
+    print("\nStatements run:")
+    for statement, count in statement_counts.most_common():
+        print(f"{count:>4}  {statement[:100]}")
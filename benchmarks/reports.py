@@ -0,0 +1,59 @@
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from typing import Dict, List
+
+from benchmarks.datagen import SCALES
+from benchmarks.scaling import prepare_database
+from reports import REPORTS, open_writers, run
+from sql import DEFAULT_DB_FILE
+
+"""
+Times writing every report (reports.py) with a growing number of worker processes.
+
+Usage:
+python -m benchmarks.reports [--scale medium] [--workers 1 2 4 8] [--repeats 3] [--data-dir DIR]
+
+The database is generated with benchmarks.datagen and is only opened read-only, so a kept database is used directly.
+The speed up is bounded by the CPU cores available (os.cpu_count() is printed with the results).
+"""
+
+
+def time_reports(db_file: str, workers: int, repeats: int, output_dir: str) -> Dict[str, float]:
+    timings = []
+    for _ in range(repeats):
+        writers = open_writers(list(REPORTS), output_dir, "csv")
+        start = time.perf_counter()
+        try:
+            run(db_file, list(REPORTS), writers, workers)
+        finally:
+            for writer in writers.values():
+                writer.close()
+        timings.append((time.perf_counter() - start) * 1000)
+    return {"median_ms": statistics.median(timings), "min_ms": min(timings)}
+
+
+def run_benchmark(scale: str, worker_counts: List[int], repeats: int, seed: int, source: str, data_dir: str = None) -> Dict[int, Dict[str, float]]:
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file, _ = prepare_database(scale, seed, source, data_dir or tmp)
+        return {workers: time_reports(db_file, workers, repeats, os.path.join(tmp, "reports")) for workers in worker_counts}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the reports with a growing number of worker processes")
+    parser.add_argument("--database", default=DEFAULT_DB_FILE, help="Database to copy the schema and existing rows from")
+    parser.add_argument("--scale", choices=SCALES, default="medium", help="Scale of the generated database")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8], help="Worker counts to time")
+    parser.add_argument("--repeats", type=int, default=3, help="Times the reports are written at each worker count")
+    parser.add_argument("--seed", type=int, default=417, help="Random seed for the data")
+    parser.add_argument("--data-dir", default=None, help="Keep the generated database here and reuse it")
+    args = parser.parse_args()
+
+    results = run_benchmark(args.scale, args.workers, args.repeats, args.seed, args.database, args.data_dir)
+    print(f"{args.scale} database, {os.cpu_count()} CPU(s)")
+    print(f"{'Workers':>8}{'Median ms':>12}{'Min ms':>12}{'Speed up':>10}")
+    baseline = results[min(results)]["median_ms"]
+    for workers, timings in results.items():
+        print(f"{workers:>8}{timings['median_ms']:>12.1f}{timings['min_ms']:>12.1f}{baseline / timings['median_ms']:>9.2f}x")
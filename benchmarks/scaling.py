@@ -0,0 +1,209 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+from benchmarks.datagen import SCALES, generate
+from catalog import CatalogCache
+from shopper import ShopperService
+from sql import SqlWrapper, DEFAULT_DB_FILE
+
+"""
+Times the shopper session operations on synthetic databases of growing size.
+
+For each scale a database is generated with benchmarks.datagen and every operation behind the ParanaShopperSession
+menu is timed through ShopperService (the same database work without the terminal I/O):
+
+order_history        First page of the order history of a sampled shopper
+order_history_all    Every page of the order history of the shopper with the most orders
+browse               Categories -> products of a category -> sellers of a product, with the catalog cache cleared first
+add_item             Add an item to the basket
+basket_view          The contents of a basket holding BASKET_LINES items
+checkout             Check out a basket holding BASKET_LINES items
+
+The results are written as JSON with --output. Pass an earlier results file as --baseline to compare the medians
+against it, the exit status is 1 if any operation is slower than the baseline by more than --threshold.
+
+Usage:
+python -m benchmarks.scaling [--scales tiny small medium] [--repeats 20] [--output results.json] [--baseline old.json]
+                             [--data-dir DIR]
+
+Generated databases are kept in --data-dir (if given) and reused by later runs with the same scale and seed.
+The operations run against a temporary copy, so the kept databases are not changed.
+"""
+
+BASKET_LINES = 20
+SAMPLE_SHOPPERS = 50
+
+
+def summarise(timings: List[float]) -> Dict[str, float]:
+    ordered = sorted(timings)
+    return {"median_ms": statistics.median(ordered), "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+            "min_ms": ordered[0], "max_ms": ordered[-1]}
+
+
+def time_operation(operation: Callable[[], Any], repeats: int, setup: Callable[[], Any] = None) -> Dict[str, float]:
+    """
+    Call operation repeats times, returning its timings in milliseconds. setup is called untimed before each call.
+    """
+    timings = []
+    for _ in range(repeats):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        operation()
+        timings.append((time.perf_counter() - start) * 1000)
+    return summarise(timings)
+
+
+class Workload:
+    """
+    The sampled shoppers and catalog entries the operations run against, chosen from the database with a seeded random
+    """
+
+    def __init__(self, sql: SqlWrapper, seed: int) -> None:
+        self.sql = sql
+        self.rng = random.Random(seed)
+        self.catalog = CatalogCache()
+        shopper_ids = [row[0] for row in sql.select_query("SELECT shopper_id FROM shoppers ORDER BY shopper_id")]
+        self.shopper_ids = self.rng.sample(shopper_ids, min(SAMPLE_SHOPPERS, len(shopper_ids)))
+        self.busiest_shopper_id = sql.select_query("SELECT shopper_id FROM shopper_orders GROUP BY shopper_id "
+                                                   "ORDER BY COUNT(*) DESC LIMIT 1", fetch="one")[0]
+        self.offers: List[Tuple[int, int]] = sql.select_query("SELECT product_id, MIN(seller_id) FROM product_sellers "
+                                                              "GROUP BY product_id")
+        self.shopper = ShopperService(sql, self.shopper_ids[0], self.catalog)
+
+    def any_shopper(self) -> ShopperService:
+        return ShopperService(self.sql, self.rng.choice(self.shopper_ids), self.catalog)
+
+    def fill_basket(self) -> None:
+        """
+        Start a new basket for the benchmark shopper holding BASKET_LINES items
+        """
+        self.shopper.basket_id = self.shopper.create_basket()
+        for product_id, seller_id in self.rng.sample(self.offers, min(BASKET_LINES, len(self.offers))):
+            self.shopper.add_item(product_id, seller_id, 1)
+
+    def empty_basket(self) -> None:
+        self.shopper.basket_id = self.shopper.create_basket()
+
+    def order_history(self) -> None:
+        self.any_shopper().order_history_page()
+
+    def order_history_all(self) -> None:
+        for _ in ShopperService(self.sql, self.busiest_shopper_id, self.catalog).iter_order_history():
+            pass
+
+    def browse(self) -> None:
+        self.catalog.invalidate()
+        category = self.rng.choice(self.shopper.categories())
+        products = self.shopper.products(category.category_id)
+        if products:
+            self.shopper.offers(self.rng.choice(products).product_id)
+
+    def add_item(self) -> None:
+        product_id, seller_id = self.rng.choice(self.offers)
+        self.shopper.add_item(product_id, seller_id, 1)
+
+
+def run_scale(db_file: str, repeats: int, seed: int) -> Dict[str, Dict[str, float]]:
+    """
+    Time every operation against one database, returning the timings of each
+    """
+    sql = SqlWrapper(db_file)
+    sql.warm_up()
+    workload = Workload(sql, seed)
+    try:
+        return {
+            "order_history": time_operation(workload.order_history, repeats),
+            "order_history_all": time_operation(workload.order_history_all, repeats),
+            "browse": time_operation(workload.browse, repeats),
+            "add_item": time_operation(workload.add_item, repeats, setup=workload.empty_basket),
+            "basket_view": time_operation(workload.shopper.basket, repeats, setup=workload.fill_basket),
+            "checkout": time_operation(workload.shopper.checkout, repeats, setup=workload.fill_basket),
+        }
+    finally:
+        sql.close()
+
+
+def prepare_database(scale: str, seed: int, source: str, data_dir: str) -> Tuple[str, Dict[str, Any]]:
+    """
+    Return the path of the generated database for a scale, generating it unless it is already in data_dir,
+    and how long generation took
+    """
+    db_file = os.path.join(data_dir, f"parana-{scale}-{seed}.db")
+    if os.path.exists(db_file):
+        return db_file, {"reused": True}
+    start = time.perf_counter()
+    rows = generate(db_file + ".tmp", SCALES[scale], seed, source)
+    os.replace(db_file + ".tmp", db_file)
+    return db_file, {"reused": False, "seconds": time.perf_counter() - start, "rows": rows}
+
+
+def run(scales: List[str], repeats: int, seed: int, source: str = DEFAULT_DB_FILE, data_dir: str = None) -> Dict[str, Any]:
+    results = {"seed": seed, "repeats": repeats, "python": platform.python_version(), "sqlite": sqlite3.sqlite_version,
+               "scales": {}}
+    with tempfile.TemporaryDirectory() as tmp:
+        for scale in scales:
+            db_file, generation = prepare_database(scale, seed, source, data_dir or tmp)
+            copy = os.path.join(tmp, "benchmark.db")
+            shutil.copyfile(db_file, copy)
+            results["scales"][scale] = {"generation": generation, "operations": run_scale(copy, repeats, seed)}
+            os.remove(copy)
+    return results
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any]) -> List[Tuple[str, str, float, float, float]]:
+    """
+    Return (scale, operation, median ms, baseline median ms, ratio) for every operation timed in both runs
+    """
+    rows = []
+    for scale, scale_results in results["scales"].items():
+        baseline_operations = baseline.get("scales", {}).get(scale, {}).get("operations", {})
+        for operation, timings in scale_results["operations"].items():
+            if operation in baseline_operations:
+                baseline_median = baseline_operations[operation]["median_ms"]
+                rows.append((scale, operation, timings["median_ms"], baseline_median, timings["median_ms"] / baseline_median))
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the shopper session operations on synthetic databases of growing size")
+    parser.add_argument("--database", default=DEFAULT_DB_FILE, help="Database to copy the schema and existing rows from")
+    parser.add_argument("--scales", nargs="+", choices=SCALES, default=["tiny", "small", "medium"], help="Scales to run")
+    parser.add_argument("--repeats", type=int, default=20, help="Times each operation is run at each scale")
+    parser.add_argument("--seed", type=int, default=417, help="Random seed for the data and the workload")
+    parser.add_argument("--data-dir", default=None, help="Keep generated databases here and reuse them")
+    parser.add_argument("--output", default=None, help="Write the results to this JSON file")
+    parser.add_argument("--baseline", default=None, help="Compare against the results in this JSON file")
+    parser.add_argument("--threshold", type=float, default=1.25, help="Slowdown against the baseline counted as a regression")
+    args = parser.parse_args()
+
+    results = run(args.scales, args.repeats, args.seed, args.database, args.data_dir)
+    if args.output:
+        with open(args.output, "w") as results_file:
+            json.dump(results, results_file, indent=2)
+
+    print(f"{'Scale':<8}{'Operation':<20}{'Median ms':>12}{'p95 ms':>12}{'Max ms':>12}")
+    for scale, scale_results in results["scales"].items():
+        for operation, timings in scale_results["operations"].items():
+            print(f"{scale:<8}{operation:<20}{timings['median_ms']:>12.3f}{timings['p95_ms']:>12.3f}{timings['max_ms']:>12.3f}")
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = 0
+        print(f"\n{'Scale':<8}{'Operation':<20}{'Median ms':>12}{'Baseline ms':>12}{'Ratio':>8}")
+        for scale, operation, median, baseline_median, ratio in compare(results, baseline):
+            regressed = ratio > args.threshold
+            regressions += regressed
+            print(f"{scale:<8}{operation:<20}{median:>12.3f}{baseline_median:>12.3f}{ratio:>7.2f}x{'  REGRESSION' if regressed else ''}")
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,93 @@
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from typing import Dict, List
+
+from benchmarks.datagen import Scale, generate
+from search import SEARCH_LIMIT, rebuild, search_products
+from sql import SqlWrapper, DEFAULT_DB_FILE
+
+"""
+Compares the FTS5 product search against LIKE '%word%' scans of the products table.
+
+Both return the first SEARCH_LIMIT products in their order (bm25 rank for FTS5, description for LIKE, as the category
+listing is ordered) with the cheapest seller of each. The LIKE search needs every word in the product text and
+has to read every product to find and order the matches. The FTS5 search reads only the matching products, but ranks
+all of them, so its cost grows with the number of matches: the synthetic catalog has a small vocabulary, so a word
+like "sony" matches about 1 in 10 products, far more than in a real catalog. The model number search is the selective case.
+
+Usage:
+python -m benchmarks.search [--database PATH] [--products 1000000] [--repeats 10]
+
+The benchmark runs against a temporary database with synthetic products (benchmarks.datagen), and times a rebuild of
+the search index at the end.
+"""
+
+SEARCHES = ["sony", "wireless speaker", "lapt", "acme ultra monitor", "nothingmatchesthis"]
+SEARCHED_TEXT = "(p.product_description || ' ' || p.product_manufacturer || ' ' || COALESCE(p.product_model, ''))"
+
+
+def like_search(sql: SqlWrapper, text: str, limit: int = SEARCH_LIMIT) -> list:
+    """
+    Search with a LIKE '%word%' scan for every word over the description, manufacturer and model, the way a search
+    without an index would have to
+    """
+    words = text.split()
+    return sql.select_query("SELECT p.product_id, p.product_description, MIN(ps.price) "
+                            "FROM products p "
+                            "LEFT JOIN product_sellers ps ON ps.product_id = p.product_id "
+                            f"WHERE {' AND '.join([SEARCHED_TEXT + ' LIKE ?'] * len(words))} "
+                            "GROUP BY p.product_id "
+                            "ORDER BY p.product_description "
+                            "LIMIT ?", sql_parameters=(*(f"%{word}%" for word in words), limit))
+
+
+def time_search(search, sql: SqlWrapper, text: str, repeats: int) -> Dict[str, float]:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        results = search(sql, text)
+        timings.append((time.perf_counter() - start) * 1000)
+    return {"median_ms": statistics.median(timings), "results": len(results)}
+
+
+def run(source: str, products: int, repeats: int) -> Dict[str, object]:
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, "database")
+        start = time.perf_counter()
+        generate(db_file, Scale(shoppers=0, sellers=200, categories=100, products=products, sellers_per_product=3,
+                                orders=0, lines_per_order=0, reviews=0), source=source)
+        generate_seconds = time.perf_counter() - start
+
+        sql = SqlWrapper(db_file)
+        sql.warm_up()
+        searches: List[Dict[str, object]] = []
+        model_number = sql.select_query("SELECT product_model FROM products ORDER BY product_id DESC LIMIT 1", fetch="one")[0]
+        for text in SEARCHES + [model_number]:
+            searches.append({"search": text,
+                             "fts": time_search(search_products, sql, text, repeats),
+                             "like": time_search(like_search, sql, text, repeats)})
+        start = time.perf_counter()
+        rebuild(sql)
+        rebuild_seconds = time.perf_counter() - start
+        sql.close()
+    return {"products": products, "generate_seconds": generate_seconds, "rebuild_seconds": rebuild_seconds, "searches": searches}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare FTS5 product search against LIKE scans")
+    parser.add_argument("--database", default=DEFAULT_DB_FILE, help="Database to copy the schema and existing rows from")
+    parser.add_argument("--products", type=int, default=1000000, help="Synthetic products to add")
+    parser.add_argument("--repeats", type=int, default=10, help="Times each search is run")
+    args = parser.parse_args()
+
+    results = run(args.database, args.products, args.repeats)
+    print(f"{results['products']:,} products (generated and indexed in {results['generate_seconds']:.1f}s, "
+          f"index rebuilt in {results['rebuild_seconds']:.1f}s)\n")
+    print(f"{'Search':<22}{'FTS ms':>10}{'Results':>9}{'LIKE ms':>10}{'Results':>9}{'Speed up':>10}")
+    for search in results["searches"]:
+        fts, like = search["fts"], search["like"]
+        print(f"{search['search']:<22}{fts['median_ms']:>10.2f}{fts['results']:>9}{like['median_ms']:>10.2f}{like['results']:>9}"
+              f"{like['median_ms'] / fts['median_ms']:>9.0f}x")
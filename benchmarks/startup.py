@@ -0,0 +1,142 @@
+import argparse
+import os
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Tuple
+
+from migrations import migrate
+from sql import SqlWrapper, DEFAULT_DB_FILE
+
+"""
+Measures how long a shopper session takes to start.
+
+import          The cumulative import time of main.py (python -X importtime -c "import main"), and the modules that
+                take the longest to import themselves
+first_prompt    From starting python main.py to the Shopper ID prompt
+main_menu       From entering the Shopper ID to the main menu prompt (opening and migrating the database, warming up
+                the statements and loading the shopper)
+
+Each measurement is the median of --runs runs in fresh processes, against a copy of the database that has already been
+migrated, and is checked against TARGETS. python -c pass is timed as well, as the floor set by the interpreter.
+
+Usage:
+python -m benchmarks.startup [--database PATH] [--runs 10] [--top 10]
+"""
+
+# Milliseconds, on a warm file cache
+TARGETS = {
+    "import": 60.0,
+    "first_prompt": 120.0,
+    "main_menu": 150.0,
+}
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The sessions are timed as they start once their bytecode is cached, even where the environment turns the cache off
+ENV = {name: value for name, value in os.environ.items() if name != "PYTHONDONTWRITEBYTECODE"}
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)")
+
+
+def import_times() -> Tuple[float, Dict[str, float]]:
+    """
+    Import main in a fresh interpreter, returning its cumulative import time and the self time of each module, in ms
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], cwd=ROOT, env=ENV,
+                            capture_output=True, text=True, check=True)
+    total, modules = 0.0, {}
+    for match in IMPORT_LINE.finditer(result.stderr):
+        self_us, cumulative_us, _, module = match.groups()
+        modules[module] = int(self_us) / 1000
+        if module == "main":
+            total = int(cumulative_us) / 1000
+    return total, modules
+
+
+def read_until(stream: int, prompt: bytes) -> bytes:
+    """
+    Read the output of a session until it shows prompt
+    """
+    output = b""
+    while not output.endswith(prompt):
+        data = os.read(stream, 65536)
+        if not data:
+            raise RuntimeError(f"The session exited before showing {prompt!r}: {output.decode(errors='replace')}")
+        output += data
+    return output
+
+
+def session_times(db_file: str, shopper_id: int) -> Dict[str, float]:
+    """
+    Start a session, log in and exit, returning the time to the Shopper ID prompt and from there to the main menu, in ms
+    """
+    start = time.perf_counter()
+    session = subprocess.Popen([sys.executable, "main.py", "--database", db_file], cwd=ROOT, env=ENV,
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        read_until(session.stdout.fileno(), b"Please enter your Shopper ID: ")
+        first_prompt = time.perf_counter()
+        session.stdin.write(f"{shopper_id}\n".encode())
+        session.stdin.flush()
+        read_until(session.stdout.fileno(), b"Select an option: ")
+        main_menu = time.perf_counter()
+        session.stdin.write(b"7\n")
+        session.stdin.flush()
+        session.wait(timeout=10)
+    finally:
+        if session.poll() is None:
+            session.kill()
+    return {"first_prompt": (first_prompt - start) * 1000, "main_menu": (main_menu - first_prompt) * 1000}
+
+
+def interpreter_ms() -> float:
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "pass"], env=ENV, check=True)
+    return (time.perf_counter() - start) * 1000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the startup time of a shopper session")
+    parser.add_argument("--database", default=DEFAULT_DB_FILE, help="Database to copy")
+    parser.add_argument("--runs", type=int, default=10, help="Runs of each measurement, the median is reported")
+    parser.add_argument("--top", type=int, default=10, help="The slowest modules to list")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, "database")
+        shutil.copyfile(args.database, db_file)
+        sql = SqlWrapper(db_file)
+        migrate(sql)
+        shopper_id = sql.select_query("SELECT MIN(shopper_id) FROM shoppers", fetch="one")[0]
+        sql.close()
+
+        # The first run writes the bytecode caches, it is not counted
+        import_times()
+        session_times(db_file, shopper_id)
+
+        imports: List[float] = []
+        module_times: Dict[str, List[float]] = {}
+        for _ in range(args.runs):
+            total, modules = import_times()
+            imports.append(total)
+            for module, ms in modules.items():
+                module_times.setdefault(module, []).append(ms)
+        sessions = [session_times(db_file, shopper_id) for _ in range(args.runs)]
+        interpreter = statistics.median(interpreter_ms() for _ in range(args.runs))
+
+    results = {"import": statistics.median(imports),
+               "first_prompt": statistics.median(run["first_prompt"] for run in sessions),
+               "main_menu": statistics.median(run["main_menu"] for run in sessions)}
+
+    print(f"python -c pass: {interpreter:.1f}ms\n")
+    print(f"{'Measurement':<14}{'Median ms':>10}{'Target ms':>10}")
+    for name, ms in results.items():
+        print(f"{name:<14}{ms:>10.1f}{TARGETS[name]:>10.1f}  {'ok' if ms <= TARGETS[name] else 'MISSED'}")
+
+    print("\nSlowest imports (self time, median ms):")
+    slowest = sorted(((statistics.median(times), module) for module, times in module_times.items()), reverse=True)
+    for ms, module in slowest[:args.top]:
+        print(f"{module:<30}{ms:>8.2f}")
@@ -0,0 +1,299 @@
+import argparse
+import csv
+import itertools
+import json
+import logging
+import sys
+import time
+from typing import Callable, Iterable, Iterator, List, Literal, NamedTuple, Optional, TextIO, Tuple
+
+from migrations import migrate
+from sql import SqlWrapper, DEFAULT_DB_FILE
+
+"""
+Streaming bulk import and export of the Parana tables, as CSV (with a header row) or JSON lines.
+
+Rows are read CHUNK_SIZE at a time and loaded with executemany into a temporary staging table. One INSERT ... SELECT
+per chunk then resolves the natural keys in the file (category codes, seller account refs, product codes) to IDs with
+a join against their UNIQUE indexes and upserts the rows, so only one chunk is ever held in memory. Rows whose
+foreign keys do not resolve are skipped and counted. The whole file is loaded in one transaction: it is imported
+completely or not at all.
+
+With defer_indexes the secondary indexes of the table are dropped for the load and rebuilt once at the end, inside the
+same transaction. This is much faster for a load that is large compared to the table, and much slower for a small update.
+
+The catalog_version triggers (migration 2) would bump the version once per row loaded, so they are dropped for the load
+too and the version is bumped once at the end.
+
+Export streams the rows of a table (or the order lines) straight from the cursor, with foreign keys as natural keys,
+so an exported catalog table can be imported into another database.
+
+Usage:
+python bulk.py [--database PATH] import TABLE FILE [--format csv|jsonl] [--defer-indexes] [--chunk-size 50000]
+python bulk.py [--database PATH] export TABLE [FILE] [--format csv|jsonl]
+
+FILE "-" (the default for export) is stdin / stdout.
+"""
+
+CHUNK_SIZE = 50000
+STAGING_TABLE = "bulk_import_rows"
+
+logger = logging.getLogger("parana.bulk")
+
+
+class TableSpec(NamedTuple):
+    """
+    How one table is imported and exported. The staging table has the file columns, upsert loads it into the table,
+    export selects the rows with the same columns.
+    """
+    columns: Tuple[str, ...]
+    export: str
+    upsert: Optional[str] = None
+
+
+# "WHERE true" keeps the ON of the upsert from being read as a join constraint
+TABLES = {
+    "categories": TableSpec(
+        ("category_code", "category_description"),
+        "SELECT category_code, category_description FROM categories ORDER BY category_id",
+        "INSERT INTO categories (category_code, category_description) "
+        f"SELECT category_code, category_description FROM {STAGING_TABLE} WHERE true "
+        "ON CONFLICT (category_code) DO UPDATE SET category_description = excluded.category_description"),
+    "sellers": TableSpec(
+        ("seller_account_ref", "seller_name", "seller_address_line1", "seller_address_line2", "seller_address_line3",
+         "seller_county", "seller_post_code", "seller_email_address"),
+        "SELECT seller_account_ref, seller_name, seller_address_line1, seller_address_line2, seller_address_line3, "
+        "seller_county, seller_post_code, seller_email_address FROM sellers ORDER BY seller_id",
+        "INSERT INTO sellers (seller_account_ref, seller_name, seller_address_line1, seller_address_line2, "
+        "seller_address_line3, seller_county, seller_post_code, seller_email_address) "
+        "SELECT seller_account_ref, seller_name, seller_address_line1, seller_address_line2, seller_address_line3, "
+        f"seller_county, seller_post_code, seller_email_address FROM {STAGING_TABLE} WHERE true "
+        "ON CONFLICT (seller_account_ref) DO UPDATE SET seller_name = excluded.seller_name, "
+        "seller_address_line1 = excluded.seller_address_line1, seller_address_line2 = excluded.seller_address_line2, "
+        "seller_address_line3 = excluded.seller_address_line3, seller_county = excluded.seller_county, "
+        "seller_post_code = excluded.seller_post_code, seller_email_address = excluded.seller_email_address"),
+    "shoppers": TableSpec(
+        ("shopper_account_ref", "shopper_first_name", "shopper_surname", "shopper_email_address", "date_of_birth",
+         "gender", "date_joined"),
+        "SELECT shopper_account_ref, shopper_first_name, shopper_surname, shopper_email_address, date_of_birth, "
+        "gender, date_joined FROM shoppers ORDER BY shopper_id",
+        "INSERT INTO shoppers (shopper_account_ref, shopper_first_name, shopper_surname, shopper_email_address, "
+        "date_of_birth, gender, date_joined) "
+        "SELECT shopper_account_ref, shopper_first_name, shopper_surname, shopper_email_address, date_of_birth, "
+        f"gender, date_joined FROM {STAGING_TABLE} WHERE true "
+        "ON CONFLICT (shopper_account_ref) DO UPDATE SET shopper_first_name = excluded.shopper_first_name, "
+        "shopper_surname = excluded.shopper_surname, shopper_email_address = excluded.shopper_email_address, "
+        "date_of_birth = excluded.date_of_birth, gender = excluded.gender"),
+    # A product without a category code has no category, one with an unknown category code is skipped
+    "products": TableSpec(
+        ("product_code", "category_code", "product_description", "product_manufacturer", "product_model", "product_status"),
+        "SELECT p.product_code, c.category_code, p.product_description, p.product_manufacturer, p.product_model, "
+        "p.product_status FROM products p LEFT JOIN categories c ON c.category_id = p.category_id ORDER BY p.product_id",
+        "INSERT INTO products (product_code, category_id, product_description, product_manufacturer, product_model, "
+        "product_status) "
+        "SELECT r.product_code, c.category_id, r.product_description, r.product_manufacturer, r.product_model, "
+        f"r.product_status FROM {STAGING_TABLE} r LEFT JOIN categories c ON c.category_code = r.category_code "
+        "WHERE r.category_code IS NULL OR c.category_id IS NOT NULL "
+        "ON CONFLICT (product_code) DO UPDATE SET category_id = excluded.category_id, "
+        "product_description = excluded.product_description, product_manufacturer = excluded.product_manufacturer, "
+        "product_model = excluded.product_model, product_status = excluded.product_status"),
+    "product_sellers": TableSpec(
+        ("product_code", "seller_account_ref", "price"),
+        "SELECT p.product_code, s.seller_account_ref, ps.price FROM product_sellers ps "
+        "JOIN products p ON p.product_id = ps.product_id "
+        "JOIN sellers s ON s.seller_id = ps.seller_id "
+        "ORDER BY ps.product_id, ps.seller_id",
+        "INSERT INTO product_sellers (product_id, seller_id, price) "
+        f"SELECT p.product_id, s.seller_id, r.price FROM {STAGING_TABLE} r "
+        "JOIN products p ON p.product_code = r.product_code "
+        "JOIN sellers s ON s.seller_account_ref = r.seller_account_ref WHERE true "
+        "ON CONFLICT (product_id, seller_id) DO UPDATE SET price = excluded.price"),
+    # Order lines are export only, orders have no natural key to import them by
+    "order_lines": TableSpec(
+        ("order_id", "shopper_account_ref", "order_date", "order_status", "product_code", "seller_account_ref",
+         "quantity", "price", "ordered_product_status"),
+        "SELECT so.order_id, sh.shopper_account_ref, so.order_date, so.order_status, p.product_code, "
+        "s.seller_account_ref, op.quantity, op.price, op.ordered_product_status FROM shopper_orders so "
+        "JOIN shoppers sh ON sh.shopper_id = so.shopper_id "
+        "JOIN ordered_products op ON op.order_id = so.order_id "
+        "JOIN products p ON p.product_id = op.product_id "
+        "JOIN sellers s ON s.seller_id = op.seller_id "
+        "ORDER BY so.order_id, op.product_id"),
+}
+
+
+class ImportResult(NamedTuple):
+    rows_read: int
+    rows_loaded: int
+    rows_skipped: int
+    seconds: float
+
+
+def chunked(rows: Iterable[tuple], size: int = CHUNK_SIZE) -> Iterator[List[tuple]]:
+    rows = iter(rows)
+    while chunk := list(itertools.islice(rows, size)):
+        yield chunk
+
+
+def read_rows(file: TextIO, columns: Tuple[str, ...], file_format: Literal["csv", "jsonl"] = "csv") -> Iterator[tuple]:
+    """
+    Yield the rows of a CSV or JSON lines file as tuples in the order of columns. Missing values and empty CSV fields are NULL.
+    """
+    if file_format == "csv":
+        reader = csv.DictReader(file)
+        missing = set(columns) - set(reader.fieldnames or ())
+        if missing:
+            raise ValueError(f"The file has no column(s): {', '.join(sorted(missing))}")
+        for record in reader:
+            yield tuple(record[column] or None for column in columns)
+    elif file_format == "jsonl":
+        for line in file:
+            if line.strip():
+                record = json.loads(line)
+                yield tuple(record.get(column) for column in columns)
+    else:
+        raise ValueError(f"Unknown file format '{file_format}'")
+
+
+def secondary_indexes(sql: SqlWrapper, table: str) -> List[Tuple[str, str]]:
+    """
+    The (name, CREATE statement) of the indexes on a table that can be dropped and rebuilt: not the UNIQUE indexes,
+    which the upserts need, nor the automatic indexes of the primary key and UNIQUE constraints
+    """
+    return [(name, create) for name, create in
+            sql.select_query("SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+                             sql_parameters=(table,))
+            if not create.upper().startswith("CREATE UNIQUE")]
+
+
+def catalog_version_triggers(sql: SqlWrapper, table: str) -> List[Tuple[str, str]]:
+    """
+    The (name, CREATE statement) of the triggers that bump catalog_version when the table changes
+    """
+    return [(name, create) for name, create in
+            sql.select_query("SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name = ?",
+                             sql_parameters=(table,))
+            if name.endswith("_catalog_version")]
+
+
+def import_rows(sql: SqlWrapper, table: str, rows: Iterable[tuple], chunk_size: int = CHUNK_SIZE,
+                defer_indexes: bool = False, progress: Callable[[str, int, float], None] = None) -> ImportResult:
+    """
+    Upsert rows into a table in one transaction, see the module docstring
+
+    Args:
+        sql: The database to import into
+        table: The table, one of TABLES that can be imported
+        rows: Tuples in the order of the table's TableSpec columns, e.g. from read_rows
+        chunk_size: Rows loaded per executemany
+        defer_indexes: Drop the secondary indexes of the table for the load and rebuild them at the end
+        progress: Called with (table, rows read, seconds) after each chunk
+    """
+    spec = TABLES[table]
+    if spec.upsert is None:
+        raise ValueError(f"{table} can only be exported")
+    start = time.perf_counter()
+    read = loaded = 0
+    with sql.transaction() as db:
+        db.execute(f"CREATE TEMP TABLE IF NOT EXISTS {STAGING_TABLE} ({', '.join(spec.columns)})")
+        db.execute(f"DELETE FROM {STAGING_TABLE}")
+        indexes = secondary_indexes(sql, table) if defer_indexes else []
+        for name, _ in indexes:
+            db.execute(f"DROP INDEX {name}")
+        triggers = catalog_version_triggers(sql, table)
+        for name, _ in triggers:
+            db.execute(f"DROP TRIGGER {name}")
+
+        stage = f"INSERT INTO {STAGING_TABLE} VALUES ({', '.join('?' * len(spec.columns))})"
+        for chunk in chunked(rows, chunk_size):
+            db.executemany(stage, chunk)
+            loaded += db.execute(spec.upsert).rowcount
+            db.execute(f"DELETE FROM {STAGING_TABLE}")
+            read += len(chunk)
+            if progress is not None:
+                progress(table, read, time.perf_counter() - start)
+
+        for _, create in indexes:
+            db.execute(create)
+        for _, create in triggers:
+            db.execute(create)
+        if triggers and loaded:
+            db.execute("UPDATE catalog_version SET version = version + 1 WHERE catalog_version_id = 1")
+        db.execute(f"DROP TABLE {STAGING_TABLE}")
+    if loaded < read:
+        logger.warning("Skipped %s of %s %s rows, their foreign keys are not in the database", read - loaded, read, table)
+    return ImportResult(read, loaded, read - loaded, time.perf_counter() - start)
+
+
+def export_rows(sql: SqlWrapper, table: str) -> Iterator[tuple]:
+    """
+    Yield the rows of a table (one of TABLES) in the order of its TableSpec columns, read in one transaction
+    """
+    with sql.transaction("DEFERRED") as db:
+        yield from db.execute(TABLES[table].export)
+
+
+def write_rows(file: TextIO, columns: Tuple[str, ...], rows: Iterable[tuple], file_format: Literal["csv", "jsonl"] = "csv") -> int:
+    """
+    Write rows to a CSV or JSON lines file as they are yielded, returning the number written
+    """
+    count = 0
+    if file_format == "csv":
+        writer = csv.writer(file)
+        writer.writerow(columns)
+        for count, row in enumerate(rows, 1):
+            writer.writerow(row)
+    elif file_format == "jsonl":
+        for count, row in enumerate(rows, 1):
+            file.write(json.dumps(dict(zip(columns, row))) + "\n")
+    else:
+        raise ValueError(f"Unknown file format '{file_format}'")
+    return count
+
+
+def file_format_of(path: str, file_format: Optional[str]) -> str:
+    return file_format or ("jsonl" if path.endswith((".jsonl", ".json")) else "csv")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk import and export of the Parana tables")
+    parser.add_argument("--database", default=DEFAULT_DB_FILE, help="Path to the database file")
+    commands = parser.add_subparsers(dest="command", required=True)
+    import_parser = commands.add_parser("import", help="Upsert the rows of a file into a table")
+    import_parser.add_argument("table", choices=[name for name, spec in TABLES.items() if spec.upsert is not None])
+    import_parser.add_argument("file", help="CSV or JSON lines file, - for stdin")
+    import_parser.add_argument("--format", choices=("csv", "jsonl"), help="File format, by default from the file extension")
+    import_parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Rows loaded per executemany")
+    import_parser.add_argument("--defer-indexes", action="store_true", help="Rebuild the secondary indexes after the load")
+    export_parser = commands.add_parser("export", help="Write the rows of a table to a file")
+    export_parser.add_argument("table", choices=TABLES)
+    export_parser.add_argument("file", nargs="?", default="-", help="CSV or JSON lines file, - for stdout")
+    export_parser.add_argument("--format", choices=("csv", "jsonl"), help="File format, by default from the file extension")
+    args = parser.parse_args()
+    logging.basicConfig(format="%(levelname)s %(name)s: %(message)s")
+
+    file_format = file_format_of(args.file, args.format)
+    sql = SqlWrapper(args.database)
+    migrate(sql)
+    if args.command == "import":
+        def report_progress(table: str, rows: int, seconds: float) -> None:
+            print(f"\r{table}: {rows:,} rows read, {rows / max(seconds, 1e-9):,.0f} rows/s", end="", file=sys.stderr)
+
+        file = sys.stdin if args.file == "-" else open(args.file, newline="")
+        try:
+            result = import_rows(sql, args.table, read_rows(file, TABLES[args.table].columns, file_format),
+                                 args.chunk_size, args.defer_indexes, report_progress)
+        finally:
+            if file is not sys.stdin:
+                file.close()
+        print(f"\n{args.table}: {result.rows_loaded:,} rows loaded, {result.rows_skipped:,} skipped "
+              f"in {result.seconds:.1f}s", file=sys.stderr)
+    else:
+        file = sys.stdout if args.file == "-" else open(args.file, "w", newline="")
+        try:
+            count = write_rows(file, TABLES[args.table].columns, export_rows(sql, args.table), file_format)
+        finally:
+            if file is not sys.stdout:
+                file.close()
+        print(f"{args.table}: {count:,} rows exported", file=sys.stderr)
+    sql.close()
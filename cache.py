@@ -0,0 +1,81 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+"""
+The bounded LRU/TTL cache behind the in-process caches shared between sessions (catalog.py and profiles.py).
+
+A lookup that misses calls a load function (a query) and keeps what it returns. Entries are evicted least recently
+used first and after a time to live, and can carry a tag (e.g. the catalog version they were read at) that a lookup
+must match. A result loaded while the cache was being invalidated is returned but not kept, as it may be from before
+the change.
+"""
+
+
+class LoadingCache:
+    """
+    A thread-safe LRU/TTL cache that loads what it does not hold, see the module docstring
+    """
+    def __init__(self, max_entries: int, ttl: float) -> None:
+        """
+        Args:
+            max_entries: The most results kept, the least recently used is evicted first
+            ttl: Seconds a result is used for before it is loaded again
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # key -> (time loaded, tag, value)
+        self._entries: OrderedDict[Hashable, Tuple[float, Hashable, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+
+    def get(self, key: Hashable, load: Callable[[], Any], tag: Hashable = None) -> Any:
+        """
+        Return the value cached for key, or load it. A value loaded with a different tag is not used, and None is
+        not cached, so a missing row is looked up again next time.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[0] < self.ttl and entry[1] == tag:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return entry[2]
+            self._misses += 1
+            invalidations = self._invalidations
+
+        # Load outside the lock so one slow query does not hold up the other sessions
+        value = load()
+        with self._lock:
+            if value is None or self._invalidations != invalidations:
+                return value
+            self._entries[key] = (now, tag, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+        return value
+
+    def invalidate(self, matches: Optional[Callable[[Hashable, Any], bool]] = None) -> None:
+        """
+        Drop the entries where matches(key, value) is true, or every entry if matches is None
+        """
+        with self._lock:
+            for key in [key for key, (_, _, value) in self._entries.items() if matches is None or matches(key, value)]:
+                del self._entries[key]
+            self._invalidations += 1
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Return the hit, miss, eviction and invalidation counts
+        """
+        with self._lock:
+            return {"entries": len(self._entries),
+                    "hits": self._hits,
+                    "misses": self._misses,
+                    "evictions": self._evictions,
+                    "invalidations": self._invalidations}
@@ -0,0 +1,92 @@
+import threading
+import time
+from typing import Callable, Dict, Hashable, List, Tuple
+
+from cache import LoadingCache
+from models import Category, Product, SellerOffer
+from sql import SqlWrapper
+
+"""
+In-process cache of the product catalog (categories -> products -> seller offers) browsed by add_item.
+
+The catalog hardly ever changes, so every session can share one cache instead of querying the database on each browse.
+Entries are evicted least recently used first and after a time to live. Changes are picked up through the catalog_version
+row, which triggers bump whenever categories, products, sellers or product_sellers change (see migration 2): when the
+version read from the database moves on, every cached entry for that database is dropped.
+"""
+
+
+class CatalogCache:
+    """
+    A thread-safe LRU/TTL cache of catalog queries, shared between sessions
+    """
+    def __init__(self, max_entries: int = 1024, ttl: float = 300.0, version_check_interval: float = 0.0) -> None:
+        """
+        Args:
+            max_entries: The most query results kept, the least recently used is evicted first
+            ttl: Seconds a cached result is used for before it is read from the database again
+            version_check_interval: Seconds between reads of the catalog version. 0 checks on every lookup, so a
+                                    price change is seen straight away; higher values trade freshness for fewer queries
+        """
+        self.version_check_interval = version_check_interval
+        # (db_file, kind, key) -> result, tagged with the catalog version read before loading it
+        self._cache = LoadingCache(max_entries, ttl)
+        # db_file -> (catalog version, time it was read)
+        self._versions: Dict[str, Tuple[int, float]] = {}
+        self._lock = threading.Lock()
+
+    def categories(self, sql: SqlWrapper) -> List[Category]:
+        """
+        Return every product category, ordered by description
+        """
+        return self._get(sql, "categories", None,
+                         lambda: [Category(*row) for row in sql.select_named("categories")])
+
+    def products(self, sql: SqlWrapper, category_id: int) -> List[Product]:
+        """
+        Return the products in a category, ordered by description
+        """
+        return self._get(sql, "products", category_id,
+                         lambda: [Product(*row) for row in sql.select_named("category_products", sql_parameters=category_id)])
+
+    def offers(self, sql: SqlWrapper, product_id: int) -> List[SellerOffer]:
+        """
+        Return the sellers of a product and their prices, ordered by seller name
+        """
+        return self._get(sql, "offers", product_id,
+                         lambda: [SellerOffer(*row) for row in sql.select_named("product_offers", sql_parameters=product_id)])
+
+    def _get(self, sql: SqlWrapper, kind: str, key: Hashable, load: Callable[[], list]) -> list:
+        return self._cache.get((sql.db_file, kind, key), load, tag=self._check_version(sql))
+
+    def _check_version(self, sql: SqlWrapper) -> int:
+        """
+        Drop the cached entries for the database if its catalog version has changed, returning the version
+        """
+        now = time.monotonic()
+        with self._lock:
+            cached = self._versions.get(sql.db_file)
+            if cached is not None and now - cached[1] < self.version_check_interval:
+                return cached[0]
+        version = sql.select_named("catalog_version", fetch="one")[0]
+        with self._lock:
+            cached = self._versions.get(sql.db_file)
+            if cached is not None and cached[0] != version:
+                self.invalidate(sql.db_file)
+            self._versions[sql.db_file] = (version, now)
+        return version
+
+    def invalidate(self, db_file: str = None) -> None:
+        """
+        Drop the cached entries for a database, or for every database if db_file is None
+        """
+        self._cache.invalidate(None if db_file is None else lambda cache_key, _: cache_key[0] == db_file)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Return the hit, miss, eviction and invalidation counts
+        """
+        return self._cache.stats()
+
+
+CATALOG_CACHE = CatalogCache()
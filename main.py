@@ -1,8 +1,14 @@
-from sql import SqlWrapper
-from tabulate import tabulate
+from sql import SqlWrapper, DEFAULT_DB_FILE
+from migrations import migrate
+from models import BasketItem, ProductSearchResult
+from basket_buffer import DURABILITY_LEVELS, FLUSH_INTERVAL
+from catalog import CatalogCache, CATALOG_CACHE
+from shopper import ShopperService, ShopperError, LATEST_ORDER, ORDER_STATUSES
+from tracing import QueryTracer
+import render
 import datetime
 
-from typing import Tuple, Union, List
+from typing import Any, Iterable, Optional, Sequence, Tuple, Union, List, Dict
 
 """
 Store database in the root directory as 'database' or specify when calling SqlWrapper
@@ -11,41 +17,57 @@ Links Used:
 https://learnpython.com/blog/print-table-in-python/ -> Pretty print a SQL query results in a table
 https://learnsql.com/cookbook/how-to-number-rows-in-sql/ -> Number rows returned from an SQL Query
 https://www.sqlite.org/lang_datefunc.html -> DATE('now'), was returung the incorrect date at midnight. Needs to use local timezone.
+
+Tables are written by render.py rather than tabulate, and the database is only opened once the Shopper ID has been
+entered, so the first prompt appears without waiting for the migrations and the statement warm up
+(python -m benchmarks.startup measures both).
 """
 
 
 class ParanaShopperSession:
     """
     Creates a Shopper session based on the Parana database
+    The menu operations are run by a ShopperService, this class handles the prompts and printing.
     """
 
-    def __init__(self) -> None:
-        self.sql = SqlWrapper()
-        self.shopper_id = self.get_shopper_id()
+    def __init__(self, sql: SqlWrapper = None, catalog: CatalogCache = CATALOG_CACHE, db_file: str = DEFAULT_DB_FILE,
+                 tracer: Optional[QueryTracer] = None, basket_buffer: Optional[str] = None,
+                 flush_interval: Optional[float] = FLUSH_INTERVAL) -> None:
+        """
+        Args:
+            sql: The SqlWrapper to use, pass a pooled wrapper to share connections between sessions.
+                 If None, db_file is opened once the shopper has entered their Shopper ID.
+            catalog: The catalog cache used to browse products, shared between sessions by default
+            db_file: Path to the database file, used when no SqlWrapper is given
+            tracer: Record query timings with this tracer, used when no SqlWrapper is given
+            basket_buffer: Buffer the basket changes with this durability (see basket_buffer.py), None commits each change
+            flush_interval: Seconds a buffered basket change can wait to be written
+        """
+        self.sql = sql
+        self.db_file = db_file
+        self.tracer = tracer
+        self.shopper: Optional[ShopperService] = None
+        self.shopper = self.login(catalog)
+        if basket_buffer is not None:
+            self.shopper.enable_basket_buffer(basket_buffer, flush_interval)
 
         self.welcome()
-
-        self.basket_id = self.get_basket_id()
-        if not self.basket_id:
-            self.basket_id = self.create_basket()
-        else:
-            self.basket_id = self.basket_id[0]
         self.main_loop()
         
     @staticmethod
-    def pretty_print(results: Union[List[Tuple], Tuple], headers: List[str] = []) -> None:
+    def pretty_print(results: Iterable[Sequence[Any]], headers: List[str] = [], footer: Sequence[Any] = None) -> None:
         """
-        Pretty print a table based on the results from an SQL table
+        Pretty print a table based on the results from an SQL table, streaming the rows as they are formatted
         """
-        print(tabulate(results, headers), "\n")
-        
+        render.write_table(results, headers, footer)
+        print()
+
     @staticmethod
-    def display_options(options: List[Tuple[str]]) -> None:
+    def display_options(options: Iterable[Tuple[str]]) -> None:
         """
         Displays the options returned from an SQL query as a numbered list
         """
-        for i, option in enumerate(options, start=1):
-            print(f"{i}.\t{"  ".join(str(row) for row in option)}")
+        render.write_options(options)
         print("\n")
 
     @staticmethod
@@ -63,6 +85,18 @@ class ParanaShopperSession:
         elif selected_option.upper() == "N":
             return False
 
+    @staticmethod
+    def prompt_option(prompt: str, options: List[str]) -> str:
+        """
+        Prompts the user to choose one of the single letter options
+        """
+        while True:
+            selected_option = input(prompt).strip().upper()
+            if selected_option in options:
+                print()
+                return selected_option
+            print(f"Please enter {'/'.join(options)}\n")
+
     @staticmethod
     def prompt_number(prompt: str, _range: Tuple[int, Union[int, None]] = None, error_message: str = "Invalid Value!") -> int:
         """
@@ -100,193 +134,227 @@ class ParanaShopperSession:
         return selected_option
     
     @staticmethod
-    def remove_money_format(value: str) -> List[Tuple[int, str]]:
+    def format_date(value: str) -> str:
         """
-        Remove strings that are formatted with £ and/or ().
-        e.g. convert (£5.32) -> 5.32
+        Format a date stored as YYYY-MM-DD for display.
+        e.g. convert 2019-02-02 -> 02-02-2019
         """
-        return value.replace("£", "").replace(")", "").replace("(", "")
+        return datetime.date.fromisoformat(value).strftime("%d-%m-%Y")
 
-    def get_shopper_id(self) -> int:
+    @staticmethod
+    def format_money(value: float) -> str:
         """
-        Return the shopper ID, validating that the shopper ID is in the database
+        Format an amount of money for display.
+        e.g. convert 5.3 -> £5.30
         """
-        try:
-            shopper_id = int(input("Please enter your Shopper ID: "))
-        except ValueError:
-            print("Shopper ID is not a valid Shopper ID")
-            self.close()
-        shoppers = self.sql.select_query("SELECT shopper_id "
-                                         "FROM shoppers")
-        if shopper_id not in [shopper[0] for shopper in shoppers]:
-            print(f"Shopper ID {shopper_id} is not a valid Shopper ID")
-            self.close()
-        return shopper_id
+        return f"£{value:.2f}"
 
-    def get_basket_id(self) -> int:
+    def open_database(self) -> None:
         """
-        If there is a basket created from today, use that basket and return the basket_id
+        Open the database if no SqlWrapper was given, and bring it up to date
         """
-        # Must use localtime, otherwise breaks at midnight
-        return self.sql.select_query("SELECT basket_id "
-                                     "FROM shopper_baskets "
-                                     "WHERE shopper_id = ? AND DATE(basket_created_date_time) = DATE('now', 'localtime') "
-                                     "ORDER BY basket_created_date_time DESC "
-                                     "LIMIT 1", sql_parameters=(self.shopper_id,), fetch="one")
+        if self.sql is None:
+            self.sql = SqlWrapper(self.db_file, tracer=self.tracer)
+        migrate(self.sql)
+        # Prepare every query up front, so the first menu action does not pay for compiling its statements
+        self.sql.warm_up()
 
-    def create_basket(self) -> int:
+    def login(self, catalog: CatalogCache) -> ShopperService:
         """
-        If a basket is not already created from today, then create a new basket
+        Prompt for the Shopper ID (or account reference), returning the service for the shopper once it is validated
         """
-        self.sql.update_table("INSERT INTO shopper_baskets (shopper_id, basket_created_date_time) "
-                              "VALUES (?, ?)", sql_parameters=(self.shopper_id, datetime.datetime.now().strftime("%Y-%m-%d"),))
-        return self.sql.cursor.lastrowid
+        shopper_login = input("Please enter your Shopper ID: ")
+        self.open_database()
+        try:
+            return ShopperService.authenticate(self.sql, shopper_login, catalog)
+        except ShopperError as e:
+            print(e)
+            self.close()
 
     def welcome(self) -> None:
         """
         Prints a welcome message to the shopper
         """
-        shopper_first_name, shopper_surname = self.sql.select_query("SELECT shopper_first_name, shopper_surname "
-                                                                    "FROM shoppers "
-                                                                    "WHERE shopper_id = ? ",
-                                                                    sql_parameters=(self.shopper_id,),
-                                                                    fetch="one")
+        shopper_first_name, shopper_surname = self.shopper.shopper_name()
 
         print(f"Welcome {shopper_first_name} {shopper_surname}!\n")
 
+    def prompt_order_history_filters(self) -> Dict[str, str]:
+        """
+        Prompts the shopper for a date range and order status to filter their order history by. Blank answers are not filtered on.
+        """
+        filters = {}
+        for key, prompt in (("date_from", "Show orders placed from (DD-MM-YYYY, blank for any): "),
+                            ("date_to", "Show orders placed until (DD-MM-YYYY, blank for any): ")):
+            while True:
+                answer = input(prompt).strip()
+                if not answer:
+                    break
+                try:
+                    filters[key] = datetime.datetime.strptime(answer, "%d-%m-%Y").strftime("%Y-%m-%d")
+                    break
+                except ValueError:
+                    print("Please enter a date as DD-MM-YYYY\n")
+
+        while True:
+            answer = input(f"Show orders with status ({'/'.join(ORDER_STATUSES)}, blank for any): ").strip().capitalize()
+            if not answer or answer in ORDER_STATUSES:
+                break
+            print("Invalid order status!\n")
+        if answer:
+            filters["status"] = answer
+        print()
+        return filters
+
     def display_order_history(self) -> None:
         """
-        Display the order history of the shopper (Option 1)
-        """
-        order_history = self.sql.select_query("SELECT so.order_id, "
-                                              "STRFTIME('%d-%m-%Y', so.order_date), "
-                                              "p.product_description, "
-                                              "se.seller_name, "
-                                              "PRINTF('£%.2f',op.price), "
-                                              "op.quantity, "
-                                              "ordered_product_status "
-                                              "FROM shoppers as s "
-                                              "INNER JOIN shopper_orders so ON s.shopper_id = so.shopper_id "
-                                              "INNER JOIN ordered_products op ON so.order_id = op.order_id "
-                                              "INNER JOIN product_sellers ps ON op.product_id = ps.product_id "
-                                              "AND op.seller_id = ps.seller_id "
-                                              "INNER JOIN sellers se ON ps.seller_id = se.seller_id "
-                                              "INNER JOIN products p ON ps.product_id = p.product_id "
-                                              "WHERE s.shopper_id= ? "
-                                              "ORDER BY so.order_date DESC", sql_parameters=(self.shopper_id,))
-        if not order_history:
-            print("No orders placed by this customer\n")
-        else:
-            self.pretty_print(results=order_history, headers=[
-                              "Order ID", "Order Date", "Product Description", "Seller", "Price", "Qty", "Status"])
+        Display the order history of the shopper a page at a time (Option 1)
+        """
+        summary = self.shopper.order_summary()
+        if summary.order_count:
+            print(f"{summary.order_count} order(s) placed, {self.format_money(summary.lifetime_spend)} spent in total. "
+                  f"Last order placed on {self.format_date(summary.last_order_date)}\n")
+
+        filters = {}
+        # The key each visited page starts from, so Previous can go back without OFFSET
+        pages = [LATEST_ORDER]
+        while True:
+            order_history, next_page = self.shopper.order_history_page(pages[-1], **filters)
+            if not order_history:
+                print("No orders found for this customer\n" if filters else "No orders placed by this customer\n")
+            else:
+                self.pretty_print(results=((line.order_id, self.format_date(line.order_date), line.product_description, line.seller_name,
+                                            self.format_money(line.price), line.quantity, line.order_status, line.ordered_product_status)
+                                           for line in order_history), headers=[
+                                  "Order ID", "Order Date", "Product Description", "Seller", "Price", "Qty", "Order Status",
+                                  "Item Status"])
+                print(f"Page {len(pages)}\n")
+
+            options = {}
+            if next_page is not None:
+                options["N"] = "[N]ext page"
+            if len(pages) > 1:
+                options["P"] = "[P]revious page"
+            if order_history or filters:
+                options["F"] = "[F]ilter"
+            if not options:
+                return
+            options["Q"] = "[Q]uit to the main menu"
+
+            match self.prompt_option(f"{', '.join(options.values())}: ", list(options)):
+                case "N":
+                    pages.append(next_page)
+                case "P":
+                    pages.pop()
+                case "F":
+                    filters = self.prompt_order_history_filters()
+                    pages = [LATEST_ORDER]
+                case "Q":
+                    return
 
     def add_item(self) -> None:
         """
         Add item to the shoppers basket. (Option 2)
-        Choose product categories -> products -> sellers -> quantity
+        Search for a product, or choose product categories -> products. Then sellers -> quantity
         """
-        product_categories = self.sql.select_query("SELECT category_description "
-                                                   "FROM categories "
-                                                   "ORDER BY category_description ASC ")
-        self.display_options(product_categories)
-        
-        selected_category = self.prompt_number(prompt="Enter the number against the product category you want to choose: ",
-                                               _range=(1, len(product_categories)))
+        if self.prompt_option("Search for a product (S) or browse the product categories (C)? ", ["S", "C"]) == "S":
+            product = self.search_product()
+            if product is None:
+                return
+        else:
+            product_categories = self.shopper.categories()
+            self.display_options([(category.category_description,) for category in product_categories])
 
-        selected_category_id = self.sql.select_query("SELECT category_id "
-                                                     "FROM categories "
-                                                     "WHERE category_description = ?", sql_parameters=product_categories[selected_category-1], fetch="one")
-        
-        products = self.sql.select_query("SELECT product_description "
-                                         "FROM products "
-                                         "WHERE category_id = ? "
-                                         "ORDER BY product_description ASC ", sql_parameters=selected_category_id)
-        self.display_options(products)
-        
-        selected_product = self.prompt_number(prompt="Enter the number against the product you want to choose: ",
-                                              _range=(1, len(products)))
+            selected_category = self.prompt_number(prompt="Enter the number against the product category you want to choose: ",
+                                                   _range=(1, len(product_categories)))
+            category = product_categories[selected_category-1]
 
-        selected_product_id = self.sql.select_query("SELECT product_id "
-                                                    "FROM products "
-                                                    "WHERE product_description = ?", sql_parameters=products[selected_product-1], fetch="one")
+            products = self.shopper.products(category.category_id)
+            self.display_options([(product.product_description,) for product in products])
 
-        sellers = self.sql.select_query("SELECT s.seller_name, PRINTF('(£%.2f)', ps.price) "
-                                        "FROM sellers s "
-                                        "INNER JOIN product_sellers ps ON s.seller_id = ps.seller_id "
-                                        "WHERE ps.product_id = ? "
-                                        "ORDER BY s.seller_name ASC ", sql_parameters=selected_product_id)
-        self.display_options(sellers)
+            selected_product = self.prompt_number(prompt="Enter the number against the product you want to choose: ",
+                                                  _range=(1, len(products)))
+            product = products[selected_product-1]
+
+        sellers = self.shopper.offers(product.product_id)
+        self.display_options([(seller.seller_name, f"({self.format_money(seller.price)})") for seller in sellers])
         
         selected_seller = self.prompt_number(prompt="Enter the number against the seller you want to choose: ",
                                              _range=(1, len(sellers)))
-
-        selected_seller_id = self.sql.select_query("SELECT seller_id "
-                                                   "FROM sellers "
-                                                   "WHERE seller_name = ?", sql_parameters=sellers[selected_seller-1][0], fetch="one")
+        seller = sellers[selected_seller-1]
 
         quantity = self.prompt_number(prompt="Enter the quantity of the selected product you want to buy: ", _range=(1, None),
                                       error_message="The quantity must be greater than 0")
-        
-        # NOTE: ix. in the brief says to create a new basket here, if there is not already one. This is done when initialising the session.
-
-        query_status = self.sql.update_table("INSERT INTO basket_contents (basket_id, product_id, seller_id, quantity, price) "
-                                             "VALUES (?, ?, ?, ?, ?)",
-                                             sql_parameters=(self.basket_id, selected_product_id[0], selected_seller_id[0], quantity,
-                                                             self.remove_money_format(sellers[selected_seller-1][1]))) 
 
-        if query_status is None:
-            print("Item added to your basket\n")
+        try:
+            self.shopper.add_item(product.product_id, seller.seller_id, quantity)
+        except ShopperError as e:
+            print(f"{e}\n")
         else:
-            print("That item is already in your basket. Please edit the quantity of the item in Option 4, or delete the item in Option 5\n")
+            print("Item added to your basket\n")
+
+    def search_product(self) -> Union[ProductSearchResult, None]:
+        """
+        Prompt for words to search for and a product from the results, returning None if nothing was found
+        """
+        products = self.shopper.search(input("Enter the words to search for: "))
+        if not products:
+            print("No products found\n")
+            return None
+        self.display_options([(product.product_description, f"({product.category_description})",
+                                f"from {self.format_money(product.best_price)}" if product.best_price is not None else "(no sellers)")
+                              for product in products])
 
-    def display_basket(self) -> None:
+        selected_product = self.prompt_number(prompt="Enter the number against the product you want to choose: ",
+                                              _range=(1, len(products)))
+        return products[selected_product-1]
+
+    def display_basket(self) -> List[BasketItem]:
         """
         Display the contents of the shoppers basket (Option 3)
         """
-        basket_contents = self.sql.select_query("SELECT ROW_NUMBER() OVER(), p.product_description, s.seller_name, bc.quantity, PRINTF('£%.2f', bc.price), PRINTF('£%.2f', bc.price * bc.quantity) "
-                                                "FROM basket_contents bc "
-                                                "INNER JOIN product_sellers ps ON bc.product_id = ps.product_id and bc.seller_id = ps.seller_id "
-                                                "INNER JOIN products p ON p.product_id = ps.product_id "
-                                                "INNER JOIN sellers s ON s.seller_id = ps.seller_id "
-                                                "WHERE bc.basket_id = ?", sql_parameters=self.basket_id)
+        basket_contents = self.shopper.basket()
 
         if not basket_contents:
             print("Your basket is empty\n")
             return basket_contents
-        else:
-            # Abit of a botched way... looks okay so oh well.
-            basket_contents.append((None, None, None, None, "Basket Total", f'£{sum(
-                [float(self.remove_money_format(item[5])) for item in basket_contents])}'))
-            self.pretty_print(basket_contents, headers=[
-                              "Basket Item", "Product Description", "Seller Name", "Qty", "Price", "Total"])
+
+        rows = ((i, item.product_description, item.seller_name, item.quantity, self.format_money(item.price), self.format_money(item.total))
+                for i, item in enumerate(basket_contents, start=1))
+        self.pretty_print(rows, headers=["Basket Item", "Product Description", "Seller Name", "Qty", "Price", "Total"],
+                          footer=(None, None, None, None, "Basket Total", self.format_money(self.shopper.basket_summary().total)))
 
         return basket_contents
 
+    def select_basket_item(self, basket_contents: List[BasketItem]) -> BasketItem:
+        """
+        Prompt the shopper for the basket item no. of an item in their basket
+        """
+        if len(basket_contents) > 1:
+            basket_item_number = self.prompt_number("Enter the basket item no. of the item you want to change: ", _range=(1, len(basket_contents)),
+                                                    error_message="The basket item no. you have entered is invalid")
+        else:
+            basket_item_number = 1
+        return basket_contents[basket_item_number-1]
+
     def change_quantity(self) -> None:
         """
         Change the quantity of an item in the basket. (Option 4)
-        The basket_contents table has 2 primary keys. basket_id and product_id.
-        So there can only be 1 of a product added to a basket, even if they are from different sellers.
         """
         basket_contents = self.display_basket()
         if not basket_contents:
             return
 
-        # basket_contents is returned with the botched basket total column, so 2 instead of 1.
-        if len(basket_contents) > 2:
-            basket_item_number = self.prompt_number("Enter the basket item no. of the item you want to change: ", _range=(1, len(basket_contents)-1),
-                                                    error_message="The basket item no. you have entered is invalid")
-        else:
-            basket_item_number = 1
+        item = self.select_basket_item(basket_contents)
 
         quantity = self.prompt_number("Enter the new quantity of the selected product you want to buy: ", _range=(1, None),
                                       error_message="The quantity must be greater than 0")
 
-        self.sql.update_table("UPDATE basket_contents "
-                              "SET quantity = ? "
-                              "WHERE product_id = (SELECT product_id "
-                              "FROM products "
-                              "WHERE product_description = ?) and basket_id = ? ", sql_parameters=(quantity, basket_contents[basket_item_number-1][1], self.basket_id))
+        try:
+            self.shopper.change_quantity(item.product_id, quantity)
+        except ShopperError as e:
+            print(f"{e}\n")
+            return
 
         self.display_basket()
 
@@ -298,21 +366,17 @@ class ParanaShopperSession:
         if not basket_contents:
             return
 
-        # basket_contents is returned with the botched basket total column, so 2 instead of 1.
-        if len(basket_contents) > 2:
-            basket_item_number = self.prompt_number("Enter the basket item no. of the item you want to change: ", _range=(1, len(basket_contents)-1),
-                                                    error_message="The basket item no. you have entered is invalid")
-        else:
-            basket_item_number = 1
+        item = self.select_basket_item(basket_contents)
 
         answer = self.prompt_yes_no(
             "Do you definitly want to delete this product from your basket (Y/N)? ")
 
         if answer:
-            self.sql.update_table("DELETE FROM basket_contents "
-                                  "WHERE product_id = (SELECT product_id "
-                                  "FROM products WHERE "
-                                  "product_description = ?) and basket_id = ?", sql_parameters=(basket_contents[basket_item_number-1][1], self.basket_id))
+            try:
+                self.shopper.remove_item(item.product_id)
+            except ShopperError as e:
+                print(f"{e}\n")
+                return
 
             self.display_basket()
         else:
@@ -332,30 +396,11 @@ class ParanaShopperSession:
             "Do you wish to proceed with the checkout (Y/N)? ")
 
         if answer:
-            # Dont commit any changes untill the final query. To ensure all tables are updated correctly first.
-            
-            # Insert row into shoppers_orders
-            self.sql.update_table("INSERT INTO shopper_orders (shopper_id, order_date, order_status) "
-                                  "VALUES (?, ?, ?)", sql_parameters=(self.shopper_id, datetime.datetime.now().strftime("%Y-%m-%d"), "Placed"), commit=False)
-            order_id = self.sql.cursor.lastrowid
-            
-            # Insert row into ordered_products
-            for item in basket_contents[:-1]:
-                self.sql.update_table("INSERT INTO ordered_products (order_id, product_id, seller_id, quantity, price, ordered_product_status) "
-                                      "VALUES (?, (SELECT product_id "
-                                      "FROM products WHERE "
-                                      "product_description = ?), (SELECT seller_id "
-                                      "FROM sellers WHERE "
-                                      "seller_name = ?), ?, ?, ?)", 
-                                      sql_parameters=(order_id, item[1], item[2], item[3], self.remove_money_format(item[4]), "Placed"), commit=False)
-
-            # Delete rows in basket_contents associated with the basket
-            self.sql.update_table("DELETE FROM basket_contents "
-                                  "WHERE basket_id = ?", sql_parameters=(self.basket_id), commit=False)
-
-            # Delete basket in shopper_baskets
-            self.sql.update_table("DELETE FROM shopper_baskets "
-                                  "WHERE basket_id = ?", sql_parameters=(self.basket_id))
+            try:
+                self.shopper.checkout()
+            except ShopperError as e:
+                print(f"{e}\n")
+                return
 
             print("Checkout complete, your order has been placed\n")
 
@@ -363,7 +408,10 @@ class ParanaShopperSession:
             return
         
     def close(self):
-        self.sql.close()
+        if self.shopper is not None:
+            self.shopper.close()
+        if self.sql is not None:
+            self.sql.close()
         quit()
 
     def main_menu(self) -> int:
@@ -412,4 +460,27 @@ class ParanaShopperSession:
 
 
 if __name__ == "__main__":
-    ParanaShopperSession()
+    # Only needed to start a session from the command line, so importing this module does not pay for them
+    import argparse
+    import logging
+
+    parser = argparse.ArgumentParser(description="Start a Parana shopper session")
+    parser.add_argument("--database", default=DEFAULT_DB_FILE, help="Path to the database file")
+    parser.add_argument("--trace", action="store_true", help="Record query timings, a summary is logged when the session ends")
+    parser.add_argument("--slow-query-ms", type=float, default=100, help="Log traced queries slower than this")
+    parser.add_argument("--trace-export", default=None, help="Write the traced query stats to this file when the session ends")
+    parser.add_argument("--trace-format", choices=["jsonl", "prometheus"], default="jsonl", help="Format of --trace-export")
+    parser.add_argument("--trace-log", default=None, help="Write the trace log to this file instead of stderr")
+    parser.add_argument("--basket-buffer", choices=DURABILITY_LEVELS, default=None,
+                        help="Buffer the basket changes with this durability, instead of committing each one")
+    parser.add_argument("--flush-interval", type=float, default=FLUSH_INTERVAL,
+                        help="Seconds a buffered basket change can wait to be written")
+    args = parser.parse_args()
+
+    tracer = None
+    if args.trace:
+        logging.basicConfig(level=logging.INFO, filename=args.trace_log)
+        tracer = QueryTracer(slow_query_seconds=args.slow_query_ms / 1000, export_path=args.trace_export,
+                             export_format=args.trace_format)
+    ParanaShopperSession(db_file=args.database, tracer=tracer, basket_buffer=args.basket_buffer,
+                         flush_interval=args.flush_interval)
@@ -0,0 +1,274 @@
+import argparse
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, NamedTuple, Optional
+
+from migrations import migrate
+from sql import SqlWrapper, DEFAULT_DB_FILE
+
+"""
+Database maintenance, run once or on a schedule.
+
+expire_baskets      Delete baskets (and their contents) that can no longer be used. A basket is only reused on the day it
+                    was created, KEEP_BASKET_DAYS more days are kept for sessions still open from before midnight.
+                    Baskets are deleted BASKET_BATCH_SIZE at a time, each batch in its own short transaction with a pause
+                    between batches, so shoppers adding to their baskets are never blocked for long.
+optimize            PRAGMA optimize, re-analyzes the tables whose statistics are out of date
+checkpoint          PRAGMA wal_checkpoint(TRUNCATE), copies the write-ahead log into the database and truncates it
+incremental_vacuum  Returns free pages to the file system, VACUUM_STEP_PAGES at a time. Needs auto_vacuum=INCREMENTAL,
+                    which enable_incremental_vacuum sets (with a full VACUUM, once).
+
+Every task returns what it reclaimed. MaintenanceScheduler runs the tasks on a background thread when they are due
+and logs a line for each run to the parana.maintenance logger.
+
+Usage:
+python maintenance.py [--database PATH] [--tasks TASK...]          -> run the tasks once and report
+python maintenance.py [--database PATH] --schedule                 -> run the tasks on their schedule until interrupted
+python maintenance.py [--database PATH] --enable-incremental-vacuum
+"""
+
+KEEP_BASKET_DAYS = 1
+BASKET_BATCH_SIZE = 500
+BATCH_PAUSE = 0.05
+VACUUM_STEP_PAGES = 1000
+
+# Seconds between runs of each task
+SCHEDULE = {
+    "expire_baskets": 3600.0,
+    "optimize": 3600.0,
+    "checkpoint": 300.0,
+    "incremental_vacuum": 86400.0,
+}
+
+logger = logging.getLogger("parana.maintenance")
+
+
+class TaskResult(NamedTuple):
+    task: str
+    started: float
+    seconds: float
+    details: Dict[str, Any]
+    error: Optional[str] = None
+
+    def __str__(self) -> str:
+        if self.error:
+            outcome = f"failed: {self.error}"
+        else:
+            outcome = ", ".join(f"{key}={value}" for key, value in self.details.items()) or "done"
+        return f"{self.task} ({self.seconds * 1000:.1f}ms): {outcome}"
+
+
+def _pages(sql: SqlWrapper) -> Dict[str, int]:
+    return {"page_size": sql.select_query("PRAGMA page_size", fetch="one")[0],
+            "page_count": sql.select_query("PRAGMA page_count", fetch="one")[0],
+            "freelist_count": sql.select_query("PRAGMA freelist_count", fetch="one")[0]}
+
+
+def expire_baskets(sql: SqlWrapper, keep_days: int = KEEP_BASKET_DAYS, batch_size: int = BASKET_BATCH_SIZE,
+                   pause: float = BATCH_PAUSE, stop: threading.Event = None) -> Dict[str, Any]:
+    """
+    Delete the baskets created before today, less keep_days, in batches
+
+    Args:
+        sql: The database
+        keep_days: Days of baskets kept before today
+        batch_size: Baskets deleted per transaction
+        pause: Seconds to wait between batches
+        stop: Stop after the current batch when this is set
+    """
+    cutoff = sql.select_query("SELECT DATE('now', 'localtime', ?)", sql_parameters=(f"-{keep_days} days",), fetch="one")[0]
+    batch = ("SELECT basket_id FROM shopper_baskets WHERE basket_created_date_time < ? "
+             "ORDER BY basket_created_date_time LIMIT ?")
+
+    def delete_batch() -> tuple:
+        contents = sql.execute(f"DELETE FROM basket_contents WHERE basket_id IN ({batch})", (cutoff, batch_size)).rowcount
+        baskets = sql.execute(f"DELETE FROM shopper_baskets WHERE basket_id IN ({batch})", (cutoff, batch_size)).rowcount
+        return baskets, contents
+
+    baskets = lines = batches = 0
+    while stop is None or not stop.is_set():
+        deleted, contents = sql.run_in_transaction(delete_batch)
+        if not deleted:
+            break
+        baskets += deleted
+        lines += contents
+        batches += 1
+        time.sleep(pause)
+    return {"cutoff": cutoff, "baskets_deleted": baskets, "lines_deleted": lines, "batches": batches}
+
+
+def optimize(sql: SqlWrapper) -> Dict[str, Any]:
+    """
+    Run PRAGMA optimize
+    """
+    sql.execute("PRAGMA optimize")
+    return {}
+
+
+def checkpoint(sql: SqlWrapper) -> Dict[str, Any]:
+    """
+    Checkpoint the write-ahead log and truncate it. busy is 1 if a reader kept the checkpoint from completing.
+    """
+    wal_file = sql.db_file + "-wal"
+    size_before = os.path.getsize(wal_file) if os.path.exists(wal_file) else 0
+    busy, log_pages, checkpointed = sql.select_query("PRAGMA wal_checkpoint(TRUNCATE)", fetch="one")
+    if log_pages == -1:
+        return {"skipped": "not in WAL mode"}
+    size_after = os.path.getsize(wal_file) if os.path.exists(wal_file) else 0
+    return {"busy": busy, "log_pages": log_pages, "checkpointed_pages": checkpointed,
+            "wal_bytes_reclaimed": size_before - size_after}
+
+
+def incremental_vacuum(sql: SqlWrapper, step_pages: int = VACUUM_STEP_PAGES, pause: float = BATCH_PAUSE,
+                       stop: threading.Event = None) -> Dict[str, Any]:
+    """
+    Free the pages on the freelist, step_pages per transaction
+    """
+    before = _pages(sql)
+    if sql.select_query("PRAGMA auto_vacuum", fetch="one")[0] != 2:
+        return {"skipped": "auto_vacuum is not INCREMENTAL", "free_pages": before["freelist_count"]}
+    free_pages = before["freelist_count"]
+    while free_pages and (stop is None or not stop.is_set()):
+        # execute() stops incremental_vacuum after its first step (one page), executescript runs it to completion.
+        # It runs outside a transaction, so each step is committed on its own.
+        with sql.connection() as db:
+            db.executescript(f"PRAGMA incremental_vacuum({int(step_pages)});")
+        left = sql.select_query("PRAGMA freelist_count", fetch="one")[0]
+        if left >= free_pages:
+            break
+        free_pages = left
+        time.sleep(pause)
+    after = _pages(sql)
+    return {"pages_freed": before["page_count"] - after["page_count"],
+            "bytes_reclaimed": (before["page_count"] - after["page_count"]) * before["page_size"],
+            "free_pages_left": after["freelist_count"]}
+
+
+def enable_incremental_vacuum(sql: SqlWrapper) -> Dict[str, Any]:
+    """
+    Switch the database to auto_vacuum=INCREMENTAL. This rewrites the whole database (VACUUM) and locks it while it runs.
+    """
+    before = _pages(sql)
+    sql.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    sql.execute("VACUUM")
+    after = _pages(sql)
+    return {"bytes_reclaimed": (before["page_count"] - after["page_count"]) * before["page_size"]}
+
+
+TASKS: Dict[str, Callable[..., Dict[str, Any]]] = {
+    "expire_baskets": expire_baskets,
+    "optimize": optimize,
+    "checkpoint": checkpoint,
+    "incremental_vacuum": incremental_vacuum,
+}
+
+
+def run_task(sql: SqlWrapper, task: str, **options) -> TaskResult:
+    """
+    Run a task, timing it. A database error is returned in the result rather than raised.
+    """
+    started = time.time()
+    start = time.perf_counter()
+    try:
+        details = TASKS[task](sql, **options)
+        error = None
+    except Exception as e:
+        details, error = {}, str(e)
+    return TaskResult(task, started, time.perf_counter() - start, details, error)
+
+
+class MaintenanceScheduler:
+    """
+    Runs the maintenance tasks when they are due, on a background thread
+    """
+
+    def __init__(self, sql: SqlWrapper, schedule: Dict[str, float] = None, keep_days: int = KEEP_BASKET_DAYS,
+                 history_size: int = 100) -> None:
+        """
+        Args:
+            sql: The database, it must be pooled to be used from the scheduler thread by start()
+            schedule: Seconds between runs of each task, defaults to SCHEDULE
+            keep_days: Days of baskets kept before today
+            history_size: The number of task results kept
+        """
+        self.sql = sql
+        self.schedule = dict(SCHEDULE if schedule is None else schedule)
+        self.keep_days = keep_days
+        self.history: Deque[TaskResult] = deque(maxlen=history_size)
+        # Every task is due as soon as the scheduler starts
+        self._next_run = {task: 0.0 for task in self.schedule}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def run_pending(self) -> List[TaskResult]:
+        """
+        Run the tasks that are due, returning their results
+        """
+        results = []
+        for task, interval in self.schedule.items():
+            if self._stop.is_set():
+                break
+            if time.monotonic() >= self._next_run[task]:
+                options = {"stop": self._stop} if task in ("expire_baskets", "incremental_vacuum") else {}
+                if task == "expire_baskets":
+                    options["keep_days"] = self.keep_days
+                result = run_task(self.sql, task, **options)
+                self._next_run[task] = time.monotonic() + interval
+                self.history.append(result)
+                (logger.error if result.error else logger.info)("%s", result)
+                results.append(result)
+        return results
+
+    def run_forever(self) -> None:
+        """
+        Run the tasks as they fall due until stop() is called
+        """
+        while not self._stop.is_set():
+            self.run_pending()
+            self._stop.wait(max(0.0, min(self._next_run.values()) - time.monotonic()))
+
+    def start(self) -> None:
+        """
+        Run the scheduler on a daemon thread
+        """
+        self._thread = threading.Thread(target=self.run_forever, name="parana-maintenance", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """
+        Stop the scheduler, waiting for the task it is running to finish its current batch
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the Parana database maintenance tasks")
+    parser.add_argument("--database", default=DEFAULT_DB_FILE, help="Path to the database file")
+    parser.add_argument("--tasks", nargs="+", choices=TASKS, default=list(TASKS), help="The tasks to run")
+    parser.add_argument("--keep-days", type=int, default=KEEP_BASKET_DAYS, help="Days of baskets kept before today")
+    parser.add_argument("--schedule", action="store_true", help="Keep running the tasks on their schedule")
+    parser.add_argument("--enable-incremental-vacuum", action="store_true",
+                        help="Switch the database to auto_vacuum=INCREMENTAL (rewrites the whole database)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s: %(message)s")
+
+    sql = SqlWrapper(args.database)
+    migrate(sql)
+    if args.enable_incremental_vacuum:
+        print(f"auto_vacuum=INCREMENTAL: {enable_incremental_vacuum(sql)}")
+    elif args.schedule:
+        scheduler = MaintenanceScheduler(sql, {task: SCHEDULE[task] for task in args.tasks}, args.keep_days)
+        try:
+            scheduler.run_forever()
+        except KeyboardInterrupt:
+            pass
+    else:
+        for task in args.tasks:
+            print(run_task(sql, task, **({"keep_days": args.keep_days} if task == "expire_baskets" else {})))
+    sql.close()
@@ -0,0 +1,319 @@
+import sqlite3
+from typing import List, NamedTuple, Set, Tuple
+
+from queries import QUERIES, QueryRegistry
+from sql import SqlWrapper, DEFAULT_DB_FILE
+
+"""
+Versioned schema migrations for the Parana database.
+
+The schema version is stored in PRAGMA user_version. Migrations are applied in order, each one in its own
+transaction together with the version bump, and the query planner statistics are refreshed with ANALYZE afterwards.
+
+Usage:
+python migrations.py [--database PATH]           -> apply any pending migrations
+python migrations.py [--database PATH] --check   -> print the query plan of every registered query, flagging full table scans
+"""
+
+
+# The product_search rows for the products, used to fill the search index and to rebuild it (see search.py)
+PRODUCT_SEARCH_ROWS = ("(rowid, product_description, product_manufacturer, product_model, category_description) "
+                       "SELECT p.product_id, p.product_description, p.product_manufacturer, p.product_model, "
+                       "(SELECT category_description FROM categories WHERE category_id = p.category_id) "
+                       "FROM products p")
+INSERT_NEW_PRODUCT_SEARCH_ROW = ("INSERT INTO product_search "
+                                 "(rowid, product_description, product_manufacturer, product_model, category_description) "
+                                 "VALUES (NEW.product_id, NEW.product_description, NEW.product_manufacturer, NEW.product_model, "
+                                 "(SELECT category_description FROM categories WHERE category_id = NEW.category_id))")
+
+
+# The rows of each summary table computed from scratch, used to fill the summaries, check them and rebuild them (see summaries.py).
+# Cancelled order lines do not count towards spend, revenue or units sold. Money is rounded to pennies.
+SUMMARY_ROWS = {
+    "shopper_order_summary":
+        "SELECT so.shopper_id, COUNT(*), "
+        "ROUND(COALESCE(SUM((SELECT SUM(op.price * op.quantity) FROM ordered_products op "
+        "WHERE op.order_id = so.order_id AND op.ordered_product_status IS NOT 'Cancelled')), 0), 2), "
+        "MAX(so.order_date) "
+        "FROM shopper_orders so "
+        "GROUP BY so.shopper_id",
+    "seller_sales_summary":
+        "SELECT seller_id, ROUND(SUM(price * quantity), 2), SUM(quantity) "
+        "FROM ordered_products "
+        "WHERE ordered_product_status IS NOT 'Cancelled' "
+        "GROUP BY seller_id",
+    "basket_summary":
+        "SELECT basket_id, COUNT(*), ROUND(SUM(price * quantity), 2) "
+        "FROM basket_contents "
+        "GROUP BY basket_id",
+}
+
+
+def _line_spend(row: str) -> str:
+    return f"(CASE WHEN {row}.ordered_product_status IS 'Cancelled' THEN 0 ELSE {row}.price * {row}.quantity END)"
+
+
+def _line_units(row: str) -> str:
+    return f"(CASE WHEN {row}.ordered_product_status IS 'Cancelled' THEN 0 ELSE {row}.quantity END)"
+
+
+def _order_spend(order_id: str) -> str:
+    return (f"(SELECT COALESCE(SUM(price * quantity), 0) FROM ordered_products "
+            f"WHERE order_id = {order_id} AND ordered_product_status IS NOT 'Cancelled')")
+
+
+# Trigger bodies that add a row's contribution to the summaries (NEW) or take it away (OLD)
+ADD_ORDER = ("INSERT INTO shopper_order_summary (shopper_id, order_count, lifetime_spend, last_order_date) "
+             f"VALUES (NEW.shopper_id, 1, ROUND({_order_spend('NEW.order_id')}, 2), NEW.order_date) "
+             "ON CONFLICT (shopper_id) DO UPDATE SET order_count = order_count + 1, "
+             "lifetime_spend = ROUND(lifetime_spend + excluded.lifetime_spend, 2), "
+             "last_order_date = MAX(COALESCE(last_order_date, ''), excluded.last_order_date);")
+REMOVE_ORDER = ("UPDATE shopper_order_summary SET order_count = order_count - 1, "
+                f"lifetime_spend = ROUND(lifetime_spend - {_order_spend('OLD.order_id')}, 2), "
+                "last_order_date = (SELECT MAX(order_date) FROM shopper_orders WHERE shopper_id = OLD.shopper_id) "
+                "WHERE shopper_id = OLD.shopper_id;")
+ADD_ORDER_LINE = ("UPDATE shopper_order_summary "
+                  f"SET lifetime_spend = ROUND(lifetime_spend + {_line_spend('NEW')}, 2) "
+                  "WHERE shopper_id = (SELECT shopper_id FROM shopper_orders WHERE order_id = NEW.order_id); "
+                  "INSERT INTO seller_sales_summary (seller_id, revenue, units_sold) "
+                  f"VALUES (NEW.seller_id, ROUND({_line_spend('NEW')}, 2), {_line_units('NEW')}) "
+                  "ON CONFLICT (seller_id) DO UPDATE SET revenue = ROUND(revenue + excluded.revenue, 2), "
+                  "units_sold = units_sold + excluded.units_sold;")
+REMOVE_ORDER_LINE = ("UPDATE shopper_order_summary "
+                     f"SET lifetime_spend = ROUND(lifetime_spend - {_line_spend('OLD')}, 2) "
+                     "WHERE shopper_id = (SELECT shopper_id FROM shopper_orders WHERE order_id = OLD.order_id); "
+                     "UPDATE seller_sales_summary "
+                     f"SET revenue = ROUND(revenue - {_line_spend('OLD')}, 2), units_sold = units_sold - {_line_units('OLD')} "
+                     "WHERE seller_id = OLD.seller_id;")
+ADD_BASKET_LINE = ("INSERT INTO basket_summary (basket_id, line_count, total) "
+                   "VALUES (NEW.basket_id, 1, ROUND(NEW.price * NEW.quantity, 2)) "
+                   "ON CONFLICT (basket_id) DO UPDATE SET line_count = line_count + 1, "
+                   "total = ROUND(total + excluded.total, 2);")
+REMOVE_BASKET_LINE = ("UPDATE basket_summary SET line_count = line_count - 1, total = ROUND(total - OLD.price * OLD.quantity, 2) "
+                      "WHERE basket_id = OLD.basket_id;")
+
+
+class Migration(NamedTuple):
+    """
+    A schema change, applied when the database is older than version
+    """
+    version: int
+    description: str
+    statements: Tuple[str, ...]
+
+
+MIGRATIONS = [
+    Migration(1, "Secondary indexes for the shopper session queries", (
+        # Order history: WHERE shopper_id = ? ORDER BY order_date
+        "CREATE INDEX IF NOT EXISTS shopper_orders_shopper_id_order_date_idx "
+        "ON shopper_orders (shopper_id, order_date)",
+        # Add item: products in a category, listed by description
+        "CREATE INDEX IF NOT EXISTS products_category_id_product_description_idx "
+        "ON products (category_id, product_description)",
+        # Todays basket: WHERE shopper_id = ? ORDER BY basket_created_date_time
+        "CREATE INDEX IF NOT EXISTS shopper_baskets_shopper_id_basket_created_date_time_idx "
+        "ON shopper_baskets (shopper_id, basket_created_date_time)",
+        # Sellers of a product are found through the primary key, products of a seller need this
+        "CREATE INDEX IF NOT EXISTS product_sellers_seller_id_idx "
+        "ON product_sellers (seller_id)",
+        # Name lookups from the add item, change quantity and checkout queries, before they carried IDs.
+        # Nothing uses them since, migration 7 drops them
+        "CREATE INDEX IF NOT EXISTS sellers_seller_name_idx "
+        "ON sellers (seller_name)",
+        "CREATE INDEX IF NOT EXISTS products_product_description_idx "
+        "ON products (product_description)",
+    )),
+    Migration(2, "Catalog version row, bumped by triggers whenever the catalog changes", (
+        "CREATE TABLE IF NOT EXISTS catalog_version "
+        "(catalog_version_id INTEGER PRIMARY KEY CHECK (catalog_version_id = 1), "
+        "version INTEGER NOT NULL)",
+        "INSERT OR IGNORE INTO catalog_version (catalog_version_id, version) VALUES (1, 0)",
+        *(f"CREATE TRIGGER IF NOT EXISTS {table}_{event.lower()}_catalog_version "
+          f"AFTER {event} ON {table} "
+          f"BEGIN UPDATE catalog_version SET version = version + 1 WHERE catalog_version_id = 1; END"
+          for table in ("categories", "products", "sellers", "product_sellers")
+          for event in ("INSERT", "UPDATE", "DELETE")),
+    )),
+    Migration(3, "Full text product search (FTS5), kept in sync with products and categories by triggers", (
+        # The rowid is the product_id. Prefix indexes make 2 and 3 character prefix queries (e.g. "so"*) index lookups
+        "CREATE VIRTUAL TABLE IF NOT EXISTS product_search USING fts5("
+        "product_description, product_manufacturer, product_model, category_description, "
+        "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')",
+        # Rank by bm25, a match in the description counts for more than one in the manufacturer, model or category
+        "INSERT INTO product_search (product_search, rank) VALUES ('rank', 'bm25(10.0, 4.0, 2.0, 1.0)')",
+        "DELETE FROM product_search",
+        f"INSERT INTO product_search {PRODUCT_SEARCH_ROWS}",
+        "CREATE TRIGGER IF NOT EXISTS products_insert_product_search AFTER INSERT ON products "
+        f"BEGIN {INSERT_NEW_PRODUCT_SEARCH_ROW}; END",
+        "CREATE TRIGGER IF NOT EXISTS products_update_product_search "
+        "AFTER UPDATE OF product_id, category_id, product_description, product_manufacturer, product_model ON products "
+        f"BEGIN DELETE FROM product_search WHERE rowid = OLD.product_id; {INSERT_NEW_PRODUCT_SEARCH_ROW}; END",
+        "CREATE TRIGGER IF NOT EXISTS products_delete_product_search AFTER DELETE ON products "
+        "BEGIN DELETE FROM product_search WHERE rowid = OLD.product_id; END",
+        "CREATE TRIGGER IF NOT EXISTS categories_update_product_search AFTER UPDATE OF category_description ON categories "
+        "BEGIN UPDATE product_search SET category_description = NEW.category_description "
+        "WHERE rowid IN (SELECT product_id FROM products WHERE category_id = NEW.category_id); END",
+    )),
+    Migration(4, "Summary tables of shopper orders, seller sales and basket totals, kept current by triggers", (
+        "CREATE TABLE IF NOT EXISTS shopper_order_summary "
+        "(shopper_id INTEGER PRIMARY KEY, "
+        "order_count INTEGER NOT NULL, "
+        "lifetime_spend REAL NOT NULL, "
+        "last_order_date TEXT)",
+        "CREATE TABLE IF NOT EXISTS seller_sales_summary "
+        "(seller_id INTEGER PRIMARY KEY, "
+        "revenue REAL NOT NULL, "
+        "units_sold INTEGER NOT NULL)",
+        # Best selling sellers, without sorting every seller
+        "CREATE INDEX IF NOT EXISTS seller_sales_summary_revenue_idx ON seller_sales_summary (revenue)",
+        "CREATE TABLE IF NOT EXISTS basket_summary "
+        "(basket_id INTEGER PRIMARY KEY, "
+        "line_count INTEGER NOT NULL, "
+        "total REAL NOT NULL)",
+        *(statement for table, rows in SUMMARY_ROWS.items()
+          for statement in (f"DELETE FROM {table}", f"INSERT INTO {table} {rows}")),
+        f"CREATE TRIGGER IF NOT EXISTS shopper_orders_insert_summary AFTER INSERT ON shopper_orders BEGIN {ADD_ORDER} END",
+        f"CREATE TRIGGER IF NOT EXISTS shopper_orders_delete_summary AFTER DELETE ON shopper_orders BEGIN {REMOVE_ORDER} END",
+        "CREATE TRIGGER IF NOT EXISTS shopper_orders_update_summary AFTER UPDATE OF shopper_id, order_date ON shopper_orders "
+        f"BEGIN {REMOVE_ORDER} {ADD_ORDER} END",
+        f"CREATE TRIGGER IF NOT EXISTS ordered_products_insert_summary AFTER INSERT ON ordered_products BEGIN {ADD_ORDER_LINE} END",
+        f"CREATE TRIGGER IF NOT EXISTS ordered_products_delete_summary AFTER DELETE ON ordered_products BEGIN {REMOVE_ORDER_LINE} END",
+        "CREATE TRIGGER IF NOT EXISTS ordered_products_update_summary "
+        "AFTER UPDATE OF order_id, seller_id, quantity, price, ordered_product_status ON ordered_products "
+        f"BEGIN {REMOVE_ORDER_LINE} {ADD_ORDER_LINE} END",
+        f"CREATE TRIGGER IF NOT EXISTS basket_contents_insert_summary AFTER INSERT ON basket_contents BEGIN {ADD_BASKET_LINE} END",
+        f"CREATE TRIGGER IF NOT EXISTS basket_contents_delete_summary AFTER DELETE ON basket_contents BEGIN {REMOVE_BASKET_LINE} END",
+        "CREATE TRIGGER IF NOT EXISTS basket_contents_update_summary AFTER UPDATE OF basket_id, quantity, price ON basket_contents "
+        f"BEGIN {REMOVE_BASKET_LINE} {ADD_BASKET_LINE} END",
+        "CREATE TRIGGER IF NOT EXISTS shopper_baskets_delete_summary AFTER DELETE ON shopper_baskets "
+        "BEGIN DELETE FROM basket_summary WHERE basket_id = OLD.basket_id; END",
+    )),
+    Migration(5, "Date indexes for the sales and review reports", (
+        # Reports read orders and reviews a date range at a time (see reports.py)
+        "CREATE INDEX IF NOT EXISTS shopper_orders_order_date_idx ON shopper_orders (order_date)",
+        "CREATE INDEX IF NOT EXISTS reviews_review_date_idx ON reviews (review_date)",
+    )),
+    Migration(6, "Basket creation date index for the basket expiry", (
+        # Expired baskets are found by their creation date across every shopper (see maintenance.py)
+        "CREATE INDEX IF NOT EXISTS shopper_baskets_basket_created_date_time_idx "
+        "ON shopper_baskets (basket_created_date_time)",
+    )),
+    Migration(7, "Drop the product and seller name indexes", (
+        # Products and sellers are found by ID, so every write to them only paid to keep these current
+        "DROP INDEX IF EXISTS sellers_seller_name_idx",
+        "DROP INDEX IF EXISTS products_product_description_idx",
+    )),
+]
+
+
+def current_version(sql: SqlWrapper) -> int:
+    """
+    Return the schema version of the database
+    """
+    return sql.select_query("PRAGMA user_version", fetch="one")[0]
+
+
+def migrate(sql: SqlWrapper, migrations: List[Migration] = MIGRATIONS) -> List[Migration]:
+    """
+    Apply the migrations newer than the database schema version, returning the migrations applied
+
+    Args:
+        sql: The database to migrate
+        migrations: The migrations to apply, in version order
+    """
+    version = current_version(sql)
+    if not any(migration.version > version for migration in migrations):
+        return []
+
+    applied = []
+    with sql.connection() as db:
+        for migration in migrations:
+            # BEGIN IMMEDIATE takes the write lock before re-reading the version, so concurrent sessions apply each migration once
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                if migration.version <= db.execute("PRAGMA user_version").fetchone()[0]:
+                    db.rollback()
+                    continue
+                for statement in migration.statements:
+                    db.execute(statement)
+                db.execute(f"PRAGMA user_version = {int(migration.version)}")
+                db.commit()
+            except sqlite3.Error:
+                db.rollback()
+                raise
+            applied.append(migration)
+        if applied:
+            db.execute("ANALYZE")
+    return applied
+
+
+def query_plan(sql: SqlWrapper, sql_query: str) -> List[Tuple[int, int, str]]:
+    """
+    Return the EXPLAIN QUERY PLAN rows (id, parent, detail) for a query, binding NULL to every parameter
+    """
+    plan = sql.select_query(f"EXPLAIN QUERY PLAN {sql_query}", sql_parameters=(None,) * sql_query.count("?"))
+    return [(row[0], row[1], row[3]) for row in plan]
+
+
+def is_full_scan(detail: str, subqueries: Set[str] = frozenset()) -> bool:
+    """
+    True if a query plan step reads a whole table rather than searching an index
+
+    Args:
+        detail: The query plan step
+        subqueries: Names of the materialized subqueries/CTEs in the plan, which are not tables
+    """
+    if not detail.startswith("SCAN ") or detail.startswith("SCAN (") or detail == "SCAN CONSTANT ROW":
+        return False  # Subqueries and constant rows are not tables
+    if detail.split()[1] in subqueries:
+        return False
+    # Virtual tables (e.g. FTS5 MATCH) are searched by their own index, given by the INDEX number
+    return "USING" not in detail and "VIRTUAL TABLE INDEX" not in detail
+
+
+def check(sql: SqlWrapper, queries: QueryRegistry = QUERIES) -> int:
+    """
+    Print the query plan of every registered query and flag full table scans, returning the number of scans found
+    """
+    full_scans = 0
+    for query in queries:
+        print(f"{query.name}:")
+        depths = {0: 0}
+        subqueries = set()
+        for plan_id, parent, detail in query_plan(sql, query.sql):
+            depths[plan_id] = depths.get(parent, 0) + 1
+            if detail.startswith(("MATERIALIZE ", "CO-ROUTINE ")):
+                subqueries.add(detail.split()[1])
+            flag = ""
+            if is_full_scan(detail, subqueries):
+                full_scans += 1
+                flag = "   <-- FULL TABLE SCAN"
+            print(f"{'  ' * depths[plan_id]}{detail}{flag}")
+        print()
+    print(f"{full_scans} full table scan(s) in {len(queries)} queries")
+    return full_scans
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Apply schema migrations to the Parana database")
+    parser.add_argument("--database", default=DEFAULT_DB_FILE, help="Path to the database file")
+    parser.add_argument("--check", action="store_true", help="Print the query plan of every query the app issues")
+    args = parser.parse_args()
+
+    sql = SqlWrapper(args.database)
+    if args.check:
+        # The queries use tables and indexes the migrations create, so they can only be planned once it is migrated.
+        # --check leaves the database as it is rather than migrating it.
+        version = current_version(sql)
+        if version < MIGRATIONS[-1].version:
+            sql.close()
+            parser.exit(1, f"The database is at schema version {version}, the queries need version "
+                           f"{MIGRATIONS[-1].version}. Run python migrations.py first, then --check.\n")
+        check(sql)
+    else:
+        for migration in migrate(sql):
+            print(f"Applied migration {migration.version}: {migration.description}")
+        print(f"Database is at schema version {current_version(sql)}")
+    sql.close()
@@ -0,0 +1,104 @@
+from typing import NamedTuple
+
+"""
+Typed rows returned by the shopper session queries.
+Each row carries the IDs the session works on, alongside the fields that are displayed to the shopper.
+Money is kept as a number and only formatted when it is displayed.
+"""
+
+
+class ShopperProfile(NamedTuple):
+    """
+    The shopper details loaded at login
+    """
+    shopper_id: int
+    shopper_account_ref: str
+    shopper_first_name: str
+    shopper_surname: str
+
+
+class Category(NamedTuple):
+    category_id: int
+    category_description: str
+
+
+class Product(NamedTuple):
+    product_id: int
+    product_description: str
+
+
+class ProductSearchResult(NamedTuple):
+    """
+    A product found by search, with its cheapest seller (None if no seller has it)
+    """
+    product_id: int
+    product_description: str
+    product_manufacturer: str
+    category_description: str
+    best_price: float
+    best_seller_id: int
+    best_seller_name: str
+
+
+class SellerOffer(NamedTuple):
+    """
+    A seller's price for a product
+    """
+    seller_id: int
+    seller_name: str
+    price: float
+
+
+class BasketItem(NamedTuple):
+    product_id: int
+    seller_id: int
+    product_description: str
+    seller_name: str
+    quantity: int
+    price: float
+
+    @property
+    def total(self) -> float:
+        return self.price * self.quantity
+
+
+class OrderLine(NamedTuple):
+    """
+    A product in one of the shoppers orders
+    """
+    order_id: int
+    order_date: str
+    product_description: str
+    seller_name: str
+    price: float
+    quantity: int
+    ordered_product_status: str
+    # The status of the whole order, which the order history is filtered by
+    order_status: str
+
+
+class ShopperOrderSummary(NamedTuple):
+    """
+    A shoppers order totals, from shopper_order_summary
+    """
+    order_count: int
+    lifetime_spend: float
+    last_order_date: str
+
+
+class BasketSummary(NamedTuple):
+    """
+    A baskets running total, from basket_summary
+    """
+    line_count: int
+    total: float
+
+
+class SellerSales(NamedTuple):
+    """
+    A sellers sales totals, from seller_sales_summary
+    """
+    seller_id: int
+    seller_name: str
+    revenue: float
+    units_sold: int
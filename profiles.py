@@ -0,0 +1,63 @@
+from typing import Dict, Hashable, Union
+
+from cache import LoadingCache
+from models import ShopperProfile
+from sql import SqlWrapper
+
+"""
+In-process cache of shopper profiles, shared between sessions.
+
+Login is a single point lookup on shoppers (by shopper_id or the UNIQUE shopper_account_ref), and a shopper who logs in
+again, or opens another session, is served from this cache instead. Profiles are evicted least recently used first
+and after a time to live. Unknown shoppers are not cached, so a shopper added after a failed login can log in straight away.
+A profile is cached separately for the shopper_id and the account reference it was looked up by.
+"""
+
+
+class ProfileCache:
+    """
+    A thread-safe, bounded LRU/TTL cache of shopper profiles
+    """
+    def __init__(self, max_entries: int = 10000, ttl: float = 300.0) -> None:
+        """
+        Args:
+            max_entries: The most profiles kept, the least recently used is evicted first
+            ttl: Seconds a profile is used for before it is read from the database again
+        """
+        # (db_file, query name, shopper_id or shopper_account_ref) -> profile
+        self._cache = LoadingCache(max_entries, ttl)
+
+    def get(self, sql: SqlWrapper, shopper_id: int) -> Union[ShopperProfile, None]:
+        """
+        Return the profile of a shopper, or None if there is no shopper with that ID
+        """
+        return self._get(sql, "shopper_profile", shopper_id)
+
+    def get_by_account_ref(self, sql: SqlWrapper, shopper_account_ref: str) -> Union[ShopperProfile, None]:
+        """
+        Return the profile of a shopper by their account reference, or None if there is no shopper with that reference
+        """
+        return self._get(sql, "shopper_profile_by_account_ref", shopper_account_ref)
+
+    def _get(self, sql: SqlWrapper, query_name: str, key: Hashable) -> Union[ShopperProfile, None]:
+        def load() -> Union[ShopperProfile, None]:
+            row = sql.select_named(query_name, sql_parameters=(key,), fetch="one")
+            return ShopperProfile(*row) if row is not None else None
+
+        return self._cache.get((sql.db_file, query_name, key), load)
+
+    def invalidate(self, db_file: str = None, shopper_id: int = None) -> None:
+        """
+        Drop one shopper's profile, every profile for a database, or every profile if db_file is None
+        """
+        self._cache.invalidate(lambda cache_key, profile: (db_file is None or cache_key[0] == db_file)
+                               and shopper_id in (None, profile.shopper_id))
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Return the hit, miss, eviction and invalidation counts
+        """
+        return self._cache.stats()
+
+
+PROFILE_CACHE = ProfileCache()
@@ -0,0 +1,272 @@
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterator, NamedTuple
+
+"""
+Registry of the named queries used by the Parana shopper session.
+
+Keeping every query in one place means SqlWrapper can run them by name, prepare the reads up front (warm_up)
+and count how often each one is served from sqlite3's statement cache.
+"""
+
+
+class Query(NamedTuple):
+    """
+    A named SQL query
+    """
+    name: str
+    sql: str
+
+    @property
+    def is_select(self) -> bool:
+        return self.sql.lstrip().upper().startswith(("SELECT", "WITH"))
+
+    @property
+    def param_count(self) -> int:
+        return self.sql.count("?")
+
+
+class StatementCache:
+    """
+    Mirrors the LRU statement cache sqlite3 keeps per connection (keyed by the exact SQL text),
+    so a query can tell whether it was served by an already prepared statement.
+    """
+    def __init__(self, size: int = 128) -> None:
+        self.size = size
+        self._statements = OrderedDict()
+
+    def __len__(self):
+        return len(self._statements)
+
+    def __contains__(self, sql_query: str):
+        return sql_query in self._statements
+
+    def touch(self, sql_query: str) -> bool:
+        """
+        Record that sql_query was executed, returning True if it was already cached
+        """
+        if sql_query in self._statements:
+            self._statements.move_to_end(sql_query)
+            return True
+        if self.size > 0:
+            self._statements[sql_query] = None
+            if len(self._statements) > self.size:
+                self._statements.popitem(last=False)
+        return False
+
+
+class QueryRegistry:
+    """
+    A registry of named queries with per-query statement cache hit and miss counts
+    """
+    def __init__(self) -> None:
+        self._queries: Dict[str, Query] = {}
+        self._hits: Dict[str, int] = {}
+        self._misses: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name: str) -> Query:
+        try:
+            return self._queries[name]
+        except KeyError:
+            raise KeyError(f"No query named '{name}' is registered") from None
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._queries
+
+    def __iter__(self) -> Iterator[Query]:
+        return iter(self._queries.values())
+
+    def __len__(self) -> int:
+        return len(self._queries)
+
+    def register(self, name: str, sql_query: str) -> Query:
+        """
+        Add a query to the registry
+
+        Args:
+            name: The name the query is executed by
+            sql_query: The SQL for the query, using ? placeholders
+        """
+        if name in self._queries:
+            raise ValueError(f"A query named '{name}' is already registered")
+        query = Query(name, sql_query)
+        self._queries[name] = query
+        self._hits[name] = 0
+        self._misses[name] = 0
+        return query
+
+    def record(self, name: str, hit: bool) -> None:
+        """
+        Record a statement cache hit or miss for a query
+        """
+        with self._lock:
+            if hit:
+                self._hits[name] += 1
+            else:
+                self._misses[name] += 1
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """
+        Return the statement cache hits and misses for each query
+        """
+        with self._lock:
+            return {name: {"hits": self._hits[name], "misses": self._misses[name]} for name in self._queries}
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            for name in self._queries:
+                self._hits[name] = 0
+                self._misses[name] = 0
+
+
+QUERIES = QueryRegistry()
+
+# Session start. Login validates the shopper and loads their profile in one point lookup,
+# through the primary key or the UNIQUE index on shopper_account_ref
+QUERIES.register("shopper_profile",
+                 "SELECT shopper_id, shopper_account_ref, shopper_first_name, shopper_surname "
+                 "FROM shoppers "
+                 "WHERE shopper_id = ?")
+QUERIES.register("shopper_profile_by_account_ref",
+                 "SELECT shopper_id, shopper_account_ref, shopper_first_name, shopper_surname "
+                 "FROM shoppers "
+                 "WHERE shopper_account_ref = ?")
+# Must use localtime, otherwise breaks at midnight
+QUERIES.register("todays_basket",
+                 "SELECT basket_id "
+                 "FROM shopper_baskets "
+                 "WHERE shopper_id = ? AND DATE(basket_created_date_time) = DATE('now', 'localtime') "
+                 "ORDER BY basket_created_date_time DESC "
+                 "LIMIT 1")
+QUERIES.register("create_basket",
+                 "INSERT INTO shopper_baskets (shopper_id, basket_created_date_time) "
+                 "VALUES (?, ?)")
+
+# Option 1
+# Keyset pagination: a page is the next ? orders older than the (order_date, order_id) of the last order on the previous page.
+# The date range and status filters are applied in the same index range scan. The status filter is on the order's
+# status, which is returned with each line as well as the line's own status.
+QUERIES.register("order_history_page",
+                 "WITH page AS ("
+                 "SELECT order_id, order_date, order_status "
+                 "FROM shopper_orders "
+                 "WHERE shopper_id = ? AND (order_date, order_id) < (?, ?) "
+                 "AND order_date >= ? AND order_date <= ? AND (? IS NULL OR order_status = ?) "
+                 "ORDER BY order_date DESC, order_id DESC "
+                 "LIMIT ?) "
+                 "SELECT page.order_id, "
+                 "page.order_date, "
+                 "p.product_description, "
+                 "se.seller_name, "
+                 "op.price, "
+                 "op.quantity, "
+                 "op.ordered_product_status, "
+                 "page.order_status "
+                 "FROM page "
+                 "INNER JOIN ordered_products op ON page.order_id = op.order_id "
+                 "INNER JOIN sellers se ON op.seller_id = se.seller_id "
+                 "INNER JOIN products p ON op.product_id = p.product_id "
+                 "ORDER BY page.order_date DESC, page.order_id DESC")
+
+# Option 2
+QUERIES.register("catalog_version",
+                 "SELECT version "
+                 "FROM catalog_version "
+                 "WHERE catalog_version_id = 1")
+QUERIES.register("categories",
+                 "SELECT category_id, category_description "
+                 "FROM categories "
+                 "ORDER BY category_description ASC ")
+QUERIES.register("category_products",
+                 "SELECT product_id, product_description "
+                 "FROM products "
+                 "WHERE category_id = ? "
+                 "ORDER BY product_description ASC ")
+QUERIES.register("product_offers",
+                 "SELECT s.seller_id, s.seller_name, ps.price "
+                 "FROM sellers s "
+                 "INNER JOIN product_sellers ps ON s.seller_id = ps.seller_id "
+                 "WHERE ps.product_id = ? "
+                 "ORDER BY s.seller_name ASC ")
+# Full text search (migration 3). The best price is the cheapest seller, MIN() makes SQLite take the seller columns
+# from that row
+QUERIES.register("search_products",
+                 "WITH hits AS ("
+                 "SELECT rowid AS product_id, rank "
+                 "FROM product_search "
+                 "WHERE product_search MATCH ? "
+                 "ORDER BY rank "
+                 "LIMIT ?) "
+                 "SELECT p.product_id, p.product_description, p.product_manufacturer, c.category_description, "
+                 "MIN(ps.price), ps.seller_id, s.seller_name "
+                 "FROM hits "
+                 "INNER JOIN products p ON p.product_id = hits.product_id "
+                 "LEFT JOIN categories c ON c.category_id = p.category_id "
+                 "LEFT JOIN product_sellers ps ON ps.product_id = p.product_id "
+                 "LEFT JOIN sellers s ON s.seller_id = ps.seller_id "
+                 "GROUP BY hits.product_id "
+                 "ORDER BY hits.rank ")
+QUERIES.register("product_description",
+                 "SELECT product_description "
+                 "FROM products "
+                 "WHERE product_id = ?")
+QUERIES.register("add_basket_item",
+                 "INSERT INTO basket_contents (basket_id, product_id, seller_id, quantity, price) "
+                 "VALUES (?, ?, ?, ?, ?)")
+
+# Option 3
+QUERIES.register("basket_contents",
+                 "SELECT bc.product_id, bc.seller_id, p.product_description, s.seller_name, bc.quantity, bc.price "
+                 "FROM basket_contents bc "
+                 "INNER JOIN products p ON p.product_id = bc.product_id "
+                 "INNER JOIN sellers s ON s.seller_id = bc.seller_id "
+                 "WHERE bc.basket_id = ?")
+
+# The lines a buffered basket is compared with when it is flushed (basket_buffer.py)
+QUERIES.register("basket_lines",
+                 "SELECT product_id, seller_id, quantity, price "
+                 "FROM basket_contents "
+                 "WHERE basket_id = ?")
+
+# Option 4
+# Totals are read from the summary tables (migration 4) instead of re-aggregating the rows
+QUERIES.register("basket_summary",
+                 "SELECT line_count, total "
+                 "FROM basket_summary "
+                 "WHERE basket_id = ?")
+QUERIES.register("shopper_order_summary",
+                 "SELECT order_count, lifetime_spend, last_order_date "
+                 "FROM shopper_order_summary "
+                 "WHERE shopper_id = ?")
+QUERIES.register("top_sellers",
+                 "SELECT s.seller_id, s.seller_name, ss.revenue, ss.units_sold "
+                 "FROM seller_sales_summary ss "
+                 "INNER JOIN sellers s ON s.seller_id = ss.seller_id "
+                 "ORDER BY ss.revenue DESC "
+                 "LIMIT ?")
+QUERIES.register("change_basket_quantity",
+                 "UPDATE basket_contents "
+                 "SET quantity = ? "
+                 "WHERE basket_id = ? AND product_id = ?")
+
+# Option 5
+QUERIES.register("remove_basket_item",
+                 "DELETE FROM basket_contents "
+                 "WHERE basket_id = ? AND product_id = ?")
+
+# Option 6
+QUERIES.register("create_order",
+                 "INSERT INTO shopper_orders (shopper_id, order_date, order_status) "
+                 "VALUES (?, ?, ?)")
+QUERIES.register("order_basket_contents",
+                 "INSERT INTO ordered_products (order_id, product_id, seller_id, quantity, price, ordered_product_status) "
+                 "SELECT ?, product_id, seller_id, quantity, price, 'Placed' "
+                 "FROM basket_contents "
+                 "WHERE basket_id = ?")
+QUERIES.register("clear_basket",
+                 "DELETE FROM basket_contents "
+                 "WHERE basket_id = ?")
+QUERIES.register("delete_basket",
+                 "DELETE FROM shopper_baskets "
+                 "WHERE basket_id = ?")
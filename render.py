@@ -0,0 +1,105 @@
+import sys
+from itertools import islice
+from typing import Any, Iterable, List, Optional, Sequence, TextIO
+
+"""
+Plain text rendering for the shopper session, without third party imports so starting a session stays fast.
+
+Tables are written in the layout of tabulate's "simple" format:
+
+Order ID  Product Description      Price
+--------  -----------------------  ------
+       1  Premium coffee beans     £12.99
+
+The column widths come from the headers and the first SAMPLE_ROWS rows only, so the rows are streamed to the output as
+they are produced rather than held in a list. A later value wider than its column is cut short with "…", and no
+column is wider than MAX_COLUMN_WIDTH. Columns where every sampled value is a number are right aligned.
+
+Lines are joined and written a chunk at a time: stdout is line buffered on a terminal, and one write per line would
+flush per line.
+"""
+
+SAMPLE_ROWS = 50
+MAX_COLUMN_WIDTH = 48
+COLUMN_GAP = "  "
+
+
+def _text(value: Any) -> str:
+    return "" if value is None else str(value)
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _fit(text: str, width: int) -> str:
+    return text if len(text) <= width else text[:width - 1] + "…"
+
+
+def _line(cells: Sequence[str], widths: List[int], right: List[bool]) -> str:
+    return COLUMN_GAP.join((cell.rjust(width) if align_right else cell.ljust(width))
+                           for cell, width, align_right in zip(cells, widths, right)).rstrip() + "\n"
+
+
+def write_table(rows: Iterable[Sequence[Any]], headers: Sequence[str] = (), footer: Optional[Sequence[Any]] = None,
+                out: Optional[TextIO] = None, sample_rows: int = SAMPLE_ROWS, max_width: int = MAX_COLUMN_WIDTH) -> int:
+    """
+    Write rows as a fixed width table, returning the number of rows written
+
+    Args:
+        rows: The rows of the table, any iterable (e.g. a generator over query results)
+        headers: The column headings
+        footer: A row written under a rule after the rows, e.g. a total. None values are left blank.
+        out: Where to write the table, defaults to sys.stdout
+        sample_rows: The number of rows read ahead to size the columns, and the number of lines written at a time
+        max_width: The widest a column can be sized from its values
+    """
+    out = sys.stdout if out is None else out
+    rows = iter(rows)
+    sample = [tuple(row) for row in islice(rows, sample_rows)]
+    columns = max([len(headers), len(footer or ())] + [len(row) for row in sample]) if sample or headers else 0
+    if not columns:
+        return 0
+
+    widths = [len(headers[column]) if column < len(headers) else 0 for column in range(columns)]
+    right = [bool(sample) for _ in range(columns)]
+    for row in sample + ([tuple(footer)] if footer else []):
+        for column, value in enumerate(row):
+            widths[column] = max(widths[column], min(len(_text(value)), max_width))
+    for row in sample:
+        for column in range(columns):
+            value = row[column] if column < len(row) else None
+            if value is not None and not _is_number(value):
+                right[column] = False
+
+    def render(row: Sequence[Any]) -> str:
+        return _line([_fit(_text(row[column]) if column < len(row) else "", width)
+                      for column, width in enumerate(widths)], widths, right)
+
+    lines = []
+    if headers:
+        lines.append(_line([_text(header) for header in headers] + [""] * (columns - len(headers)), widths, right))
+        lines.append(_line(["-" * width for width in widths], widths, right))
+    lines.extend(render(row) for row in sample)
+    count = len(sample)
+    while lines:
+        out.write("".join(lines))
+        lines = [render(row) for row in islice(rows, sample_rows)]
+        count += len(lines)
+
+    if footer:
+        # The rule only spans the footer's columns, as the rule under a column of figures being added up
+        out.write(_line([("-" * width if value is not None else "")
+                         for value, width in zip(list(footer) + [None] * columns, widths)], widths, right)
+                  + render(tuple(footer)))
+    return count
+
+
+def write_options(options: Iterable[Sequence[Any]], out: Optional[TextIO] = None) -> int:
+    """
+    Write options as a numbered list, each option's values separated by two spaces, returning the number of options
+    """
+    out = sys.stdout if out is None else out
+    lines = [f"{i}.\t{'  '.join(_text(value) for value in option)}\n" for i, option in enumerate(options, start=1)]
+    out.write("".join(lines))
+    return len(lines)
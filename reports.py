@@ -0,0 +1,309 @@
+import argparse
+import csv
+import heapq
+import json
+import os
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import Dict, Iterable, List, Literal, NamedTuple, Optional, TextIO, Tuple
+
+from sql import SqlWrapper, DEFAULT_DB_FILE, read_only_uri
+
+"""
+Sales and review reports, computed in parallel over read-only connections.
+
+category_revenue    Revenue, units and orders by month and category
+seller_revenue      Revenue, units and orders by month and seller
+top_products        The products with the most revenue
+review_stars        How many product and seller reviews gave each star rating
+
+The dates covered are split into contiguous month ranges with about the same number of orders and reviews in each.
+Every range is aggregated by a worker process on its own read-only (mode=ro) connection, so the reports never take a
+connection from the shopper pool and can never write. The partial aggregates are merged as they arrive: the monthly
+reports cannot span ranges and are written straight out, the others are summed by key and written once every range
+is in. Rows are written as CSV or JSON one at a time, so only one range of the monthly reports is held in memory.
+
+Each range is read in its own transaction, so ranges read while shoppers are checking out may see slightly different
+points in time. Pass --snapshot to report on a point in time copy of the database instead.
+
+Usage:
+python reports.py [--database PATH] [--reports NAME...] [--workers 4] [--format csv|json] [--output-dir DIR]
+                  [--since YYYY-MM-DD] [--until YYYY-MM-DD] [--top 100] [--snapshot]
+"""
+
+PARTITIONS_PER_WORKER = 4
+TOP_PRODUCTS = 100
+
+
+class Report(NamedTuple):
+    """
+    A report that can be computed a date range at a time. sql is run with the range as ?1 (inclusive) and ?2 (exclusive).
+    """
+    name: str
+    columns: Tuple[str, ...]
+    sql: str
+    # The leading columns that identify a row, the columns after them are summed when the ranges are merged
+    keys: int
+    # Rows are keyed by month, so no row is in more than one range and the ranges can be written as they arrive
+    monthly: bool = False
+    # Write the rows with the most of this column first, otherwise in key order
+    rank_by: Optional[str] = None
+
+
+# Revenue and units leave out cancelled lines, as the summary tables do (see migrations.SUMMARY_ROWS)
+REPORTS = {report.name: report for report in (
+    Report("category_revenue", ("month", "category_id", "category_description", "orders", "units", "revenue"),
+           "SELECT substr(so.order_date, 1, 7) AS month, c.category_id, c.category_description, "
+           "COUNT(DISTINCT so.order_id), SUM(op.quantity), SUM(op.price * op.quantity) "
+           "FROM shopper_orders so "
+           "JOIN ordered_products op ON op.order_id = so.order_id "
+           "JOIN products p ON p.product_id = op.product_id "
+           "LEFT JOIN categories c ON c.category_id = p.category_id "
+           "WHERE so.order_date >= ?1 AND so.order_date < ?2 AND op.ordered_product_status IS NOT 'Cancelled' "
+           "GROUP BY month, c.category_id "
+           "ORDER BY month, c.category_id",
+           keys=3, monthly=True),
+    Report("seller_revenue", ("month", "seller_id", "seller_name", "orders", "units", "revenue"),
+           "SELECT substr(so.order_date, 1, 7) AS month, s.seller_id, s.seller_name, "
+           "COUNT(DISTINCT so.order_id), SUM(op.quantity), SUM(op.price * op.quantity) "
+           "FROM shopper_orders so "
+           "JOIN ordered_products op ON op.order_id = so.order_id "
+           "JOIN sellers s ON s.seller_id = op.seller_id "
+           "WHERE so.order_date >= ?1 AND so.order_date < ?2 AND op.ordered_product_status IS NOT 'Cancelled' "
+           "GROUP BY month, s.seller_id "
+           "ORDER BY month, s.seller_id",
+           keys=3, monthly=True),
+    # A product is in an order at most once (the primary key of ordered_products), so its lines are its orders
+    Report("top_products", ("product_id", "product_description", "orders", "units", "revenue"),
+           "SELECT p.product_id, p.product_description, COUNT(*), SUM(op.quantity), SUM(op.price * op.quantity) "
+           "FROM shopper_orders so "
+           "JOIN ordered_products op ON op.order_id = so.order_id "
+           "JOIN products p ON p.product_id = op.product_id "
+           "WHERE so.order_date >= ?1 AND so.order_date < ?2 AND op.ordered_product_status IS NOT 'Cancelled' "
+           "GROUP BY p.product_id",
+           keys=2, rank_by="revenue"),
+    Report("review_stars", ("review_type", "stars", "reviews"),
+           "SELECT 'product', length(r.review_star_rated), COUNT(*) "
+           "FROM reviews r JOIN product_reviews pr ON pr.review_id = r.review_id "
+           "WHERE r.review_date >= ?1 AND r.review_date < ?2 "
+           "GROUP BY 2 "
+           "UNION ALL "
+           "SELECT 'seller', length(r.review_star_rated), COUNT(*) "
+           "FROM reviews r JOIN seller_reviews sr ON sr.review_id = r.review_id "
+           "WHERE r.review_date >= ?1 AND r.review_date < ?2 "
+           "GROUP BY 2",
+           keys=2),
+)}
+
+
+class ReportWriter:
+    """
+    Writes the rows of one report to a file as they are given, as CSV (with a header row) or as a JSON array of objects
+    """
+    def __init__(self, file: TextIO, columns: Tuple[str, ...], output_format: Literal["csv", "json"] = "csv") -> None:
+        if output_format not in ("csv", "json"):
+            raise ValueError(f"Unknown report format '{output_format}'")
+        self.file = file
+        self.columns = columns
+        self.output_format = output_format
+        self.rows = 0
+        if output_format == "csv":
+            self._csv = csv.writer(file)
+            self._csv.writerow(columns)
+        else:
+            file.write("[")
+
+    def write(self, rows: Iterable[tuple]) -> None:
+        for row in rows:
+            # Money is summed unrounded across the ranges and rounded to pennies once, here
+            row = [round(value, 2) if isinstance(value, float) else value for value in row]
+            if self.output_format == "csv":
+                self._csv.writerow(row)
+            else:
+                self.file.write(("," if self.rows else "") + "\n" + json.dumps(dict(zip(self.columns, row))))
+            self.rows += 1
+
+    def close(self) -> None:
+        if self.output_format == "json":
+            self.file.write("\n]\n")
+        self.file.close()
+
+
+def date_ranges(sql: SqlWrapper, partitions: int, since: Optional[str] = None, until: Optional[str] = None) -> List[Tuple[str, str]]:
+    """
+    Split the dates of the orders and reviews into at most partitions contiguous ranges of whole months,
+    each with about the same number of orders and reviews. Returns (first date, date after the last) of each range.
+
+    Args:
+        sql: The database to report on
+        partitions: The most ranges to return
+        since: Leave out orders and reviews before this date (YYYY-MM-DD)
+        until: Leave out orders and reviews on or after this date (YYYY-MM-DD)
+    """
+    months = sql.select_query("SELECT month, SUM(rows) FROM ("
+                              "SELECT substr(order_date, 1, 7) AS month, COUNT(*) AS rows FROM shopper_orders "
+                              "WHERE order_date >= ?1 AND order_date < ?2 GROUP BY month "
+                              "UNION ALL "
+                              "SELECT substr(review_date, 1, 7), COUNT(*) FROM reviews "
+                              "WHERE review_date >= ?1 AND review_date < ?2 GROUP BY 1) "
+                              "GROUP BY month ORDER BY month", sql_parameters=(since or "", until or "9999-12-31"))
+    if not months:
+        return []
+    target = sum(rows for _, rows in months) / max(partitions, 1)
+    ranges = []
+    start, filled = since or f"{months[0][0]}-01", 0
+    for month, rows in months[:-1]:
+        filled += rows
+        if filled >= target * (len(ranges) + 1):
+            end = f"{next_month(month)}-01"
+            ranges.append((start, end))
+            start = end
+    ranges.append((start, until or f"{next_month(months[-1][0])}-01"))
+    return ranges
+
+
+def next_month(month: str) -> str:
+    """
+    The month after a YYYY-MM month, e.g. '2019-12' -> '2020-01'
+    """
+    year, month = map(int, month.split("-"))
+    return f"{year + month // 12:04d}-{month % 12 + 1:02d}"
+
+
+def aggregate(sql: SqlWrapper, reports: List[Report], start: str, end: str) -> Dict[str, List[tuple]]:
+    """
+    Return the partial aggregates of each report over one date range, read in one transaction
+    """
+    with sql.transaction("DEFERRED"):
+        return {report.name: sql.select_query(report.sql, sql_parameters=(start, end)) for report in reports}
+
+
+# The read-only connection of a worker process, opened once by the pool initializer
+_worker_sql: Optional[SqlWrapper] = None
+
+
+def _open_worker(db_file: str) -> None:
+    global _worker_sql
+    _worker_sql = SqlWrapper(db_file, read_only=True)
+
+
+def _aggregate_in_worker(report_names: List[str], start: str, end: str) -> Dict[str, List[tuple]]:
+    return aggregate(_worker_sql, [REPORTS[name] for name in report_names], start, end)
+
+
+def run(db_file: str, report_names: List[str], writers: Dict[str, ReportWriter], workers: int = 1,
+        partitions: Optional[int] = None, since: Optional[str] = None, until: Optional[str] = None,
+        top: int = TOP_PRODUCTS) -> Dict[str, int]:
+    """
+    Compute reports and write them with their writers, returning the number of rows written for each
+
+    Args:
+        db_file: The database to report on, it is only opened read-only
+        report_names: The reports to compute, see REPORTS
+        writers: The writer of each report
+        workers: Aggregate the date ranges in this many processes, 1 aggregates them in this process
+        partitions: The most date ranges to split the work into, defaults to PARTITIONS_PER_WORKER per worker
+        since: Leave out orders and reviews before this date (YYYY-MM-DD)
+        until: Leave out orders and reviews on or after this date (YYYY-MM-DD)
+        top: The most rows written by reports ranked by a column (top_products)
+    """
+    reports = [REPORTS[name] for name in report_names]
+    sql = SqlWrapper(db_file, read_only=True)
+    try:
+        ranges = date_ranges(sql, partitions or workers * PARTITIONS_PER_WORKER, since, until)
+        merged: Dict[str, Dict[tuple, list]] = {report.name: {} for report in reports if not report.monthly}
+        if workers == 1 or not ranges:
+            for start, end in ranges:
+                _merge(reports, aggregate(sql, reports, start, end), writers, merged)
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_open_worker, initargs=(db_file,)) as executor:
+                # map yields the ranges in date order, so the monthly reports are written in month order
+                for partials in executor.map(_aggregate_in_worker, repeat(report_names), *zip(*ranges)):
+                    _merge(reports, partials, writers, merged)
+    finally:
+        sql.close()
+
+    for report in reports:
+        if not report.monthly:
+            rows = (key + tuple(values) for key, values in merged.pop(report.name).items())
+            if report.rank_by is not None:
+                rank = report.columns.index(report.rank_by)
+                writers[report.name].write(heapq.nlargest(top, rows, key=lambda row: row[rank]))
+            else:
+                writers[report.name].write(sorted(rows))
+    return {report.name: writers[report.name].rows for report in reports}
+
+
+def _merge(reports: List[Report], partials: Dict[str, List[tuple]], writers: Dict[str, ReportWriter],
+           merged: Dict[str, Dict[tuple, list]]) -> None:
+    for report in reports:
+        if report.monthly:
+            writers[report.name].write(partials[report.name])
+            continue
+        totals = merged[report.name]
+        for row in partials[report.name]:
+            key = row[:report.keys]
+            values = totals.get(key)
+            if values is None:
+                totals[key] = list(row[report.keys:])
+            else:
+                for index, value in enumerate(row[report.keys:]):
+                    values[index] += value
+
+
+def snapshot(db_file: str, snapshot_file: str) -> None:
+    """
+    Copy the database to snapshot_file as it is at one point in time, with SQLite's online backup
+    """
+    source = sqlite3.connect(read_only_uri(db_file), uri=True)
+    target = sqlite3.connect(snapshot_file)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+
+def open_writers(report_names: List[str], output_dir: str, output_format: Literal["csv", "json"]) -> Dict[str, ReportWriter]:
+    """
+    Open a writer for each report, writing to output_dir/<report>.<format>
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    return {name: ReportWriter(open(os.path.join(output_dir, f"{name}.{output_format}"), "w", newline=""),
+                               REPORTS[name].columns, output_format)
+            for name in report_names}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write the Parana sales and review reports")
+    parser.add_argument("--database", default=DEFAULT_DB_FILE, help="Path to the database file")
+    parser.add_argument("--reports", nargs="+", choices=REPORTS, default=list(REPORTS), help="The reports to write")
+    parser.add_argument("--workers", type=int, default=4, help="Worker processes")
+    parser.add_argument("--format", choices=("csv", "json"), default="csv", help="Output format")
+    parser.add_argument("--output-dir", default="reports", help="Directory the report files are written to")
+    parser.add_argument("--since", help="Leave out orders and reviews before this date (YYYY-MM-DD)")
+    parser.add_argument("--until", help="Leave out orders and reviews on or after this date (YYYY-MM-DD)")
+    parser.add_argument("--top", type=int, default=TOP_PRODUCTS, help="Products in the top_products report")
+    parser.add_argument("--snapshot", action="store_true", help="Report on a point in time copy of the database")
+    args = parser.parse_args()
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = args.database
+        if args.snapshot:
+            db_file = os.path.join(tmp, "snapshot")
+            snapshot(args.database, db_file)
+        writers = open_writers(args.reports, args.output_dir, args.format)
+        start = time.perf_counter()
+        try:
+            counts = run(db_file, args.reports, writers, args.workers, since=args.since, until=args.until, top=args.top)
+        finally:
+            for writer in writers.values():
+                writer.close()
+    for name, rows in counts.items():
+        print(f"{name:<20}{rows:>10} rows  {os.path.join(args.output_dir, f'{name}.{args.format}')}")
+    print(f"Reports written in {time.perf_counter() - start:.2f}s with {args.workers} worker(s)")
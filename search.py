@@ -0,0 +1,85 @@
+import re
+import sqlite3
+from typing import List
+
+from migrations import PRODUCT_SEARCH_ROWS, migrate
+from models import ProductSearchResult
+from sql import SqlWrapper, DEFAULT_DB_FILE
+
+"""
+Full text product search over the product_search FTS5 table (migration 3).
+
+The index covers the product description, manufacturer, model and category. Triggers keep it in sync with products
+and categories, so it only needs a rebuild after changes made with the triggers off (e.g. a bulk load into a copy of
+the table) or to compact it.
+
+Usage:
+python search.py [--database PATH] [--limit 20] WORDS...   -> search for products
+python search.py [--database PATH] --rebuild               -> rebuild the search index from the products table
+"""
+
+SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+
+def match_query(text: str) -> str:
+    """
+    Turn what the shopper typed into an FTS5 MATCH expression: every word must match, as a prefix of a word in the index.
+    e.g. 'sony tel' -> '"sony"* "tel"*'. Returns "" if there are no words to search for.
+    """
+    return " ".join(f'"{word}"*' for word in _WORD.findall(text))
+
+
+def search_products(sql: SqlWrapper, text: str, limit: int = SEARCH_LIMIT) -> List[ProductSearchResult]:
+    """
+    Return the products matching text, best match first (bm25), with the cheapest seller of each
+
+    Args:
+        sql: The database to search
+        text: The words to search for
+        limit: The most products returned, capped at MAX_SEARCH_LIMIT
+    """
+    query = match_query(text)
+    if not query:
+        return []
+    rows = sql.select_named("search_products", sql_parameters=(query, max(1, min(limit, MAX_SEARCH_LIMIT))))
+    return [ProductSearchResult(*row) for row in rows]
+
+
+def rebuild(sql: SqlWrapper) -> int:
+    """
+    Rebuild the search index from the products and categories tables and merge its segments, returning the number of products indexed
+    """
+    with sql.transaction() as db:
+        db.execute("DELETE FROM product_search")
+        db.execute(f"INSERT INTO product_search {PRODUCT_SEARCH_ROWS}")
+        db.execute("INSERT INTO product_search (product_search) VALUES ('optimize')")
+        return db.execute("SELECT COUNT(*) FROM product_search").fetchone()[0]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Search the Parana products")
+    parser.add_argument("--database", default=DEFAULT_DB_FILE, help="Path to the database file")
+    parser.add_argument("--rebuild", action="store_true", help="Rebuild the search index")
+    parser.add_argument("--limit", type=int, default=SEARCH_LIMIT, help="The most products to list")
+    parser.add_argument("words", nargs="*", help="Words to search for")
+    args = parser.parse_args()
+
+    sql = SqlWrapper(args.database)
+    migrate(sql)
+    if args.rebuild:
+        print(f"Indexed {rebuild(sql)} products")
+    elif args.words:
+        try:
+            for result in search_products(sql, " ".join(args.words), args.limit):
+                price = f"£{result.best_price:.2f} from {result.best_seller_name}" if result.best_price is not None else "No sellers"
+                print(f"{result.product_id}\t{result.product_description} ({result.category_description})\t{price}")
+        except sqlite3.OperationalError as e:
+            parser.error(f"Search failed: {e}")
+    else:
+        parser.error("Give words to search for, or --rebuild")
+    sql.close()
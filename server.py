@@ -0,0 +1,244 @@
+import argparse
+import asyncio
+import functools
+import json
+import logging
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Union
+
+from basket_buffer import DURABILITY_LEVELS
+from catalog import CatalogCache, CATALOG_CACHE
+from maintenance import MaintenanceScheduler
+from migrations import migrate
+from shopper import ShopperService, ShopperError, LATEST_ORDER
+from sql import SqlWrapper, DEFAULT_DB_FILE
+
+"""
+Serves many shopper sessions from one process.
+
+Each client connection hosts one shopper session, driven by a line based protocol over TCP or a Unix socket.
+The database work for every request runs on a bounded pool of worker threads sharing a pooled SqlWrapper,
+so a slow query only holds up the session that asked for it.
+
+Protocol: the client sends one command per line, the server replies with one line of JSON,
+{"ok": true, "result": ...} or {"ok": false, "error": "..."}.
+
+LOGIN <shopper_id | account_ref>           Start the session, must be sent first
+HISTORY [<before_date> <before_order_id>]   A page of the order history and the order totals, pass the "next" key of a page to get the page after it
+CATEGORIES                                  The product categories
+PRODUCTS <category_id>                      The products in a category
+OFFERS <product_id>                         The sellers of a product and their prices
+SEARCH <words>                              Products matching the words, best match first, with their best price
+ADD <product_id> <seller_id> <quantity>     Add an item to the basket
+BASKET                                      The basket contents and total
+QUANTITY <product_id> <quantity>            Change the quantity of an item in the basket
+REMOVE <product_id>                         Remove an item from the basket
+CHECKOUT                                    Place an order for the basket
+HELP                                        List the commands
+QUIT                                        End the session
+
+Usage:
+python server.py [--database PATH] [--host 127.0.0.1] [--port 8417 | --unix PATH] [--workers 8] [--maintenance]
+
+With --maintenance the database maintenance tasks (maintenance.py) run on their schedule on a background thread.
+"""
+
+logger = logging.getLogger("parana.server")
+
+
+def to_json(value: Any) -> Any:
+    """
+    Convert typed rows (NamedTuples) to JSON friendly dicts
+    """
+    if hasattr(value, "_asdict"):
+        return {key: to_json(field) for key, field in value._asdict().items()}
+    if isinstance(value, (list, tuple)):
+        return [to_json(item) for item in value]
+    return value
+
+
+class ShopperConnection:
+    """
+    One client connection, hosting one shopper session
+    """
+
+    def __init__(self, server: "ParanaServer", reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+        self.shopper: Union[ShopperService, None] = None
+        self.commands: Dict[str, Callable[..., Any]] = {
+            "HISTORY": self.history,
+            "CATEGORIES": lambda: self.shopper.categories(),
+            "PRODUCTS": lambda category_id: self.shopper.products(int(category_id)),
+            "OFFERS": lambda product_id: self.shopper.offers(int(product_id)),
+            "SEARCH": lambda *words: self.shopper.search(" ".join(words)),
+            "ADD": lambda product_id, seller_id, quantity: self.shopper.add_item(int(product_id), int(seller_id), int(quantity)),
+            "BASKET": self.basket,
+            "QUANTITY": lambda product_id, quantity: self.shopper.change_quantity(int(product_id), int(quantity)),
+            "REMOVE": lambda product_id: self.shopper.remove_item(int(product_id)),
+            "CHECKOUT": lambda: {"order_id": self.shopper.checkout()},
+        }
+
+    async def run(self) -> None:
+        """
+        Answer commands until the client quits or disconnects
+        """
+        try:
+            while True:
+                line = await self.reader.readline()
+                if not line:
+                    break
+                command, *args = line.decode("utf-8").split() or [""]
+                command = command.upper()
+                if command == "QUIT":
+                    await self.reply({"ok": True, "result": "Goodbye"})
+                    break
+                await self.reply(await self.handle(command, args))
+        except ConnectionError:
+            pass
+        finally:
+            if self.shopper is not None:
+                await self.server.run_db(self.shopper.close)
+            self.writer.close()
+
+    async def reply(self, response: Dict[str, Any]) -> None:
+        self.writer.write(json.dumps(response).encode("utf-8") + b"\n")
+        await self.writer.drain()
+
+    async def handle(self, command: str, args: List[str]) -> Dict[str, Any]:
+        """
+        Run a command, returning the response to send
+        """
+        try:
+            if command == "HELP":
+                return {"ok": True, "result": ["LOGIN", "QUIT", *self.commands]}
+            if command == "LOGIN":
+                if self.shopper is not None:
+                    raise ShopperError("Already logged in")
+                self.shopper = await self.server.run_db(self.login, *args)
+                return {"ok": True, "result": await self.server.run_db(self.profile)}
+            if command not in self.commands:
+                raise ShopperError(f"Unknown command '{command}', send HELP for the list of commands")
+            if self.shopper is None:
+                raise ShopperError("Please LOGIN with your Shopper ID first")
+            return {"ok": True, "result": to_json(await self.server.run_db(self.commands[command], *args))}
+        except (ShopperError, TypeError, ValueError) as e:
+            # TypeError/ValueError are the wrong number of arguments or arguments that are not numbers
+            return {"ok": False, "error": str(e) if isinstance(e, ShopperError) else f"Invalid arguments for {command}"}
+        except sqlite3.Error:
+            logger.exception("Database error running %s", command)
+            return {"ok": False, "error": "Database Error!"}
+        except Exception:
+            # e.g. a RuntimeError, or a TimeoutError from the connection pool. Answered like a database error so the
+            # client gets a reply and the connection stays up
+            logger.exception("Error running %s", command)
+            return {"ok": False, "error": "Database Error!"}
+
+    def login(self, shopper_login: str) -> ShopperService:
+        shopper = ShopperService.authenticate(self.server.sql, shopper_login, self.server.catalog)
+        if self.server.basket_buffer is not None:
+            shopper.enable_basket_buffer(self.server.basket_buffer)
+        return shopper
+
+    def profile(self) -> Dict[str, Any]:
+        first_name, surname = self.shopper.shopper_name()
+        return {"shopper_id": self.shopper.shopper_id, "shopper_account_ref": self.shopper.profile.shopper_account_ref,
+                "first_name": first_name, "surname": surname, "basket_id": self.shopper.basket_id}
+
+    def history(self, before_date: str = LATEST_ORDER[0], before_order_id: str = LATEST_ORDER[1]) -> Dict[str, Any]:
+        orders, next_page = self.shopper.order_history_page((before_date, int(before_order_id)))
+        return {"orders": orders, "next": next_page, "summary": self.shopper.order_summary()}
+
+    def basket(self) -> Dict[str, Any]:
+        items = self.shopper.basket()
+        return {"items": items, "total": self.shopper.basket_summary().total}
+
+
+class ParanaServer:
+    """
+    Hosts many shopper sessions, running their database work on a bounded pool of worker threads
+    """
+
+    def __init__(self, db_file: str = DEFAULT_DB_FILE, workers: int = 8, catalog: CatalogCache = CATALOG_CACHE,
+                 maintenance: bool = False, basket_buffer: Optional[str] = None) -> None:
+        """
+        Args:
+            db_file: Path to the database file
+            workers: The number of worker threads (and pooled database connections)
+            catalog: The catalog cache shared by the sessions
+            maintenance: Run the maintenance tasks on a background thread, on one extra pooled connection
+            basket_buffer: Buffer the basket changes of each session with this durability (see basket_buffer.py),
+                           None commits each change
+        """
+        self.sql = SqlWrapper(db_file, pool_size=workers + maintenance)
+        self.catalog = catalog
+        self.basket_buffer = basket_buffer
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="parana-db")
+        self.connections = 0
+        migrate(self.sql)
+        self.sql.warm_up()
+        self.maintenance = MaintenanceScheduler(self.sql) if maintenance else None
+        if self.maintenance is not None:
+            self.maintenance.start()
+
+    async def run_db(self, func: Callable[..., Any], *args) -> Any:
+        """
+        Run blocking database work on the worker pool, without blocking the event loop
+        """
+        return await asyncio.get_running_loop().run_in_executor(self.executor, functools.partial(func, *args))
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+        try:
+            await ShopperConnection(self, reader, writer).run()
+        finally:
+            self.connections -= 1
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8417, unix_path: str = None) -> asyncio.AbstractServer:
+        """
+        Start listening on a TCP port, or a Unix socket if unix_path is given
+        """
+        if unix_path is not None:
+            return await asyncio.start_unix_server(self.handle_connection, path=unix_path)
+        return await asyncio.start_server(self.handle_connection, host=host, port=port)
+
+    def close(self) -> None:
+        if self.maintenance is not None:
+            self.maintenance.stop()
+        self.executor.shutdown(wait=True)
+        self.sql.close()
+
+
+async def serve(db_file: str, host: str, port: int, unix_path: str, workers: int, maintenance: bool = False,
+                basket_buffer: Optional[str] = None) -> None:
+    parana_server = ParanaServer(db_file, workers, maintenance=maintenance, basket_buffer=basket_buffer)
+    server = await parana_server.start(host, port, unix_path)
+    address = unix_path if unix_path is not None else "{}:{}".format(*server.sockets[0].getsockname()[:2])
+    # The address is the first line written, so a parent process (e.g. the load generator) can find a port chosen by the OS
+    print(f"Serving on {address}", flush=True)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        parana_server.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve many Parana shopper sessions from one process")
+    parser.add_argument("--database", default=DEFAULT_DB_FILE, help="Path to the database file")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=8417, help="TCP port to listen on, 0 lets the OS choose")
+    parser.add_argument("--unix", default=None, help="Listen on this Unix socket instead of TCP")
+    parser.add_argument("--workers", type=int, default=8, help="Database worker threads (and pooled connections)")
+    parser.add_argument("--maintenance", action="store_true", help="Run the database maintenance tasks in the background")
+    parser.add_argument("--basket-buffer", choices=DURABILITY_LEVELS, default=None,
+                        help="Buffer the basket changes of each session with this durability, instead of committing each one")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(serve(args.database, args.host, args.port, args.unix, args.workers, args.maintenance, args.basket_buffer))
+    except KeyboardInterrupt:
+        pass
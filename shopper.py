@@ -0,0 +1,322 @@
+import datetime
+import sqlite3
+from typing import Callable, Iterator, List, Optional, Tuple, Union
+
+from basket_buffer import BasketBuffer, FLUSH_INTERVAL
+from catalog import CatalogCache, CATALOG_CACHE
+from models import (BasketItem, BasketSummary, Category, OrderLine, Product, ProductSearchResult, SellerOffer,
+                    ShopperOrderSummary, ShopperProfile)
+from profiles import ProfileCache, PROFILE_CACHE
+from search import SEARCH_LIMIT, search_products
+from sql import SqlWrapper
+
+"""
+The shopper operations behind the Parana main menu, with no terminal I/O.
+
+ShopperService takes plain arguments and returns typed rows, raising ShopperError with a message for the shopper when a
+request cannot be completed. The terminal session (main.py) and the multi-session server (server.py) are both front ends to it.
+
+Basket changes are committed one by one unless enable_basket_buffer is called, which keeps them in a BasketBuffer
+(basket_buffer.py) and writes them together. close() flushes the buffer, so it must be called when the session ends.
+"""
+
+ORDER_HISTORY_PAGE_SIZE = 5
+ORDER_STATUSES = ["Placed", "Incomplete", "Complete", "Cancelled"]
+# Keyset to start the order history from, newer than any order
+LATEST_ORDER = ("9999-12-31", 2**63-1)
+
+
+class ShopperError(Exception):
+    """
+    A shopper request that could not be completed. The message is meant for the shopper.
+    """
+
+
+def load_profile(sql: SqlWrapper, query_name: str, key: Union[int, str],
+                 profiles: Optional[ProfileCache] = PROFILE_CACHE) -> Union[ShopperProfile, None]:
+    """
+    Look up a shopper profile by ID (query_name "shopper_profile") or account reference ("shopper_profile_by_account_ref"),
+    through the profile cache if there is one. Returns None if there is no such shopper.
+    """
+    if profiles is not None:
+        if query_name == "shopper_profile":
+            return profiles.get(sql, key)
+        return profiles.get_by_account_ref(sql, key)
+    row = sql.select_named(query_name, sql_parameters=(key,), fetch="one")
+    return ShopperProfile(*row) if row is not None else None
+
+
+class ShopperService:
+    """
+    The menu operations for one logged in shopper
+    """
+
+    def __init__(self, sql: SqlWrapper, shopper_id: int, catalog: CatalogCache = CATALOG_CACHE,
+                 profiles: Optional[ProfileCache] = PROFILE_CACHE, profile: ShopperProfile = None) -> None:
+        """
+        Args:
+            sql: The SqlWrapper to use, a pooled wrapper can be shared by every shopper
+            shopper_id: The ID of the shopper, see login to validate it first
+            catalog: The catalog cache used to browse products, shared between shoppers by default
+            profiles: The shopper profile cache, shared between shoppers by default. None reads profiles from the database
+            profile: The shoppers profile, if it has already been loaded
+        """
+        self.sql = sql
+        self.shopper_id = shopper_id
+        self.catalog = catalog
+        self.profiles = profiles
+        self.profile = profile
+        self.basket_buffer: Optional[BasketBuffer] = None
+        self.basket_id = self.get_basket_id()
+        if self.basket_id is None:
+            self.basket_id = self.create_basket()
+
+    @classmethod
+    def login(cls, sql: SqlWrapper, shopper_id: int, catalog: CatalogCache = CATALOG_CACHE,
+              profiles: Optional[ProfileCache] = PROFILE_CACHE) -> "ShopperService":
+        """
+        Return the service for a shopper, validating that the shopper ID is in the database
+        """
+        profile = load_profile(sql, "shopper_profile", shopper_id, profiles)
+        if profile is None:
+            raise ShopperError(f"Shopper ID {shopper_id} is not a valid Shopper ID")
+        return cls(sql, profile.shopper_id, catalog, profiles, profile)
+
+    @classmethod
+    def login_by_account_ref(cls, sql: SqlWrapper, shopper_account_ref: str, catalog: CatalogCache = CATALOG_CACHE,
+                             profiles: Optional[ProfileCache] = PROFILE_CACHE) -> "ShopperService":
+        """
+        Return the service for a shopper, found by their account reference (e.g. CB104093)
+        """
+        profile = load_profile(sql, "shopper_profile_by_account_ref", shopper_account_ref, profiles)
+        if profile is None:
+            raise ShopperError(f"{shopper_account_ref} is not a valid Shopper ID or account reference")
+        return cls(sql, profile.shopper_id, catalog, profiles, profile)
+
+    @classmethod
+    def authenticate(cls, sql: SqlWrapper, shopper_login: str, catalog: CatalogCache = CATALOG_CACHE,
+                     profiles: Optional[ProfileCache] = PROFILE_CACHE) -> "ShopperService":
+        """
+        Return the service for what the shopper entered to log in, either their Shopper ID or their account reference
+        """
+        shopper_login = shopper_login.strip()
+        if not shopper_login:
+            raise ShopperError("Please enter a Shopper ID or account reference")
+        if shopper_login.isdigit():
+            return cls.login(sql, int(shopper_login), catalog, profiles)
+        return cls.login_by_account_ref(sql, shopper_login, catalog, profiles)
+
+    def shopper_name(self) -> Tuple[str, str]:
+        """
+        Return the shoppers first name and surname
+        """
+        if self.profile is None:
+            self.profile = load_profile(self.sql, "shopper_profile", self.shopper_id, self.profiles)
+        return self.profile.shopper_first_name, self.profile.shopper_surname
+
+    def get_basket_id(self) -> Union[int, None]:
+        """
+        If there is a basket created from today, return its basket_id
+        """
+        basket = self.sql.select_named("todays_basket", sql_parameters=(self.shopper_id,), fetch="one")
+        return basket[0] if basket else None
+
+    def create_basket(self) -> int:
+        """
+        Create a new basket for the shopper, returning its basket_id
+        """
+        self.check_update(self.sql.update_named("create_basket", sql_parameters=(self.shopper_id, datetime.datetime.now().strftime("%Y-%m-%d"),)))
+        return self.sql.lastrowid
+
+    def enable_basket_buffer(self, durability: str = "journal", flush_interval: Optional[float] = FLUSH_INTERVAL,
+                             journal_dir: Optional[str] = None) -> BasketBuffer:
+        """
+        Buffer the changes to the basket and write them together, see BasketBuffer for the arguments
+        """
+        if self.basket_buffer is None:
+            self.basket_buffer = BasketBuffer(self.sql, self.basket_id, durability, flush_interval, journal_dir)
+        return self.basket_buffer
+
+    def order_history_page(self, before: Tuple[str, int] = LATEST_ORDER, page_size: int = ORDER_HISTORY_PAGE_SIZE,
+                           date_from: str = "", date_to: str = "9999-12-31", status: str = None) -> Tuple[List[OrderLine], Union[Tuple[str, int], None]]:
+        """
+        Return a page of the shoppers order history, newest first, and the key to pass as before to get the next page (None on the last page)
+
+        Args:
+            before: The (order_date, order_id) of the last order on the previous page
+            page_size: The number of orders on the page
+            date_from: Only include orders placed on or after this date (YYYY-MM-DD)
+            date_to: Only include orders placed on or before this date (YYYY-MM-DD)
+            status: Only include orders with this order status
+        """
+        # Ask for one order more than the page holds, to find out if there is a next page
+        rows = self.sql.select_named("order_history_page", sql_parameters=(self.shopper_id, before[0], before[1],
+                                                                           date_from, date_to, status, status, page_size+1))
+        order_lines = [OrderLine(*row) for row in rows]
+        order_keys = list(dict.fromkeys((line.order_date, line.order_id) for line in order_lines))
+        if len(order_keys) <= page_size:
+            return order_lines, None
+        last_key = order_keys[page_size-1]
+        return [line for line in order_lines if (line.order_date, line.order_id) >= last_key], last_key
+
+    def order_summary(self) -> ShopperOrderSummary:
+        """
+        Return the shoppers order count, lifetime spend and last order date
+        """
+        row = self.sql.select_named("shopper_order_summary", sql_parameters=(self.shopper_id,), fetch="one")
+        return ShopperOrderSummary(*row) if row is not None else ShopperOrderSummary(0, 0.0, None)
+
+    def iter_order_history(self, page_size: int = ORDER_HISTORY_PAGE_SIZE, **filters) -> Iterator[OrderLine]:
+        """
+        Yield the shoppers order history, newest first, fetching it a page at a time.
+        Takes the same filters as order_history_page.
+        """
+        before = LATEST_ORDER
+        while before is not None:
+            order_lines, before = self.order_history_page(before, page_size, **filters)
+            yield from order_lines
+
+    def categories(self) -> List[Category]:
+        return self.catalog.categories(self.sql)
+
+    def products(self, category_id: int) -> List[Product]:
+        return self.catalog.products(self.sql, category_id)
+
+    def offers(self, product_id: int) -> List[SellerOffer]:
+        return self.catalog.offers(self.sql, product_id)
+
+    def search(self, text: str, limit: int = SEARCH_LIMIT) -> List[ProductSearchResult]:
+        """
+        Return the products matching the words in text, best match first, with the cheapest seller of each
+        """
+        return search_products(self.sql, text, limit)
+
+    def add_item(self, product_id: int, seller_id: int, quantity: int) -> None:
+        """
+        Add a product from a seller to the basket, at the sellers current price
+        """
+        if quantity <= 0:
+            raise ShopperError("The quantity must be greater than 0")
+        offer = next((offer for offer in self.offers(product_id) if offer.seller_id == seller_id), None)
+        if offer is None:
+            raise ShopperError("That seller does not sell this product")
+
+        # NOTE: ix. in the brief says to create a new basket here, if there is not already one. This is done when the service is created.
+        if self.basket_buffer is not None:
+            product_description, = self.sql.select_named("product_description", sql_parameters=(product_id,), fetch="one")
+            try:
+                self.basket_buffer.add(BasketItem(product_id, seller_id, product_description, offer.seller_name, quantity, offer.price))
+            except sqlite3.IntegrityError:
+                raise ShopperError("That item is already in your basket. Please edit the quantity of the item in Option 4, or delete the item in Option 5") from None
+            except OSError:
+                raise ShopperError("Your basket could not be saved. Please try again") from None
+            return
+        query_status = self.sql.update_named("add_basket_item",
+                                             sql_parameters=(self.basket_id, product_id, seller_id, quantity, offer.price))
+        if isinstance(query_status, sqlite3.IntegrityError):
+            raise ShopperError("That item is already in your basket. Please edit the quantity of the item in Option 4, or delete the item in Option 5")
+        self.check_update(query_status)
+
+    def basket(self) -> List[BasketItem]:
+        """
+        Return the contents of the shoppers basket
+        """
+        if self.basket_buffer is not None:
+            return self.basket_buffer.items()
+        return [BasketItem(*row) for row in self.sql.select_named("basket_contents", sql_parameters=self.basket_id)]
+
+    def basket_summary(self) -> BasketSummary:
+        """
+        Return the number of lines in the basket and its total
+        """
+        if self.basket_buffer is not None:
+            return self.basket_buffer.summary()
+        row = self.sql.select_named("basket_summary", sql_parameters=(self.basket_id,), fetch="one")
+        return BasketSummary(*row) if row is not None else BasketSummary(0, 0.0)
+
+    def change_quantity(self, product_id: int, quantity: int) -> None:
+        """
+        Change the quantity of an item in the basket.
+        The basket_contents table has 2 primary keys. basket_id and product_id.
+        So there can only be 1 of a product added to a basket, even if they are from different sellers.
+        """
+        if quantity <= 0:
+            raise ShopperError("The quantity must be greater than 0")
+        if self.basket_buffer is not None:
+            self.buffer_change(self.basket_buffer.change_quantity, product_id, quantity)
+            return
+        self.check_update(self.sql.update_named("change_basket_quantity", sql_parameters=(quantity, self.basket_id, product_id)))
+
+    def remove_item(self, product_id: int) -> None:
+        """
+        Remove an item from the shoppers basket
+        """
+        if self.basket_buffer is not None:
+            self.buffer_change(self.basket_buffer.remove, product_id)
+            return
+        self.check_update(self.sql.update_named("remove_basket_item", sql_parameters=(self.basket_id, product_id)))
+
+    @staticmethod
+    def check_update(query_status: Union[None, Exception]) -> None:
+        """
+        Raise a ShopperError if an update_named call returned an error
+        """
+        if query_status is not None:
+            raise ShopperError("Database Error! Your basket has not been changed. Please try again")
+
+    @staticmethod
+    def buffer_change(change: Callable[..., None], *args) -> None:
+        """
+        Make a change to the buffered basket, raising a ShopperError if it could not be written to the journal
+        """
+        try:
+            change(*args)
+        except OSError:
+            raise ShopperError("Database Error! Your basket has not been changed. Please try again") from None
+
+    def checkout(self) -> int:
+        """
+        Place an order for the basket and start a new basket, returning the order ID
+        """
+        try:
+            order_id = self.place_order()
+        except sqlite3.Error:
+            raise ShopperError("Checkout failed, your basket has not been changed. Please try again") from None
+        # The checked out basket has been deleted, so carry on shopping with a new one
+        self.basket_id = self.create_basket()
+        if self.basket_buffer is not None:
+            self.basket_buffer.move_to(self.basket_id)
+        return order_id
+
+    def place_order(self) -> int:
+        """
+        Turn the basket into an order in a single transaction, returning the order ID.
+        Either every table is updated or, if anything fails, none of them are. The transaction is retried if the database is busy.
+        """
+        def place_order_transaction() -> int:
+            # Insert row into shoppers_orders
+            order_id = self.sql.execute_named("create_order", sql_parameters=(
+                self.shopper_id, datetime.datetime.now().strftime("%Y-%m-%d"), "Placed")).lastrowid
+
+            # Copy the basket contents into ordered_products in one statement
+            if self.sql.execute_named("order_basket_contents", sql_parameters=(order_id, self.basket_id)).rowcount == 0:
+                raise sqlite3.IntegrityError("Cannot place an order for an empty basket")
+
+            # Delete rows in basket_contents associated with the basket
+            self.sql.execute_named("clear_basket", sql_parameters=(self.basket_id,))
+
+            # Delete basket in shopper_baskets
+            self.sql.execute_named("delete_basket", sql_parameters=(self.basket_id,))
+            return order_id
+
+        if self.basket_buffer is not None:
+            # The buffered changes are written in the same transaction, so the order is placed for the basket as shown
+            return self.basket_buffer.flush_with(place_order_transaction)
+        return self.sql.run_in_transaction(place_order_transaction)
+
+    def close(self) -> None:
+        """
+        Release anything the service holds, writing the buffered basket changes. The SqlWrapper is left open, as it may be shared.
+        """
+        if self.basket_buffer is not None:
+            self.basket_buffer.close()
@@ -1,23 +1,415 @@
+import logging
+import os
 import sqlite3
-from typing import Literal, Union, Tuple
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from itertools import islice
+from typing import Any, Callable, ContextManager, Literal, Union, Tuple, Dict, Iterator, List, Optional
+
+from queries import QUERIES, QueryRegistry, StatementCache
+from tracing import QueryTracer, Trace
+
+
+DEFAULT_DB_FILE = os.path.join(".", "database")
+DEFAULT_STATEMENT_CACHE_SIZE = 128
+
+logger = logging.getLogger("parana.sql")
+
+
+def read_only_uri(db_file: str) -> str:
+    """
+    The URI that opens db_file read-only, e.g. for reports that must never write to the shop database
+    """
+    # urllib.request takes longer to import than the rest of this module, and only read-only connections need it
+    from urllib.request import pathname2url
+    return f"file:{pathname2url(os.path.abspath(db_file))}?mode=ro"
+
+
+class Connection(sqlite3.Connection):
+    """
+    sqlite3 connection that keeps a model of its statement cache, so named queries can report cache hits and misses
+    """
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.statement_cache = StatementCache(kwargs.get("cached_statements", DEFAULT_STATEMENT_CACHE_SIZE))
+
+
+class FetchedCursor:
+    """
+    The rows of a query read before its pooled connection was released, used like the sqlite3.Cursor that returned them
+    """
+    def __init__(self, cursor: sqlite3.Cursor) -> None:
+        self.description = cursor.description
+        self.rowcount = cursor.rowcount
+        self.lastrowid = cursor.lastrowid
+        self._rows = iter(cursor.fetchall())
+
+    def __iter__(self) -> Iterator[tuple]:
+        return self._rows
+
+    def fetchone(self) -> Optional[tuple]:
+        return next(self._rows, None)
+
+    def fetchmany(self, size: int = 1) -> list:
+        return list(islice(self._rows, size))
+
+    def fetchall(self) -> list:
+        return list(self._rows)
+
+
+class ConnectionPool:
+    """
+    A bounded pool of pre-configured connections to the database, safe to share between threads.
+    Connections are opened lazily up to pool_size and are configured once when they are opened,
+    so checking one out of the pool does not pay for the connection setup again.
+    """
+    def __init__(self, db_file: str = DEFAULT_DB_FILE, pool_size: int = 5, journal_mode: str = "WAL",
+                 synchronous: str = "NORMAL", busy_timeout: int = 5000, mmap_size: int = 256 * 1024 * 1024,
+                 cache_size: int = -16000, checkout_timeout: Optional[float] = None,
+                 statement_cache_size: int = DEFAULT_STATEMENT_CACHE_SIZE, read_only: bool = False) -> None:
+        """
+        Args:
+            db_file: Path to the database file
+            pool_size: The maximum number of connections opened at once
+            journal_mode: PRAGMA journal_mode, WAL lets readers and a writer work at the same time
+            synchronous: PRAGMA synchronous level, NORMAL is durable enough for WAL mode
+            busy_timeout: How long (ms) a connection waits on a locked database before failing
+            mmap_size: PRAGMA mmap_size in bytes
+            cache_size: PRAGMA cache_size, negative values are in KiB
+            checkout_timeout: How long (s) acquire() waits for a free connection, None waits forever
+            statement_cache_size: How many prepared statements each connection keeps cached
+            read_only: Open the connections with mode=ro, journal_mode and synchronous are then left as they are
+        """
+        if pool_size < 1:
+            raise ValueError("pool_size must be at least 1")
+        self.db_file = db_file
+        self.pool_size = pool_size
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+        self.busy_timeout = busy_timeout
+        self.mmap_size = mmap_size
+        self.cache_size = cache_size
+        self.checkout_timeout = checkout_timeout
+        self.statement_cache_size = statement_cache_size
+        self.read_only = read_only
+
+        # Most recently returned last, so the busiest connections (with warm caches) are reused first
+        self._idle: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        # Notified when a connection is returned, a new one may be opened, or the pool is closed
+        self._available = threading.Condition(self._lock)
+        self._closed = False
+        self._opened = 0
+        self._in_use = 0
+        self._checkouts = 0
+        self._waits = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    def __str__(self):
+        return f"Connection pool ({self.pool_size} connections) for: {self.db_file}"
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Open and configure a new connection for the pool
+        """
+        db = sqlite3.connect(read_only_uri(self.db_file) if self.read_only else self.db_file, timeout=self.busy_timeout / 1000,
+                             check_same_thread=False, factory=Connection, cached_statements=self.statement_cache_size,
+                             uri=self.read_only)
+        if not self.read_only:
+            # Changing the journal mode writes to the database file
+            db.execute(f"PRAGMA journal_mode={self.journal_mode}")
+            db.execute(f"PRAGMA synchronous={self.synchronous}")
+        db.execute(f"PRAGMA busy_timeout={int(self.busy_timeout)}")
+        db.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        db.execute(f"PRAGMA cache_size={int(self.cache_size)}")
+        db.execute("PRAGMA foreign_keys=ON")
+        return db
+
+    def acquire(self, timeout: Optional[float] = None) -> sqlite3.Connection:
+        """
+        Check a connection out of the pool, waiting for one to be returned if they are all in use
+
+        Args:
+            timeout: How long (s) to wait for a connection, defaults to checkout_timeout
+        """
+        start = time.perf_counter()
+        timeout = self.checkout_timeout if timeout is None else timeout
+        db = None
+        open_new = False
+        with self._available:
+            while True:
+                # Checked again after each wait, as close() wakes the waiting threads
+                if self._closed:
+                    raise sqlite3.ProgrammingError("Cannot operate on a closed connection pool.")
+                if self._idle:
+                    db = self._idle.pop()
+                    break
+                if self._opened < self.pool_size:
+                    self._opened += 1
+                    open_new = True
+                    break
+                remaining = None if timeout is None else timeout - (time.perf_counter() - start)
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError(f"Timed out waiting for a connection from {self}")
+                self._available.wait(remaining)
+
+        if open_new:
+            try:
+                db = self._connect()
+            except sqlite3.Error:
+                with self._available:
+                    self._opened -= 1
+                    self._available.notify()
+                raise
+
+        waited = time.perf_counter() - start
+        with self._lock:
+            self._in_use += 1
+            self._checkouts += 1
+            if not open_new and waited > 0.001:
+                self._waits += 1
+            self._total_wait += waited
+            self._max_wait = max(self._max_wait, waited)
+        return db
+
+    def release(self, db: sqlite3.Connection) -> None:
+        """
+        Return a connection to the pool. Any uncommitted changes are rolled back.
+        """
+        if db.in_transaction:
+            db.rollback()
+        with self._available:
+            self._in_use -= 1
+            if self._closed:
+                self._opened -= 1
+                db.close()
+                return
+            self._idle.append(db)
+            self._available.notify()
+
+    @contextmanager
+    def connection(self, timeout: Optional[float] = None) -> Iterator[sqlite3.Connection]:
+        """
+        Check out a connection for the duration of a with block
+        """
+        db = self.acquire(timeout)
+        try:
+            yield db
+        finally:
+            self.release(db)
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        """
+        Return usage statistics for the pool
+        """
+        with self._lock:
+            return {"pool_size": self.pool_size,
+                    "connections_open": self._opened,
+                    "connections_in_use": self._in_use,
+                    "connections_idle": self._opened - self._in_use,
+                    "checkouts": self._checkouts,
+                    "checkouts_waited": self._waits,
+                    "total_wait_time": self._total_wait,
+                    "mean_wait_time": self._total_wait / self._checkouts if self._checkouts else 0.0,
+                    "max_wait_time": self._max_wait}
+
+    def close(self) -> None:
+        """
+        Close the idle connections. Connections still checked out are closed when they are released, and threads
+        waiting in acquire() raise sqlite3.ProgrammingError.
+        """
+        with self._available:
+            self._closed = True
+            while self._idle:
+                self._idle.pop().close()
+                self._opened -= 1
+            self._available.notify_all()
 
 
 class SqlWrapper:
     """
     SQL Wrapper to create a connection to the database automatically and handle queries
+
+    By default the wrapper owns a single connection and cursor. In pooled mode (pool_size or pool is given)
+    every call checks a connection out of a ConnectionPool and uses its own cursor, so one wrapper can be
+    shared between threads, or many wrappers can share one pool.
+
+    Queries in the QueryRegistry can be run by name with select_named/update_named.
+    With read_only the database is opened with mode=ro, so any write fails with sqlite3.OperationalError.
+    Pass a QueryTracer to record the time, rows and errors of every query (see tracing.py).
     """
-    def __init__(self, db_file: str = r".\database") -> None:
+    def __init__(self, db_file: str = DEFAULT_DB_FILE, pool_size: Optional[int] = None,
+                 pool: Optional[ConnectionPool] = None, queries: QueryRegistry = QUERIES,
+                 statement_cache_size: int = DEFAULT_STATEMENT_CACHE_SIZE, tracer: Optional[QueryTracer] = None,
+                 read_only: bool = False, **pool_options) -> None:
+        """
+        Args:
+            db_file: Path to the database file
+            pool_size: Create a ConnectionPool of this size for this wrapper
+            pool: Use an existing (shared) ConnectionPool
+            queries: The registry of named queries
+            statement_cache_size: How many prepared statements each connection keeps cached
+            tracer: Record query timings with this tracer, it can be shared between wrappers
+            read_only: Open the database read-only (mode=ro), ignored if an existing pool is given
+            pool_options: Extra ConnectionPool settings, e.g. journal_mode, busy_timeout, cache_size
+        """
         self.db_file = db_file
-        self.db = sqlite3.connect(self.db_file)
-        self.cursor = self.db.cursor()
-        self.cursor.execute("PRAGMA foreign_keys=ON")
-        
+        self.pool = pool
+        self.queries = queries
+        self.tracer = tracer
+        self._owns_pool = False
+        if self.pool is None and pool_size:
+            self.pool = ConnectionPool(db_file, pool_size, statement_cache_size=statement_cache_size, read_only=read_only,
+                                       **pool_options)
+            self._owns_pool = True
+
+        if self.pool is None:
+            self.db = sqlite3.connect(read_only_uri(self.db_file) if read_only else self.db_file, factory=Connection,
+                                      cached_statements=statement_cache_size, uri=read_only)
+            self.cursor = self.db.cursor()
+            self.cursor.execute("PRAGMA foreign_keys=ON")
+        else:
+            self.db_file = self.pool.db_file
+            self._local = threading.local()
+
     def __str__(self):
         return f"SQL Database wrapper for: {self.db_file}"
-        
-    def execute(self, sql_query: str, sql_parameters: Tuple[str, int] = tuple()) -> None:
-        self.cursor.execute(sql_query, sql_parameters)
-        
+
+    @property
+    def lastrowid(self) -> Optional[int]:
+        """
+        The rowid of the last row inserted by this wrapper (on this thread in pooled mode)
+        """
+        if self.pool is None:
+            return self.cursor.lastrowid
+        return getattr(self._local, "lastrowid", None)
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """
+        Yields the connection to run a call on.
+        In pooled mode the connection is pinned to the current thread while it is in use, so calls nested in a
+        with block share it, and a connection left with an open transaction (commit=False) stays checked out
+        until the transaction is committed or rolled back.
+        """
+        if self.pool is None:
+            yield self.db
+            return
+        local = self._local
+        if getattr(local, "db", None) is None:
+            local.db = self.pool.acquire()
+            local.depth = 0
+        local.depth += 1
+        try:
+            yield local.db
+        finally:
+            local.depth -= 1
+            if local.depth == 0 and not local.db.in_transaction:
+                db, local.db = local.db, None
+                self.pool.release(db)
+
+    @contextmanager
+    def transaction(self, mode: Literal['DEFERRED', 'IMMEDIATE', 'EXCLUSIVE'] = "IMMEDIATE") -> Iterator[sqlite3.Connection]:
+        """
+        Run a with block as one explicit transaction. It is committed if the block completes and rolled back if it raises.
+
+        Args:
+            mode: The BEGIN mode, IMMEDIATE takes the write lock up front so the transaction cannot fail part way with SQLITE_BUSY
+        """
+        with self.connection() as db:
+            if db.in_transaction:
+                raise sqlite3.ProgrammingError("A transaction is already open on this connection")
+            db.execute(f"BEGIN {mode}")
+            try:
+                yield db
+            except BaseException:
+                db.rollback()
+                raise
+            db.commit()
+
+    def run_in_transaction(self, func: Callable[[], Any], mode: Literal['DEFERRED', 'IMMEDIATE', 'EXCLUSIVE'] = "IMMEDIATE",
+                           retries: int = 5, retry_delay: float = 0.05) -> Any:
+        """
+        Call func in a transaction, returning its result. If the database is busy the whole transaction is retried.
+
+        Args:
+            func: Runs the statements of the transaction, e.g. through execute_named
+            mode: The BEGIN mode
+            retries: How many times to retry when the database is busy or locked
+            retry_delay: Seconds to wait before the first retry, doubling on each retry after
+        """
+        for attempt in range(retries + 1):
+            try:
+                with self.transaction(mode):
+                    return func()
+            except sqlite3.OperationalError as e:
+                if not self.is_busy_error(e) or attempt == retries:
+                    raise
+                time.sleep(retry_delay * 2 ** attempt)
+
+    @staticmethod
+    def is_busy_error(error: sqlite3.Error) -> bool:
+        """
+        True if the error is SQLITE_BUSY or SQLITE_LOCKED, i.e. another connection holds a lock and the statement can be retried
+        """
+        error_code = getattr(error, "sqlite_errorcode", None)
+        if error_code is not None:
+            return error_code & 0xFF in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+        return "locked" in str(error) or "busy" in str(error)
+
+    def execute(self, sql_query: str, sql_parameters: Tuple[str, int] = tuple()) -> sqlite3.Cursor:
+        """
+        Runs a query, raising any database error. Mostly for use inside transaction()/run_in_transaction()
+        """
+        if not isinstance(sql_parameters, tuple):
+            sql_parameters = (sql_parameters,)
+        with self.connection() as db, self._trace(db, sql_query) as trace:
+            cursor = self._execute(db, sql_query, sql_parameters)
+            trace.rows = cursor.rowcount
+            return self._detach(db, cursor)
+
+    def execute_named(self, query_name: str, sql_parameters: Tuple[str, int] = tuple()) -> sqlite3.Cursor:
+        """
+        Runs a query from the query registry by name, see execute
+        """
+        if not isinstance(sql_parameters, tuple):
+            sql_parameters = (sql_parameters,)
+        sql_query = self.queries[query_name].sql
+        with self.connection() as db, self._trace(db, sql_query, query_name) as trace:
+            cursor = self._execute(db, sql_query, sql_parameters, query_name)
+            trace.rows = cursor.rowcount
+            return self._detach(db, cursor)
+
+    def _detach(self, db: Connection, cursor: sqlite3.Cursor) -> Union[sqlite3.Cursor, FetchedCursor]:
+        """
+        Return the cursor of a call, with its rows read first if its pooled connection is released when the call ends.
+        The connection could otherwise be checked out by another thread while the caller is still reading the cursor.
+        """
+        if self.pool is None or cursor.description is None or self._local.depth > 1 or db.in_transaction:
+            return cursor
+        return FetchedCursor(cursor)
+
+    def _trace(self, db: Connection, sql_query: str, query_name: Optional[str] = None) -> ContextManager[Trace]:
+        """
+        Time a call with the tracer, if there is one. The rows of a cursor that is returned unread are not counted.
+        """
+        if self.tracer is None:
+            return nullcontext(Trace())
+        return self.tracer.trace(db, sql_query, query_name)
+
+    def _execute(self, db: Connection, sql_query: str, sql_parameters: Tuple[str, int],
+                 query_name: Optional[str] = None) -> sqlite3.Cursor:
+        cached = db.statement_cache.touch(sql_query)
+        if query_name is not None:
+            self.queries.record(query_name, cached)
+        if self.pool is None:
+            return self.cursor.execute(sql_query, sql_parameters)
+        cursor = db.execute(sql_query, sql_parameters)
+        self._local.lastrowid = cursor.lastrowid
+        return cursor
+
     def select_query(self, sql_query, sql_parameters: Tuple[str, int] = tuple(), fetch: Literal['all', 'many', 'one'] = "all", num_fetch: int = 1):
         """
         Creates a SELECT query
@@ -25,20 +417,34 @@ class SqlWrapper:
         Args:
             sql_query: An SQL Query to execute
             sql_parameters: Parameters for an SQL query
-            fetch: If set to "all", fetches all the rows returned, 
+            fetch: If set to "all", fetches all the rows returned,
                    If set to "one" returns only 1.
                    If set to "many" returns a set number of rows, specified by num_fetch
         """
+        return self._select(sql_query, sql_parameters, fetch, num_fetch)
+
+    def select_named(self, query_name: str, sql_parameters: Tuple[str, int] = tuple(), fetch: Literal['all', 'many', 'one'] = "all", num_fetch: int = 1):
+        """
+        Runs a SELECT query from the query registry by name, see select_query
+        """
+        return self._select(self.queries[query_name].sql, sql_parameters, fetch, num_fetch, query_name)
+
+    def _select(self, sql_query, sql_parameters, fetch, num_fetch, query_name=None):
         if not isinstance(sql_parameters, tuple):
             sql_parameters = (sql_parameters,)
-        self.execute(sql_query, sql_parameters)
-        if fetch == "all":
-            return self.cursor.fetchall()
-        elif fetch == "many":
-            return self.cursor.fetchmany(num_fetch)
-        elif fetch == "one":
-            return self.cursor.fetchone()
-        
+        with self.connection() as db, self._trace(db, sql_query, query_name) as trace:
+            cursor = self._execute(db, sql_query, sql_parameters, query_name)
+            if fetch == "all":
+                rows = cursor.fetchall()
+                trace.rows = len(rows)
+            elif fetch == "many":
+                rows = cursor.fetchmany(num_fetch)
+                trace.rows = len(rows)
+            elif fetch == "one":
+                rows = cursor.fetchone()
+                trace.rows = int(rows is not None)
+            return rows
+
     def update_table(self, sql_query, sql_parameters: Tuple[str, int] = tuple(), commit=True) -> Union[None, Exception]:
         """
         Creates a INSERT/UPDATE/DELETE query
@@ -47,23 +453,102 @@ class SqlWrapper:
             sql_query: An SQL Query to execute
             sql_parameters: Parameters for an SQL query
             commit: Commit changes to database immediatly
+
+        Returns the error if the query fails (the transaction is rolled back), otherwise None
+        """
+        return self._update(sql_query, sql_parameters, commit)
+
+    def update_named(self, query_name: str, sql_parameters: Tuple[str, int] = tuple(), commit=True) -> Union[None, Exception]:
         """
+        Runs an INSERT/UPDATE/DELETE query from the query registry by name, see update_table
+        """
+        return self._update(self.queries[query_name].sql, sql_parameters, commit, query_name)
+
+    def _update(self, sql_query, sql_parameters, commit, query_name=None):
         if not isinstance(sql_parameters, tuple):
             sql_parameters = (sql_parameters,)
+        with self.connection() as db, self._trace(db, sql_query, query_name) as trace:
+            try:
+                trace.rows = self._execute(db, sql_query, sql_parameters, query_name).rowcount
+            except sqlite3.IntegrityError as e:
+                trace.error = True
+                db.rollback()
+                return e
+            except sqlite3.Error as e:
+                trace.error = True
+                db.rollback()
+                logger.error("Database Error! %s running: %s", e, query_name or sql_query)
+                return e
+            if commit:
+                db.commit()
+
+    def commit(self) -> None:
+        """
+        Commit the open transaction
+        """
+        with self.connection() as db:
+            db.commit()
+
+    def rollback(self) -> None:
+        """
+        Roll back the open transaction
+        """
+        with self.connection() as db:
+            db.rollback()
+
+    def warm_up(self) -> None:
+        """
+        Prepare every read query in the registry on every connection, so the first use of a query does not pay for
+        compiling it. sqlite3 can only prepare a statement by executing it, so each query is run with NULL parameters.
+        INSERT/UPDATE/DELETE queries are left to be prepared when first used, as running them would take the write lock.
+        """
+        if self.pool is None:
+            self._warm_up(self.db)
+            return
+        connections = [self.pool.acquire() for _ in range(self.pool.pool_size)]
         try:
-            self.execute(sql_query, sql_parameters)
-        except sqlite3.IntegrityError as e:
-            self.db.rollback()
-            return e
-        except sqlite3.Error as e:
-            self.db.rollback()
-            print("Database Error!")
-        if commit:
-            self.db.commit()
- 
+            for db in connections:
+                self._warm_up(db)
+        finally:
+            for db in connections:
+                self.pool.release(db)
+
+    def _warm_up(self, db: Connection) -> None:
+        for query in self.queries:
+            if query.sql.split(None, 1)[0].upper() not in ("SELECT", "WITH"):
+                continue
+            db.statement_cache.touch(query.sql)
+            try:
+                # The cursor is dropped unread, which resets the statement and ends its read
+                db.execute(query.sql, (None,) * query.param_count)
+            except sqlite3.Error:
+                pass  # Only the prepared statement is wanted
+
+    def query_stats(self) -> Dict[str, Dict[str, int]]:
+        """
+        Return the statement cache hits and misses for each named query
+        """
+        return self.queries.stats()
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        """
+        Return the connection pool statistics, empty if the wrapper is not pooled
+        """
+        return self.pool.stats() if self.pool is not None else {}
+
     def close(self) -> None:
-        self.db.close()
-    
+        if self.tracer is not None:
+            self.tracer.dump()
+        if self.pool is None:
+            self.db.close()
+            return
+        db = getattr(self._local, "db", None)
+        if db is not None:
+            self._local.db = None
+            self.pool.release(db)
+        if self._owns_pool:
+            self.pool.close()
+
 if __name__ == "__main__":
     sql = SqlWrapper(r"C:\Users\willb\Desktop\Work\Uni\Databases Assessment\database")
-    print(sql)
\ No newline at end of file
+    print(sql)
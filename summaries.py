@@ -0,0 +1,97 @@
+import argparse
+from typing import Dict, List
+
+from migrations import SUMMARY_ROWS, migrate
+from models import SellerSales
+from sql import SqlWrapper, DEFAULT_DB_FILE
+
+"""
+Summary tables of shopper orders, seller sales and basket totals (migration 4).
+
+shopper_order_summary   Per shopper: order count, lifetime spend and last order date
+seller_sales_summary    Per seller: revenue and units sold
+basket_summary          Per basket: the number of lines and the running total
+
+Triggers on shopper_orders, ordered_products, basket_contents and shopper_baskets keep them current, so totals are
+read from one row instead of being re-aggregated. check() recomputes every summary from scratch and reports the rows
+that differ. rebuild() replaces the summaries with the recomputed rows, e.g. after changes made with the triggers off.
+
+Usage:
+python summaries.py [--database PATH] --check     -> report summary rows that are out of date
+python summaries.py [--database PATH] --rebuild   -> recompute every summary
+python summaries.py [--database PATH]             -> the best selling sellers
+"""
+
+# The summary rows a table holds, leaving out rows that have gone back to nothing (e.g. a shopper whose orders were all
+# deleted), which the recomputed rows do not have
+STORED_ROWS = {
+    "shopper_order_summary": "SELECT shopper_id, order_count, lifetime_spend, last_order_date "
+                             "FROM shopper_order_summary WHERE order_count <> 0",
+    "seller_sales_summary": "SELECT seller_id, revenue, units_sold "
+                            "FROM seller_sales_summary WHERE units_sold <> 0 OR revenue <> 0",
+    "basket_summary": "SELECT basket_id, line_count, total "
+                      "FROM basket_summary WHERE line_count <> 0",
+}
+
+
+def check(sql: SqlWrapper) -> Dict[str, List[tuple]]:
+    """
+    Return the rows of each summary table that differ from the recomputed rows (stored rows that are wrong,
+    and recomputed rows that are missing). Every list is empty if the summaries are consistent.
+    """
+    mismatches = {}
+    with sql.transaction("DEFERRED"):
+        # One read transaction, so the summaries and the tables they summarise are compared at the same point in time
+        for table, rows in SUMMARY_ROWS.items():
+            mismatches[table] = sql.select_query(f"SELECT 'stored', * FROM ({STORED_ROWS[table]} EXCEPT {rows}) "
+                                                 "UNION ALL "
+                                                 f"SELECT 'expected', * FROM ({rows} EXCEPT {STORED_ROWS[table]})")
+    return mismatches
+
+
+def rebuild(sql: SqlWrapper) -> Dict[str, int]:
+    """
+    Recompute every summary table in one transaction, returning the number of rows in each
+    """
+    counts = {}
+    with sql.transaction() as db:
+        for table, rows in SUMMARY_ROWS.items():
+            db.execute(f"DELETE FROM {table}")
+            counts[table] = db.execute(f"INSERT INTO {table} {rows}").rowcount
+    return counts
+
+
+def top_sellers(sql: SqlWrapper, limit: int = 10) -> List[SellerSales]:
+    """
+    Return the sellers with the most revenue, most first
+    """
+    return [SellerSales(*row) for row in sql.select_named("top_sellers", sql_parameters=(limit,))]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check or rebuild the Parana summary tables")
+    parser.add_argument("--database", default=DEFAULT_DB_FILE, help="Path to the database file")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--check", action="store_true", help="Report summary rows that are out of date")
+    group.add_argument("--rebuild", action="store_true", help="Recompute every summary table")
+    args = parser.parse_args()
+
+    sql = SqlWrapper(args.database)
+    migrate(sql)
+    if args.check:
+        mismatches = check(sql)
+        for table, rows in mismatches.items():
+            print(f"{table}: {'OK' if not rows else f'{len(rows)} row(s) differ'}")
+            for row in rows[:10]:
+                print(f"  {row}")
+        exit_code = 1 if any(mismatches.values()) else 0
+    elif args.rebuild:
+        for table, count in rebuild(sql).items():
+            print(f"Rebuilt {table}: {count} rows")
+        exit_code = 0
+    else:
+        for seller in top_sellers(sql):
+            print(f"{seller.seller_name:<30}£{seller.revenue:>12,.2f}{seller.units_sold:>8} units")
+        exit_code = 0
+    sql.close()
+    raise SystemExit(exit_code)
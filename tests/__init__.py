@@ -0,0 +1,3 @@
+"""
+Tests for the Parana shopper session. Run them from the project root, e.g. python -m pytest
+"""
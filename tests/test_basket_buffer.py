@@ -0,0 +1,174 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from typing import Dict, List, Optional, Tuple
+
+from basket_buffer import BasketBuffer, journal_directory, journal_line, journal_path, read_journal
+from migrations import migrate
+from models import BasketItem
+from shopper import ShopperService
+from sql import SqlWrapper, DEFAULT_DB_FILE
+
+"""
+Crash recovery of the basket buffer (basket_buffer.py): a session killed part way through a flush must lose none of the
+changes it acknowledged with journal or fsync durability, and replaying its journal must write exactly the lines that
+were not flushed. Each test runs on a migrated copy of the database.
+"""
+
+Edit = Tuple  # ("add", product_id, seller_id, quantity) / ("change", product_id, quantity) / ("remove", product_id)
+# What the basket ends up holding: product_id -> (seller_id, quantity), or None for a removed product
+Lines = Dict[int, Optional[Tuple[int, int]]]
+
+
+def apply(shopper: ShopperService, edit: Edit) -> None:
+    if edit[0] == "add":
+        shopper.add_item(*edit[1:])
+    elif edit[0] == "change":
+        shopper.change_quantity(*edit[1:])
+    else:
+        shopper.remove_item(*edit[1:])
+
+
+def lines_after(edits: List[Edit], lines: Lines = None) -> Lines:
+    lines = dict(lines or {})
+    for edit in edits:
+        if edit[0] == "add":
+            lines[edit[1]] = (edit[2], edit[3])
+        elif edit[0] == "change":
+            lines[edit[1]] = (lines[edit[1]][0], edit[2])
+        else:
+            lines[edit[1]] = None
+    return lines
+
+
+def in_basket(lines: Lines) -> Lines:
+    return {product_id: line for product_id, line in lines.items() if line is not None}
+
+
+def killed_mid_flush(db_file: str, shopper_id: int, durability: str, flushed: List[Edit], unflushed: List[Edit],
+                     flushing: multiprocessing.Event) -> None:
+    """
+    Flush the first edits, make the rest, then start a flush that stops after its first write, to be killed there
+    """
+    sql = SqlWrapper(db_file)
+    shopper = ShopperService(sql, shopper_id, profiles=None)
+    buffer = shopper.enable_basket_buffer(durability, flush_interval=None)
+    for edit in flushed:
+        apply(shopper, edit)
+    buffer.flush()
+    for edit in unflushed:
+        apply(shopper, edit)
+
+    execute_named = sql.execute_named
+
+    def stalled(query_name: str, *args, **kwargs):
+        result = execute_named(query_name, *args, **kwargs)
+        if query_name != "basket_lines":
+            flushing.set()
+            time.sleep(60)
+        return result
+
+    sql.execute_named = stalled
+    buffer.flush()
+
+
+class BasketBufferCrashTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.tmp, "database")
+        shutil.copyfile(DEFAULT_DB_FILE, self.db_file)
+        sql = SqlWrapper(self.db_file)
+        migrate(sql)
+        self.shopper_id, = sql.select_query("SELECT MIN(shopper_id) FROM shoppers", fetch="one")
+        offers = sql.select_query("SELECT product_id, MIN(seller_id) FROM product_sellers GROUP BY product_id "
+                                  "ORDER BY product_id LIMIT 4")
+        self.basket_id = ShopperService(sql, self.shopper_id, profiles=None).basket_id
+        sql.close()
+        (a, seller_a), (b, seller_b), (c, seller_c), (d, seller_d) = offers
+        self.flushed = [("add", a, seller_a, 1), ("add", b, seller_b, 2), ("add", c, seller_c, 1)]
+        self.unflushed = [("change", a, 5), ("remove", b), ("add", d, seller_d, 3), ("change", d, 4)]
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.tmp)
+
+    def journal(self) -> str:
+        return journal_path(journal_directory(self.db_file), self.basket_id)
+
+    def database_lines(self, sql: SqlWrapper) -> Lines:
+        return {product_id: (seller_id, quantity)
+                for product_id, seller_id, quantity, _ in sql.select_named("basket_lines", sql_parameters=(self.basket_id,))}
+
+    def kill_mid_flush(self, durability: str) -> None:
+        context = multiprocessing.get_context("spawn")
+        flushing = context.Event()
+        session = context.Process(target=killed_mid_flush, args=(self.db_file, self.shopper_id, durability, self.flushed,
+                                                                 self.unflushed, flushing))
+        session.start()
+        try:
+            self.assertTrue(flushing.wait(60), "The session did not reach its flush")
+        finally:
+            session.kill()
+            session.join()
+
+    def check_replay(self, durability: str) -> None:
+        flushed = lines_after(self.flushed)
+        unflushed = lines_after(self.unflushed, flushed)
+        self.kill_mid_flush(durability)
+
+        # The flush that was killed is rolled back, and the journal holds exactly the lines it did not write
+        pending = {product_id: (item.seller_id, item.quantity) if item is not None else None
+                   for product_id, item in read_journal(self.journal()).items()}
+        self.assertEqual(pending, {product_id: unflushed[product_id] for product_id in {edit[1] for edit in self.unflushed}})
+        sql = SqlWrapper(self.db_file)
+        self.assertEqual(self.database_lines(sql), in_basket(flushed))
+
+        recovered = BasketBuffer(sql, self.basket_id, durability, flush_interval=None)
+        self.assertEqual(recovered.pending, len(pending))
+        self.assertEqual({item.product_id: (item.seller_id, item.quantity) for item in recovered.items()},
+                         in_basket(unflushed))
+        recovered.flush()
+        self.assertEqual(self.database_lines(sql), in_basket(unflushed))
+        self.assertEqual(sql.select_named("basket_summary", sql_parameters=(self.basket_id,), fetch="one")[0],
+                         len(in_basket(unflushed)))
+        self.assertFalse(os.path.exists(self.journal()))
+        sql.close()
+
+    def test_journal_durability_replays_the_unflushed_lines(self) -> None:
+        self.check_replay("journal")
+
+    def test_fsync_durability_replays_the_unflushed_lines(self) -> None:
+        self.check_replay("fsync")
+
+    def test_memory_durability_keeps_what_was_flushed(self) -> None:
+        self.kill_mid_flush("memory")
+        self.assertFalse(os.path.exists(self.journal()))
+        sql = SqlWrapper(self.db_file)
+        recovered = BasketBuffer(sql, self.basket_id, "memory", flush_interval=None)
+        self.assertEqual(recovered.pending, 0)
+        self.assertEqual(self.database_lines(sql), in_basket(lines_after(self.flushed)))
+        sql.close()
+
+    def test_torn_line_is_ignored_and_later_changes_are_kept(self) -> None:
+        product_id, seller_id, quantity = self.flushed[0][1:]
+        sql = SqlWrapper(self.db_file)
+        item = BasketItem(product_id, seller_id, "Product", "Seller", quantity, 9.99)
+        os.makedirs(os.path.dirname(self.journal()), exist_ok=True)
+        with open(self.journal(), "w") as journal:
+            # A change that was acknowledged, then a write cut short by a crash
+            journal.write(journal_line(product_id, item) + '{"product_id": 1, "item": [1, ')
+
+        recovered = BasketBuffer(sql, self.basket_id, "journal", flush_interval=None)
+        self.assertEqual(recovered.pending, 1)
+        recovered.change_quantity(product_id, 7)
+        self.assertEqual(read_journal(self.journal()), {product_id: item._replace(quantity=7)})
+        recovered.flush()
+        self.assertEqual(self.database_lines(sql), {product_id: (seller_id, 7)})
+        sql.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
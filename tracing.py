@@ -0,0 +1,280 @@
+import copy
+import functools
+import json
+import logging
+import re
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from types import FrameType
+from typing import Any, Dict, Iterator, List, Literal, Optional, TextIO, Tuple
+
+"""
+Opt-in query instrumentation for SqlWrapper.
+
+A QueryTracer records, for every normalized SQL statement and the code that ran it, the number of calls, the total,
+mean and max time, the rows returned (or changed) and the errors. Queries slower than a threshold are logged as they
+happen. The stats can be exported as JSON lines or in the Prometheus text format, and a summary is written when the
+wrapper is closed.
+
+Each query is tagged with the method that ran it: the nearest ParanaShopperSession method on the call stack
+(e.g. "ParanaShopperSession.add_item"), otherwise the first caller outside the database layer (e.g. "ShopperService.add_item").
+sqlite3's trace callback and progress handler also count the SQLite statements each call ran (including trigger
+programs and implicit BEGINs) and approximately how many virtual machine instructions they took.
+
+Usage:
+sql = SqlWrapper(tracer=QueryTracer(slow_query_seconds=0.05, export_path="queries.prom", export_format="prometheus"))
+"""
+
+logger = logging.getLogger("parana.sql")
+slow_query_logger = logging.getLogger("parana.sql.slow")
+
+# Frames from these files are the database layer, never the code a query is tagged with
+DATABASE_LAYER_FILES = ("sql.py", "tracing.py", "queries.py", "catalog.py", "contextlib.py")
+MAX_TAG_DEPTH = 40
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"(?<![\w?])-?\d+(?:\.\d+)?\b")
+_WHITESPACE = re.compile(r"\s+")
+
+
+@functools.lru_cache(maxsize=1024)
+def normalize_sql(sql_query: str) -> str:
+    """
+    Replace literals with ? and collapse whitespace, so the same statement run with different values is counted once.
+    e.g. "SELECT * FROM products  WHERE product_id = 3000000" -> "SELECT * FROM products WHERE product_id = ?"
+    """
+    sql_query = _STRING_LITERAL.sub("?", sql_query)
+    sql_query = _NUMBER_LITERAL.sub("?", sql_query)
+    return _WHITESPACE.sub(" ", sql_query).strip()
+
+
+def _qualname(frame: FrameType) -> str:
+    """
+    Class.method for the frame's code. co_qualname is new in Python 3.11, before it the class comes from self.
+    """
+    code = frame.f_code
+    qualname = getattr(code, "co_qualname", None)
+    if qualname is not None:
+        return qualname
+    instance = frame.f_locals.get("self") if code.co_argcount else None
+    return f"{type(instance).__name__}.{code.co_name}" if instance is not None else code.co_name
+
+
+class Trace:
+    """
+    The outcome of one traced call, filled in by the caller while the call runs
+    """
+    __slots__ = ("rows", "error")
+
+    def __init__(self) -> None:
+        self.rows = 0
+        self.error = False
+
+
+class QueryStats:
+    """
+    The totals for one normalized statement run by one tag
+    """
+    __slots__ = ("sql", "name", "tag", "calls", "total_seconds", "max_seconds", "rows", "errors", "statements", "vm_steps")
+
+    def __init__(self, sql_query: str, name: Optional[str], tag: str) -> None:
+        self.sql = sql_query
+        self.name = name
+        self.tag = tag
+        self.calls = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.rows = 0
+        self.errors = 0
+        self.statements = 0
+        self.vm_steps = 0
+
+    @property
+    def mean_seconds(self) -> float:
+        return self.total_seconds / self.calls if self.calls else 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"sql": self.sql, "name": self.name, "tag": self.tag, "calls": self.calls,
+                "total_seconds": self.total_seconds, "mean_seconds": self.mean_seconds, "max_seconds": self.max_seconds,
+                "rows": self.rows, "errors": self.errors, "statements": self.statements, "vm_steps": self.vm_steps}
+
+
+class QueryTracer:
+    """
+    Records per statement timings for one or more SqlWrappers, safe to share between threads
+    """
+
+    def __init__(self, slow_query_seconds: Optional[float] = 0.1, tag_classes: Tuple[str, ...] = ("ParanaShopperSession",),
+                 progress_steps: int = 1000, export_path: Optional[str] = None,
+                 export_format: Literal["jsonl", "prometheus"] = "jsonl", summary_size: int = 10) -> None:
+        """
+        Args:
+            slow_query_seconds: Log queries that take at least this long to the parana.sql.slow logger, None to turn off
+            tag_classes: Queries are tagged with the nearest method of these classes on the call stack
+            progress_steps: Count virtual machine instructions in steps of this size with the progress handler, 0 to turn off
+            export_path: Write the stats to this file on dump()
+            export_format: "jsonl" (one JSON object per statement and tag) or "prometheus" (text exposition format)
+            summary_size: The number of statements in the summary, slowest total time first
+        """
+        if export_format not in ("jsonl", "prometheus"):
+            raise ValueError(f"Unknown export format '{export_format}'")
+        self.slow_query_seconds = slow_query_seconds
+        self.tag_classes = frozenset(tag_classes)
+        self.progress_steps = progress_steps
+        self.export_path = export_path
+        self.export_format = export_format
+        self.summary_size = summary_size
+        self._stats: Dict[Tuple[str, str], QueryStats] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def attach(self, db: sqlite3.Connection) -> None:
+        """
+        Install the trace callback and progress handler on a connection, once
+        """
+        if getattr(db, "tracer", None) is self:
+            return
+        db.set_trace_callback(self._on_statement)
+        if self.progress_steps:
+            db.set_progress_handler(self._on_progress, self.progress_steps)
+        db.tracer = self
+
+    def _counters(self) -> threading.local:
+        local = self._local
+        if not hasattr(local, "statements"):
+            local.statements = 0
+            local.steps = 0
+        return local
+
+    def _on_statement(self, statement: str) -> None:
+        self._counters().statements += 1
+
+    def _on_progress(self) -> int:
+        self._counters().steps += self.progress_steps
+        return 0  # Carry on running the statement
+
+    def caller_tag(self) -> str:
+        """
+        The method a query is being run for, see the module docstring
+        """
+        frame = sys._getframe(1)
+        fallback = None
+        for _ in range(MAX_TAG_DEPTH):
+            if frame is None:
+                break
+            code = frame.f_code
+            qualname = _qualname(frame)
+            if qualname.split(".", 1)[0] in self.tag_classes:
+                return qualname
+            if fallback is None and not code.co_filename.endswith(DATABASE_LAYER_FILES):
+                fallback = qualname if frame.f_globals.get("__name__") == "__main__" else f"{frame.f_globals.get('__name__')}.{qualname}"
+            frame = frame.f_back
+        return fallback or "unknown"
+
+    @contextmanager
+    def trace(self, db: sqlite3.Connection, sql_query: str, query_name: Optional[str] = None) -> Iterator[Trace]:
+        """
+        Time the with block as one call of sql_query. The block sets rows (and error if it handles an error itself).
+        """
+        self.attach(db)
+        counters = self._counters()
+        statements, steps = counters.statements, counters.steps
+        tag = self.caller_tag()
+        trace = Trace()
+        start = time.perf_counter()
+        try:
+            yield trace
+        except BaseException:
+            trace.error = True
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            self.record(sql_query, query_name, tag, seconds, trace.rows, trace.error,
+                        counters.statements - statements, counters.steps - steps)
+
+    def record(self, sql_query: str, query_name: Optional[str], tag: str, seconds: float, rows: int = 0,
+               error: bool = False, statements: int = 0, vm_steps: int = 0) -> None:
+        normalized = normalize_sql(sql_query)
+        with self._lock:
+            stats = self._stats.get((normalized, tag))
+            if stats is None:
+                stats = self._stats[(normalized, tag)] = QueryStats(normalized, query_name, tag)
+            stats.calls += 1
+            stats.total_seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+            stats.rows += max(rows, 0)
+            stats.errors += error
+            stats.statements += statements
+            stats.vm_steps += vm_steps
+        if self.slow_query_seconds is not None and seconds >= self.slow_query_seconds:
+            slow_query_logger.warning("Slow query (%.1fms, %s rows, from %s): %s", seconds * 1000, rows, tag,
+                                      query_name or normalized)
+
+    def stats(self) -> List[QueryStats]:
+        """
+        Return a copy of the stats, slowest total time first
+        """
+        with self._lock:
+            stats = [copy.copy(query_stats) for query_stats in self._stats.values()]
+        return sorted(stats, key=lambda s: s.total_seconds, reverse=True)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats.clear()
+
+    def export_json_lines(self, file: TextIO) -> None:
+        for stats in self.stats():
+            file.write(json.dumps(stats.as_dict()) + "\n")
+
+    def export_prometheus(self, file: TextIO) -> None:
+        metrics = (("parana_sql_calls_total", "counter", "Queries run", "calls"),
+                   ("parana_sql_errors_total", "counter", "Queries that raised a database error", "errors"),
+                   ("parana_sql_rows_total", "counter", "Rows returned or changed", "rows"),
+                   ("parana_sql_seconds_total", "counter", "Time spent running queries", "total_seconds"),
+                   ("parana_sql_seconds_max", "gauge", "Slowest run of a query", "max_seconds"),
+                   ("parana_sql_statements_total", "counter", "SQLite statements run, including triggers", "statements"),
+                   ("parana_sql_vm_steps_total", "counter", "Approximate SQLite virtual machine instructions", "vm_steps"))
+        stats = self.stats()
+        for metric, metric_type, description, field in metrics:
+            file.write(f"# HELP {metric} {description}\n# TYPE {metric} {metric_type}\n")
+            for query_stats in stats:
+                labels = ",".join(f'{label}="{self._escape_label(value)}"' for label, value in
+                                  (("query", query_stats.name or query_stats.sql), ("tag", query_stats.tag)))
+                file.write(f"{metric}{{{labels}}} {getattr(query_stats, field)}\n")
+
+    @staticmethod
+    def _escape_label(value: str) -> str:
+        return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+    def export(self, path: str, export_format: Literal["jsonl", "prometheus"] = None) -> None:
+        """
+        Write the stats to a file, in export_format (or the format the tracer was created with)
+        """
+        with open(path, "w") as file:
+            if (export_format or self.export_format) == "prometheus":
+                self.export_prometheus(file)
+            else:
+                self.export_json_lines(file)
+
+    def summary(self) -> str:
+        """
+        A table of the summary_size statements with the most total time
+        """
+        lines = [f"{'Calls':>8}{'Total ms':>11}{'Mean ms':>10}{'Max ms':>10}{'Rows':>9}{'Errors':>8}  Tag / query"]
+        for stats in self.stats()[:self.summary_size]:
+            lines.append(f"{stats.calls:>8}{stats.total_seconds * 1000:>11.2f}{stats.mean_seconds * 1000:>10.3f}"
+                         f"{stats.max_seconds * 1000:>10.3f}{stats.rows:>9}{stats.errors:>8}  {stats.tag}: {stats.name or stats.sql[:80]}")
+        return "\n".join(lines)
+
+    def dump(self) -> None:
+        """
+        Log the summary and write the export file, if there is one. Called when a traced SqlWrapper is closed.
+        """
+        if not self._stats:
+            return
+        logger.info("Query summary:\n%s", self.summary())
+        if self.export_path is not None:
+            self.export(self.export_path)